@@ -0,0 +1,102 @@
+# Latency of CRUD reads under concurrent load, blocking PyMySQL session vs asyncio session
+#
+#   python -m app.bench --concurrency 50 --requests 2000
+#
+# Each request runs the manga list query and serializes the page, like crud.manga.get_list.
+# A ticker coroutine measures how long the event loop was stalled, that is the latency
+# every other request on the same uvicorn worker would get on top of its own.
+import time
+import asyncio
+import argparse
+import orjson
+from typing import List, Callable, Awaitable
+from sqlalchemy import select
+
+from app import models
+from app import schemas
+from app.db import DB, ADB
+
+
+def list_query():
+    return select( models.Manga ).order_by( models.Manga.name.asc() ).limit( 50 )
+
+
+async def sync_request() -> bytes:
+    # how every crud read worked before: blocking session inside async def
+    session = DB()
+    mangas = session.execute( list_query() ).scalars().all()
+    result = orjson.dumps([ schemas.Manga.model_validate( manga ).model_dump() for manga in mangas ])
+    session.close()
+    return result
+
+
+async def async_request() -> bytes:
+    session = ADB()
+    mangas = ( await session.execute( list_query() ) ).scalars().all()
+    result = await session.run_sync( lambda _: orjson.dumps([ schemas.Manga.model_validate( manga ).model_dump() for manga in mangas ]) )
+    await session.close()
+    return result
+
+
+def percentile(
+    values: List[ float ],
+    p: float
+) -> float:
+    if not values:
+        return 0
+    values = sorted( values )
+    return values[ min( len( values ) - 1, int( len( values ) * p ) ) ]
+
+
+async def run(
+    request: Callable[ [], Awaitable[ bytes ] ],
+    concurrency: int,
+    requests: int
+) -> None:
+    latencies: List[ float ] = []
+    lags: List[ float ] = []
+    left = requests
+    finished = False
+
+    async def ticker() -> None:
+        while not finished:
+            start = time.perf_counter()
+            await asyncio.sleep( 0.005 )
+            lags.append( time.perf_counter() - start - 0.005 )
+
+    async def client() -> None:
+        nonlocal left
+        while left > 0:
+            left -= 1
+            start = time.perf_counter()
+            await request()
+            latencies.append( time.perf_counter() - start )
+
+    tick = asyncio.create_task( ticker() )
+    start = time.perf_counter()
+    await asyncio.gather( *[ client() for _ in range( concurrency ) ] )
+    total = time.perf_counter() - start
+    finished = True
+    await tick
+
+    print(f"{request.__name__}: {requests} requests, concurrency {concurrency}, {requests / total:.1f} rps")
+    print(f"\tlatency p50 {percentile( latencies, 0.5 ) * 1000:.1f}ms, p99 {percentile( latencies, 0.99 ) * 1000:.1f}ms, max {max( latencies ) * 1000:.1f}ms")
+    print(f"\tloop stall p99 {percentile( lags, 0.99 ) * 1000:.1f}ms, max {max( lags or [ 0 ] ) * 1000:.1f}ms")
+
+
+async def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument( '--concurrency', type=int, default=50 )
+    parser.add_argument( '--requests', type=int, default=2000 )
+    args = parser.parse_args()
+
+    # warm up both pools
+    await sync_request()
+    await async_request()
+
+    await run( sync_request, args.concurrency, args.requests )
+    await run( async_request, args.concurrency, args.requests )
+
+
+if __name__ == '__main__':
+    asyncio.run( main() )
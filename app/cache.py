@@ -0,0 +1,395 @@
+import os
+import sys
+import math
+import time
+import random
+import asyncio
+import gzip
+import orjson
+import brotli
+from collections import OrderedDict
+from typing import Self, Tuple, Dict, Any, Callable, Awaitable
+
+from app.db import RD, RDB
+from app.tools import calculate_hash
+
+CACHE_KEYS = {
+    'version': 'catalog-version-{}',
+    'stale': '{}-stale',
+    'delta': '{}-delta',
+    'lock': '{}-lock',
+    # catalog changes are announced here, payload is media name
+    'channel': 'catalog-changes',
+    # slugs saved by scanners since last warm up
+    'changed': 'catalog-changed-{}',
+    # same value compressed once on write, key and content coding
+    'encoded': '{}-encoded-{}',
+}
+
+# pages of old catalog versions are never read again, let them expire
+LIST_TTL = 86400
+SINGLE_TTL = 3600
+# reader is rewritten by warmer on every scan change, ttl only bounds writes it does not see
+READER_TTL = 86400
+
+# stale copy outlives the value, so it can be served while one worker rebuilds
+STALE_TTL = 86400
+# rebuild must finish before the lock is taken over by someone else
+LOCK_TTL = 30
+LOCK_WAIT = 3
+LOCK_POLL = 0.05
+RELEASE_LOCK_SCRIPT = "if redis.call('get',KEYS[1])==ARGV[1] then return redis.call('del',KEYS[1]) end return 0"
+# XFetch beta, > 1 favors earlier refresh
+EARLY_REFRESH_BETA = 1.0
+
+# per worker memory tier in front of redis
+LOCAL_CACHE_BYTES = int( os.environ.get( 'LOCAL_CACHE_BYTES', 64 * 1024 * 1024 ) )
+LOCAL_CACHE_TTL = 300
+
+# only scans of these catalogs bump versions, per worker indexes of the rest reload by age
+SCANNED_MEDIA = ( 'manga', 'anime' )
+INDEX_MAX_AGE = 600
+
+# content codings stored next to every value, in order of preference
+CACHE_ENCODINGS = ( 'br', 'gzip' )
+# below that compression gains less than a header costs
+ENCODE_MIN_BYTES = 1024
+BROTLI_QUALITY = 9
+GZIP_LEVEL = 9
+
+Builder = Callable[ [], Awaitable[ str | bytes | None ] ]
+
+# keeps background refreshes referenced until they finish
+refreshes: set[ asyncio.Task ] = set()
+
+
+class LocalCache:
+
+    max_bytes: int
+    size: int
+    # key -> ( expires, size, value ), oldest first
+    entries: OrderedDict[ str, Tuple[ float, int, str | bytes ] ]
+
+    def __init__(
+        self: Self,
+        max_bytes: int = LOCAL_CACHE_BYTES
+    ) -> None:
+        self.max_bytes = max_bytes
+        self.size = 0
+        self.entries = OrderedDict()
+
+
+    def get(
+        self: Self,
+        key: str
+    ) -> str | bytes | None:
+        entry = self.entries.get( key )
+        if entry is None:
+            return None
+        if entry[0] < time.monotonic():
+            self.delete( key )
+            return None
+        self.entries.move_to_end( key )
+        return entry[2]
+
+
+    def set(
+        self: Self,
+        key: str,
+        value: str | bytes,
+        ttl: float = LOCAL_CACHE_TTL
+    ) -> None:
+        size = sys.getsizeof( value )
+        # a few huge payloads must not wipe out all hot ones
+        if size > self.max_bytes // 8 or ttl <= 0:
+            return
+        self.delete( key )
+        self.entries[ key ] = ( time.monotonic() + ttl, size, value )
+        self.size += size
+        while self.size > self.max_bytes:
+            _, ( _, evicted, _ ) = self.entries.popitem( last=False )
+            self.size -= evicted
+
+
+    def delete(
+        self: Self,
+        key: str
+    ) -> None:
+        entry = self.entries.pop( key, None )
+        if entry is not None:
+            self.size -= entry[1]
+
+
+    def invalidate(
+        self: Self,
+        prefixes: Tuple[ str, ... ] = ()
+    ) -> None:
+        if not prefixes:
+            self.entries.clear()
+            self.size = 0
+            return
+        for key in [ x for x in self.entries.keys() if x.startswith( prefixes ) ]:
+            self.delete( key )
+
+
+local_cache = LocalCache()
+
+
+class EncodedPayload( bytes ):
+    # compressed cache value, PJSONResponse sends it with Content-Encoding
+    encoding: str
+
+    def __new__(
+        cls,
+        value: bytes,
+        encoding: str
+    ) -> Self:
+        payload = super().__new__( cls, value )
+        payload.encoding = encoding
+        return payload
+
+
+def encode_payloads(
+    value: str | bytes
+) -> Dict[ str, bytes ]:
+    raw = value.encode() if isinstance( value, str ) else value
+    if len( raw ) < ENCODE_MIN_BYTES:
+        return {}
+    return {
+        'br': brotli.compress( raw, quality=BROTLI_QUALITY ),
+        'gzip': gzip.compress( raw, GZIP_LEVEL ),
+    }
+
+
+def normalize_filters(
+    filters: Dict[ str, Any ]
+) -> Dict[ str, Any ]:
+    # same filter set must produce same key regardless of order and duplicates
+    result = {}
+    for key in sorted( filters.keys() ):
+        value = filters[ key ]
+        if isinstance( value, ( list, tuple, set ) ):
+            value = sorted( set( [ str( x ) for x in value ] ) )
+            if not value:
+                continue
+        elif isinstance( value, dict ):
+            value = normalize_filters( value )
+        else:
+            value = ' '.join( str( value ).split() ).casefold()
+            if value == '':
+                continue
+        result[ key ] = value
+    return result
+
+
+async def get_catalog_version(
+    media: str
+) -> int:
+    version = await RD.get( CACHE_KEYS['version'].format( media ) )
+    return int( version or 0 )
+
+
+def index_expired(
+    media: str,
+    loaded: float
+) -> bool:
+    return media not in SCANNED_MEDIA and time.monotonic() - loaded > INDEX_MAX_AGE
+
+
+def catalog_prefixes(
+    media: str
+) -> Tuple[ str, ... ]:
+    # notifications are produced by the same scans
+    return ( f'{media}-', 'last_notifications' )
+
+
+async def listen_invalidations() -> None:
+    # every worker drops its memory tier when any worker or scanner announces a change
+    while True:
+        try:
+            pubsub = RD.pubsub()
+            await pubsub.subscribe( CACHE_KEYS['channel'] )
+            # changes published while disconnected are lost
+            local_cache.invalidate()
+            async for message in pubsub.listen():
+                if message['type'] == 'message':
+                    local_cache.invalidate( catalog_prefixes( message['data'] ) )
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            print(f"Cache invalidation listener error: {e}")
+            local_cache.invalidate()
+            await asyncio.sleep( 1 )
+
+
+async def list_cache_key(
+    prefix: str,
+    media: str,
+    offset: int,
+    limit: int,
+    filters: Dict[ str, Any ]
+) -> str:
+    version = await get_catalog_version( media )
+    filters_hash = calculate_hash( orjson.dumps( normalize_filters( filters ) ) )
+    return f'{prefix}-{version}-{offset}-{limit}-{filters_hash}'
+
+
+async def single_flight(
+    key: str,
+    build: Builder,
+    ttl: int | None = 3600,
+    encoding: str | None = None
+) -> str | bytes | None:
+    # one builder per key across all workers, the rest get stale value or wait for fresh one;
+    # with encoding, compressed copy is returned when value was big enough to get one
+    encoded_key = CACHE_KEYS['encoded'].format( key, encoding ) if encoding else None
+
+    if encoded_key:
+        encoded = local_cache.get( encoded_key )
+        if encoded is not None:
+            return EncodedPayload( encoded, encoding )
+    else:
+        # plain copy may sit in memory while redis already has compressed one,
+        # so clients accepting a coding always look there
+        value = local_cache.get( key )
+        if value is not None:
+            return value
+
+    pipe = ( RDB if encoded_key else RD ).pipeline( transaction=False )
+    pipe.get( key )
+    pipe.pttl( key )
+    pipe.get( CACHE_KEYS['delta'].format( key ) )
+    if encoded_key:
+        pipe.get( encoded_key )
+    value, pttl, delta, *encoded = await pipe.execute()
+
+    if value is not None:
+        # memory copy must not outlive redis one
+        local_ttl = min( LOCAL_CACHE_TTL, pttl / 1000 ) if pttl > 0 else LOCAL_CACHE_TTL
+        if encoded and encoded[0] is not None:
+            local_cache.set( encoded_key, encoded[0], local_ttl )
+            value = EncodedPayload( encoded[0], encoding )
+        else:
+            local_cache.set( key, value, local_ttl )
+        # probabilistic early refresh (XFetch): the closer to expiry and the slower
+        # the build, the more likely one request refreshes it ahead of time
+        if ttl and delta and pttl > 0:
+            if -float( delta ) * EARLY_REFRESH_BETA * math.log( random.random() or 1e-12 ) * 1000 >= pttl:
+                task = asyncio.create_task( refresh( key, build, ttl ) )
+                refreshes.add( task )
+                task.add_done_callback( refreshes.discard )
+        return value
+
+    token = await acquire_lock( key )
+    if token:
+        return await rebuild( key, build, ttl, token )
+
+    stale = await RD.get( CACHE_KEYS['stale'].format( key ) )
+    if stale is not None:
+        return stale
+
+    # nothing to serve yet, wait for the builder
+    deadline = time.monotonic() + LOCK_WAIT
+    while time.monotonic() < deadline:
+        await asyncio.sleep( LOCK_POLL )
+        value = await RD.get( key )
+        if value is not None:
+            return value
+
+    return await build()
+
+
+async def refresh(
+    key: str,
+    build: Builder,
+    ttl: int | None
+) -> None:
+    token = await acquire_lock( key )
+    if not token:
+        return
+    try:
+        await rebuild( key, build, ttl, token )
+    except Exception as e:
+        print(f"Cache refresh of {key} failed: {e}")
+
+
+async def rebuild(
+    key: str,
+    build: Builder,
+    ttl: int | None,
+    token: str
+) -> str | bytes | None:
+    try:
+        start = time.perf_counter()
+        value = await build()
+        delta = time.perf_counter() - start
+
+        if value is not None:
+            await store( key, value, ttl, delta )
+
+        return value
+    finally:
+        await release_lock( key, token )
+
+
+async def warm(
+    key: str,
+    build: Builder,
+    ttl: int | None
+) -> str | bytes | None:
+    # unconditional rebuild, data is known to be changed
+    start = time.perf_counter()
+    value = await build()
+    if value is not None:
+        await store( key, value, ttl, time.perf_counter() - start )
+    else:
+        await RD.delete(
+            key,
+            CACHE_KEYS['stale'].format( key ),
+            CACHE_KEYS['delta'].format( key ),
+            *[ CACHE_KEYS['encoded'].format( key, x ) for x in CACHE_ENCODINGS ]
+        )
+    return value
+
+
+async def store(
+    key: str,
+    value: str | bytes,
+    ttl: int | None,
+    delta: float
+) -> None:
+    # compressed once here, hits are served without per request compression
+    encoded = await asyncio.to_thread( encode_payloads, value )
+    local_ttl = min( LOCAL_CACHE_TTL, ttl ) if ttl else LOCAL_CACHE_TTL
+    local_cache.set( key, value, local_ttl )
+    pipe = RD.pipeline( transaction=False )
+    pipe.set( key, value, ttl )
+    pipe.set( CACHE_KEYS['stale'].format( key ), value, STALE_TTL if ttl else None )
+    pipe.set( CACHE_KEYS['delta'].format( key ), delta, STALE_TTL if ttl else None )
+    for encoding in CACHE_ENCODINGS:
+        encoded_key = CACHE_KEYS['encoded'].format( key, encoding )
+        if encoding in encoded:
+            local_cache.set( encoded_key, encoded[ encoding ], local_ttl )
+            pipe.set( encoded_key, encoded[ encoding ], ttl )
+        else:
+            # value shrank below threshold, old compressed copy must not be served
+            local_cache.delete( encoded_key )
+            pipe.delete( encoded_key )
+    await pipe.execute()
+
+
+async def acquire_lock(
+    key: str
+) -> str | None:
+    token = f'{os.getpid()}-{random.getrandbits( 64 )}'
+    if await RD.set( CACHE_KEYS['lock'].format( key ), token, nx=True, ex=LOCK_TTL ):
+        return token
+    return None
+
+
+async def release_lock(
+    key: str,
+    token: str
+) -> None:
+    # compare and delete in one step, lock may expire and be taken by other worker in between
+    await RD.eval( RELEASE_LOCK_SCRIPT, 1, CACHE_KEYS['lock'].format( key ), token )
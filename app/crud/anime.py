@@ -9,9 +9,12 @@ from urllib import parse
 from typing import Dict, List, Any
 from app import models
 from app import schemas
-from app.db import DB
+from app.db import ADB
 from app.db import RD
-from app.tools import calculate_hash
+from app.cache import list_cache_key, single_flight, LIST_TTL, SINGLE_TTL
+from app.tools import calculate_hash, encode_cursor, decode_cursor
+from app.crud.fulltext import fulltext_candidates
+from app.facets import facet_counts, has_facets, get_facet_index
 
 ANIME_CACHE_KEYS = {
     'list': 'anime-list',
@@ -24,15 +27,14 @@ skip_es_indexing = re.compile("(Season|Сезон) \d+")
 
 
 async def search(
-    search: str
+    search: str,
+    limit: int | None = None
 ) -> List[ schemas.SearchResult ]:
 
     results = []
 
     terms = search.split(' ')
     
-    session = DB()
-
     # 
     
     cases = []
@@ -73,95 +75,128 @@ async def search(
             desc("relevance")
         )
 
+    # relevance is still computed by CASE, but only over rows found by fulltext index
+    candidates = fulltext_candidates( models.Anime, terms )
+    if candidates is not None:
+        anime_query = anime_query\
+            .filter(
+                candidates
+            )
+
+    if limit:
+        anime_query = anime_query\
+            .limit(
+                limit
+            )
+
     # print('#'*20)
     # print( anime_query.compile(compile_kwargs={"literal_binds": True}) )
     # print('#'*20)
 
-    animes: List[ models.Anime ] = session.execute( anime_query ).scalars().all()
-
-    if len(animes) > 0:
-        for anime in animes:
-            result = schemas.SearchResult()
-            result.type = 'anime'
-            result.name = anime.name
-            result.eng_name = anime.eng_name
-            result.slug = anime.slug
-            if anime.cover:
-                result.cover = anime.cover.cover_link_mini if anime.cover.cover_link_mini != '' else anime.cover.cover_link_full
-            elif anime.all_covers:
-                result.cover = anime.all_covers[0].cover_link_mini if anime.all_covers[0].cover_link_mini != '' else anime.all_covers[0].cover_link_full
-            results.append( result.model_dump() )
-
-    session.close()
+    # backend can be cancelled by search timeout, connection must go back anyway
+    session = ADB()
+    try:
+        animes: List[ models.Anime ] = ( await session.execute( anime_query ) ).scalars().all()
+
+        # relationships are loaded lazily, that needs sync session context
+        def collect( _ ) -> None:
+            if len(animes) > 0:
+                for anime in animes:
+                    result = schemas.SearchResult()
+                    result.type = 'anime'
+                    result.name = anime.name
+                    result.eng_name = anime.eng_name
+                    result.slug = anime.slug
+                    if anime.cover:
+                        result.cover = anime.cover.cover_link_mini if anime.cover.cover_link_mini != '' else anime.cover.cover_link_full
+                    elif anime.all_covers:
+                        result.cover = anime.all_covers[0].cover_link_mini if anime.all_covers[0].cover_link_mini != '' else anime.all_covers[0].cover_link_full
+                    results.append( result.model_dump() )
+
+        await session.run_sync( collect )
+    finally:
+        await session.close()
 
     return results
 
 
-async def get_filters():
+async def get_filters(
+    selection: Dict[ str, Any ] = {}
+) -> str | bytes:
     cache_key = ANIME_CACHE_KEYS['filters']
-    result = await RD.get( cache_key )
+    result = await single_flight( cache_key, build_filters, None )
 
-    if not result:
+    if not has_facets( 'anime', selection ):
+        return result or '{}'
 
-        session = DB()
+    # lists are shared, counts follow current selection and are never cached
+    filters = orjson.loads( result or '{}' )
+    filters['counts'] = await facet_counts( 'anime', selection )
 
-        studios_query =\
-            select(
-                models.Studio
-            )\
-            .join(
-                models.StudiosToAnime, models.StudiosToAnime.c.studio_id==models.Studio.id
-            )\
-            .group_by(
-                models.StudiosToAnime.c.studio_id
-            )\
-            .order_by(
-                models.Studio.name.asc()
-            )
+    return orjson.dumps( filters )
 
-        voices_query =\
-            select(
-                models.Voice
-            )\
-            .join(
-                models.VoicesToAnime, models.VoicesToAnime.c.voice_id==models.Voice.id
-            )\
-            .group_by(
-                models.VoicesToAnime.c.voice_id
-            )\
-            .order_by(
-                models.Voice.name.asc()
-            )
 
-        genres_query =\
-            select(
-                models.Genre
-            )\
-            .join(
-                models.GenresToAnime, models.GenresToAnime.c.genre_id==models.Genre.id
-            )\
-            .group_by(
-                models.GenresToAnime.c.genre_id
-            )\
-            .order_by(
-                models.Genre.name.asc()
-            )
+async def build_filters() -> str | bytes | None:
+
+    result = None
+
+    session = ADB()
+
+    studios_query =\
+        select(
+            models.Studio
+        )\
+        .join(
+            models.StudiosToAnime, models.StudiosToAnime.c.studio_id==models.Studio.id
+        )\
+        .group_by(
+            models.StudiosToAnime.c.studio_id
+        )\
+        .order_by(
+            models.Studio.name.asc()
+        )
 
-        studios = session.execute( studios_query ).scalars().all()
-        voices = session.execute( voices_query ).scalars().all()
-        genres = session.execute( genres_query ).scalars().all()
+    voices_query =\
+        select(
+            models.Voice
+        )\
+        .join(
+            models.VoicesToAnime, models.VoicesToAnime.c.voice_id==models.Voice.id
+        )\
+        .group_by(
+            models.VoicesToAnime.c.voice_id
+        )\
+        .order_by(
+            models.Voice.name.asc()
+        )
 
-        filters = {
-            'studios': [ schemas.ShortData.model_validate( studio ).model_dump() for studio in studios ],
-            'voices': [ schemas.ShortData.model_validate( voice ).model_dump() for voice in voices ],
-            'genres': [ schemas.ShortData.model_validate( genre ).model_dump() for genre in genres ],
-        }
+    genres_query =\
+        select(
+            models.Genre
+        )\
+        .join(
+            models.GenresToAnime, models.GenresToAnime.c.genre_id==models.Genre.id
+        )\
+        .group_by(
+            models.GenresToAnime.c.genre_id
+        )\
+        .order_by(
+            models.Genre.name.asc()
+        )
 
-        result = orjson.dumps( filters )
+    studios = ( await session.execute( studios_query ) ).scalars().all()
+    voices = ( await session.execute( voices_query ) ).scalars().all()
+    genres = ( await session.execute( genres_query ) ).scalars().all()
 
-        await RD.set( cache_key, result )
+    filters = {
+        'studios': [ schemas.ShortData.model_validate( studio ).model_dump() for studio in studios ],
+        'voices': [ schemas.ShortData.model_validate( voice ).model_dump() for voice in voices ],
+        'genres': [ schemas.ShortData.model_validate( genre ).model_dump() for genre in genres ],
+    }
 
-        session.close()
+    result = orjson.dumps( filters )
+
+    await session.close()
 
     return result
 
@@ -169,33 +204,40 @@ async def get_filters():
 async def get_list(
     offset: int = 0,
     limit: int = 50,
-    filters: Dict[ str, int ] = {}
+    filters: Dict[ str, int ] = {},
+    cursor: str | None = None
 ) -> List[ schemas.Anime ]:
 
-    session = DB()
+    # cursor mode returns { items, next }, offset mode keeps plain list for old clients
+    if cursor is not None:
+        position = decode_cursor( cursor )
+        cache_filters = { **filters, 'cursor': cursor }
+    else:
+        position = None
+        cache_filters = filters
 
-    animes_query = select( models.Anime )
+    cache_key = await list_cache_key( ANIME_CACHE_KEYS['list'], 'anime', offset, limit, cache_filters )
+    result = await RD.get( cache_key )
 
-    if 'studios' in filters:
-        animes_query = animes_query\
-            .join( models.StudiosToAnime, models.StudiosToAnime.c.anime_id==models.Anime.id )\
-            .filter(
-                models.StudiosToAnime.c.studio_id.in_( map( int, filters['studios'] ) )
-            )
+    if result:
+        return result
 
-    if 'voices' in filters:
-        animes_query = animes_query\
-            .join( models.VoicesToAnime, models.VoicesToAnime.c.anime_id==models.Anime.id )\
-            .filter(
-                models.VoicesToAnime.c.voice_id.in_( map( int, filters['voices'] ) )
-            )
+    session = ADB()
 
-    if 'genres' in filters:
-        animes_query = animes_query\
-            .join( models.GenresToAnime, models.GenresToAnime.c.anime_id==models.Anime.id )\
-            .filter(
-                models.GenresToAnime.c.genre_id.in_( map( int, filters['genres'] ) )
-            )
+    animes_query = select( models.Anime )
+
+    # facets are resolved from in-memory bitmaps, without joining relation tables
+    page_ids = None
+    if has_facets( 'anime', filters ):
+        index = await get_facet_index( 'anime' )
+        matched = index.match( filters )
+        if 'search' not in filters:
+            page_ids = index.page( matched, offset, limit, position )
+        if page_ids is None:
+            animes_query = animes_query\
+                .filter(
+                    models.Anime.id.in_( index.ids( matched ) )
+                )
 
     if 'search' in filters:
         terms = str( filters[ 'search' ] ).split(' ')
@@ -230,90 +272,154 @@ async def get_list(
                 desc("relevance")
             )
 
+        candidates = fulltext_candidates( models.Anime, terms )
+        if candidates is not None:
+            animes_query = animes_query\
+                .filter(
+                    candidates
+                )
+
+    if page_ids is not None:
+        # page is already cut from the index, only its rows are read
+        animes_query = animes_query\
+            .filter(
+                models.Anime.id.in_( page_ids )
+            )
+    elif position is None:
+        animes_query = animes_query\
+            .offset(
+                offset
+            )
+    elif 'search' in filters:
+        # relevance is computed per request, so search pages are still counted by rows
+        animes_query = animes_query\
+            .offset(
+                int( position.get( 'o', 0 ) )
+            )
+    elif 'n' in position and 'i' in position:
+        # keyset, next page starts right after last seen ( name, id )
+        animes_query = animes_query\
+            .filter(
+                or_(
+                    models.Anime.name > position['n'],
+                    and_(
+                        models.Anime.name == position['n'],
+                        models.Anime.id > int( position['i'] )
+                    )
+                )
+            )
+
     animes_query = animes_query\
-        .offset(
-            offset
-        )\
         .limit(
-            limit
+            limit if position is None else limit + 1
         )\
         .group_by(
             models.Anime.id
         )\
         .order_by(
-            models.Anime.name.asc()
+            models.Anime.name.asc(),
+            models.Anime.id.asc()
         )
 
-    animes = session.execute( animes_query ).scalars().all()
-
-    result = orjson.dumps([ schemas.Anime.model_validate( anime ).model_dump() for anime in animes ])
-
-    session.close()
+    animes = ( await session.execute( animes_query ) ).scalars().all()
+
+    if position is None:
+        result = await session.run_sync( lambda _: orjson.dumps([ schemas.Anime.model_validate( anime ).model_dump() for anime in animes ]) )
+    else:
+        # relevance filtered pages can not be counted from facet bitmaps
+        facets = None if 'search' in filters else await facet_counts( 'anime', filters )
+        next_cursor = None
+        if len( animes ) > limit:
+            animes = animes[:limit]
+            if 'search' in filters:
+                next_cursor = encode_cursor( { 'o': int( position.get( 'o', 0 ) ) + limit } )
+            else:
+                next_cursor = encode_cursor( { 'n': animes[-1].name, 'i': animes[-1].id } )
+        result = await session.run_sync( lambda _: orjson.dumps({
+            'items': [ schemas.Anime.model_validate( anime ).model_dump() for anime in animes ],
+            'next': next_cursor,
+            'facets': facets,
+        }) )
+
+    await session.close()
+
+    await RD.set( cache_key, result, LIST_TTL )
 
     return result
 
 
 async def get_single(
-    anime_slug: str
-) -> str:
+    anime_slug: str,
+    encoding: str | None = None
+) -> str | bytes:
 
     cache_key = ANIME_CACHE_KEYS['single'].format( anime_slug )
-    result = await RD.get( cache_key )
+    result = await single_flight( cache_key, lambda: build_single( anime_slug ), SINGLE_TTL, encoding )
 
-    if not result:
+    return result or '{}'
 
-        session = DB()
-        anime = session.execute( 
-            select(
-                models.Anime
-            )\
-            .where(
-                models.Anime.slug==anime_slug
-            )
-        ).scalars().one_or_none()
 
-        if anime:
-            result = schemas.AnimeFull.model_validate( anime ).model_dump_json()
-            await RD.set( cache_key, result, 3600 )
-        else:
-            result = '{}'
+async def build_single(
+    anime_slug: str
+) -> str | bytes | None:
 
-        session.close()
+    result = None
+
+    session = ADB()
+    anime = ( await session.execute(
+        select(
+            models.Anime
+        )\
+        .where(
+            models.Anime.slug==anime_slug
+        )
+    ) ).scalars().one_or_none()
+
+    if anime:
+        result = await session.run_sync( lambda _: schemas.AnimeFull.model_validate( anime ).model_dump_json() )
+
+    await session.close()
 
     return result
 
 
 async def get_season(
     anime_slug: str,
-    season_slug: str
-) -> str:
+    season_slug: str,
+    encoding: str | None = None
+) -> str | bytes:
 
     cache_key = ANIME_CACHE_KEYS['season'].format( anime_slug, season_slug )
-    result = await RD.get( cache_key )
+    result = await single_flight( cache_key, lambda: build_season( anime_slug, season_slug ), None, encoding )
 
-    if not result:
+    return result or '{}'
 
-        session = DB()
-        season = session.execute( 
-            select(
-                models.AnimeSeason
-            )\
-            .join(
-                models.Anime, models.Anime.id==models.AnimeSeason.anime_id
-            )\
-            .where(
-                models.Anime.slug==anime_slug,
-                models.AnimeSeason.slug==season_slug
-            )\
-            .limit(1)
-        ).scalars().one_or_none()
 
-        if season:
-            result = schemas.AnimeSeasonSingle.model_validate( season ).model_dump_json()
-            await RD.set( cache_key, result )
-        else:
-            result = '{}'
+async def build_season(
+    anime_slug: str,
+    season_slug: str
+) -> str | bytes | None:
 
-        session.close()
+    result = None
 
-    return result
\ No newline at end of file
+    session = ADB()
+    season = ( await session.execute(
+        select(
+            models.AnimeSeason
+        )\
+        .join(
+            models.Anime, models.Anime.id==models.AnimeSeason.anime_id
+        )\
+        .where(
+            models.Anime.slug==anime_slug,
+            models.AnimeSeason.slug==season_slug
+        )\
+        .limit(1)
+    ) ).scalars().one_or_none()
+
+    if season:
+        result = await session.run_sync( lambda _: schemas.AnimeSeasonSingle.model_validate( season ).model_dump_json() )
+
+    await session.close()
+
+    return result
@@ -0,0 +1,50 @@
+from typing import List, Set, Any
+from sqlalchemy.dialects.mysql import match
+
+# innodb ngram_token_size, shorter terms are not in the index
+NGRAM_TOKEN_SIZE = 2
+
+# FULLTEXT WITH PARSER ngram over the same columns ILIKE relevance is computed on,
+# created by update_db. Server must run with innodb_ft_enable_stopword=OFF,
+# otherwise ngrams containing stopwords are not indexed and results would differ.
+FULLTEXT_INDEXES = {
+    'mangas': 'ft_mangas_search',
+    'animes': 'ft_animes_search',
+    'ranobes': 'ft_ranobes_search',
+}
+
+# tables whose index was found at startup, failed DDL leaves table on full scan
+fulltext_ready: Set[ str ] = set()
+
+
+def load_fulltext_indexes(
+    engine: Any
+) -> None:
+    from sqlalchemy import inspect
+    inspector = inspect( engine )
+    fulltext_ready.clear()
+    for table, name in FULLTEXT_INDEXES.items():
+        try:
+            if name in [ x['name'] for x in inspector.get_indexes( table ) ]:
+                fulltext_ready.add( table )
+        except Exception as e:
+            print(f"Fulltext index check of {table} failed: {e}")
+
+
+def fulltext_candidates(
+    model: Any,
+    terms: List[ str ]
+) -> Any | None:
+    # rows that can get relevance > 0. For plain alphanumeric terms a phrase of ngrams matches
+    # exactly where ILIKE '%term%' does; wildcards, punctuation and other ngram delimiters do not,
+    # so None - some term can not be answered from the index, caller keeps the full scan
+    if model.__tablename__ not in fulltext_ready:
+        return None
+
+    for term in terms:
+        if len( term ) < NGRAM_TOKEN_SIZE or not term.isalnum():
+            return None
+
+    against = ' '.join( [ f'"{term}"' for term in terms ] )
+
+    return match( model.name, model.eng_name, against=against ).in_boolean_mode()
@@ -4,29 +4,35 @@ from sqlalchemy.orm import joinedload
 from typing import Dict, List, Any
 from app import models
 from app import schemas
-from app.db import DB
+from app.db import ADB
 from app.db import RD
-from app.tools import calculate_hash
+from app.cache import list_cache_key, single_flight, LIST_TTL, SINGLE_TTL, READER_TTL
+from app.tools import calculate_hash, encode_cursor, decode_cursor
+from app.crud.fulltext import fulltext_candidates
+from app.facets import facet_counts, has_facets, get_facet_index
 
 
 MANGA_CACHE_KEYS = {
     'list': 'manga-list',
     'filters': 'manga-filters',
     'single': 'manga-{}',
-    'reader': 'manga-{}-reader',
+    # tuples carry chapter files, documents stored under older key lack them
+    'reader': 'manga-{}-navigation',
 }
 
+# order of values in every reader navigation tuple
+READER_FIELDS = ( 'volume', 'chapter', 'id', 'title', 'branch', 'team', 'filesize', 'download_path' )
+
 
 async def search(
-    search: str
+    search: str,
+    limit: int | None = None
 ) -> List[ schemas.SearchResult ]:
 
     results = []
 
     terms = search.split(' ')
 
-    session = DB()
-
     # 
     
     manga_cases = []
@@ -67,79 +73,112 @@ async def search(
             desc("relevance")
         )
 
+    # relevance is still computed by CASE, but only over rows found by fulltext index
+    candidates = fulltext_candidates( models.Manga, terms )
+    if candidates is not None:
+        manga_query = manga_query\
+            .filter(
+                candidates
+            )
+
+    if limit:
+        manga_query = manga_query\
+            .limit(
+                limit
+            )
+
     # print('#'*20)
     # print( manga_query.compile(compile_kwargs={"literal_binds": True}) )
     # print('#'*20)
 
-    mangas: List[ models.Manga ] = session.execute( manga_query ).scalars().all()
-
-    if len( mangas ) > 0:
-        for manga in mangas:
-            result = schemas.SearchResult()
-            result.type = 'manga'
-            result.name = manga.name
-            result.eng_name = manga.eng_name
-            result.slug = manga.slug
-            if manga.cover:
-                result.cover = manga.cover.cover_link_mini if manga.cover.cover_link_mini != '' else manga.cover.cover_link_full
-            elif manga.all_covers:
-                result.cover = manga.all_covers[0].cover_link_mini if manga.all_covers[0].cover_link_mini != '' else manga.all_covers[0].cover_link_full
-            results.append( result.model_dump() )
-
-    session.close()
+    # backend can be cancelled by search timeout, connection must go back anyway
+    session = ADB()
+    try:
+        mangas: List[ models.Manga ] = ( await session.execute( manga_query ) ).scalars().all()
+
+        # relationships are loaded lazily, that needs sync session context
+        def collect( _ ) -> None:
+            if len( mangas ) > 0:
+                for manga in mangas:
+                    result = schemas.SearchResult()
+                    result.type = 'manga'
+                    result.name = manga.name
+                    result.eng_name = manga.eng_name
+                    result.slug = manga.slug
+                    if manga.cover:
+                        result.cover = manga.cover.cover_link_mini if manga.cover.cover_link_mini != '' else manga.cover.cover_link_full
+                    elif manga.all_covers:
+                        result.cover = manga.all_covers[0].cover_link_mini if manga.all_covers[0].cover_link_mini != '' else manga.all_covers[0].cover_link_full
+                    results.append( result.model_dump() )
+
+        await session.run_sync( collect )
+    finally:
+        await session.close()
 
     return results
 
 
-async def get_filters():
+async def get_filters(
+    selection: Dict[ str, Any ] = {}
+) -> str | bytes:
     cache_key = MANGA_CACHE_KEYS['filters']
-    result = await RD.get( cache_key )
+    result = await single_flight( cache_key, build_filters, None )
 
-    if not result:
+    if not has_facets( 'manga', selection ):
+        return result or '{}'
 
-        session = DB()
+    # lists are shared, counts follow current selection and are never cached
+    filters = orjson.loads( result or '{}' )
+    filters['counts'] = await facet_counts( 'manga', selection )
 
-        authors_query =\
-            select(
-                models.Author
-            )\
-            .join(
-                models.AuthorsToManga, models.AuthorsToManga.c.author_id==models.Author.id
-            )\
-            .group_by(
-                models.AuthorsToManga.c.author_id
-            )\
-            .order_by(
-                models.Author.name.asc()
-            )
+    return orjson.dumps( filters )
 
-        genres_query =\
-            select(
-                models.Genre
-            )\
-            .join(
-                models.GenresToManga, models.GenresToManga.c.genre_id==models.Genre.id
-            )\
-            .group_by(
-                models.GenresToManga.c.genre_id
-            )\
-            .order_by(
-                models.Genre.name.asc()
-            )
 
-        authors = session.execute( authors_query ).scalars().all()
-        genres = session.execute( genres_query ).scalars().all()
+async def build_filters() -> str | bytes | None:
 
-        filters = {
-            'authors': [ schemas.ShortData.model_validate( author ).model_dump() for author in authors ],
-            'genres': [ schemas.ShortData.model_validate( genre ).model_dump() for genre in genres ],
-        }
-    
-        result = orjson.dumps( filters )
+    result = None
+
+    session = ADB()
+
+    authors_query =\
+        select(
+            models.Author
+        )\
+        .join(
+            models.AuthorsToManga, models.AuthorsToManga.c.author_id==models.Author.id
+        )\
+        .group_by(
+            models.AuthorsToManga.c.author_id
+        )\
+        .order_by(
+            models.Author.name.asc()
+        )
+
+    genres_query =\
+        select(
+            models.Genre
+        )\
+        .join(
+            models.GenresToManga, models.GenresToManga.c.genre_id==models.Genre.id
+        )\
+        .group_by(
+            models.GenresToManga.c.genre_id
+        )\
+        .order_by(
+            models.Genre.name.asc()
+        )
+
+    authors = ( await session.execute( authors_query ) ).scalars().all()
+    genres = ( await session.execute( genres_query ) ).scalars().all()
 
-        await RD.set( cache_key, result )
+    filters = {
+        'authors': [ schemas.ShortData.model_validate( author ).model_dump() for author in authors ],
+        'genres': [ schemas.ShortData.model_validate( genre ).model_dump() for genre in genres ],
+    }
 
-        session.close()
+    result = orjson.dumps( filters )
+
+    await session.close()
 
     return result
 
@@ -147,32 +186,40 @@ async def get_filters():
 async def get_list(
     offset: int = 0,
     limit: int = 50,
-    filters: Dict[ str, int ] = {}
+    filters: Dict[ str, int ] = {},
+    cursor: str | None = None
 ) -> List[ schemas.Manga ]:
 
-    session = DB()
+    # cursor mode returns { items, next }, offset mode keeps plain list for old clients
+    if cursor is not None:
+        position = decode_cursor( cursor )
+        cache_filters = { **filters, 'cursor': cursor }
+    else:
+        position = None
+        cache_filters = filters
 
-    mangas_query = select( models.Manga )
+    cache_key = await list_cache_key( MANGA_CACHE_KEYS['list'], 'manga', offset, limit, cache_filters )
+    result = await RD.get( cache_key )
 
-    if 'genres' in filters:
-        mangas_query = mangas_query\
-            .join(
-                models.GenresToManga,
-                models.GenresToManga.c.manga_id==models.Manga.id
-            )\
-            .filter(
-                models.GenresToManga.c.genre_id.in_( map( int, filters['genres'] ) )
-            )
+    if result:
+        return result
 
-    if 'authors' in filters:
-        mangas_query = mangas_query\
-            .join(
-                models.AuthorsToManga,
-                models.AuthorsToManga.c.manga_id==models.Manga.id
-            )\
-            .filter(
-                models.AuthorsToManga.c.author_id.in_( map( int, filters['authors'] ) )
-            )
+    session = ADB()
+
+    mangas_query = select( models.Manga )
+
+    # facets are resolved from in-memory bitmaps, without joining relation tables
+    page_ids = None
+    if has_facets( 'manga', filters ):
+        index = await get_facet_index( 'manga' )
+        matched = index.match( filters )
+        if 'search' not in filters:
+            page_ids = index.page( matched, offset, limit, position )
+        if page_ids is None:
+            mangas_query = mangas_query\
+                .filter(
+                    models.Manga.id.in_( index.ids( matched ) )
+                )
 
     if 'search' in filters:
         terms = str( filters[ 'search' ] ).split(' ')
@@ -207,151 +254,203 @@ async def get_list(
                 desc("relevance")
             )
 
+        candidates = fulltext_candidates( models.Manga, terms )
+        if candidates is not None:
+            mangas_query = mangas_query\
+                .filter(
+                    candidates
+                )
+
+    if page_ids is not None:
+        # page is already cut from the index, only its rows are read
+        mangas_query = mangas_query\
+            .filter(
+                models.Manga.id.in_( page_ids )
+            )
+    elif position is None:
+        mangas_query = mangas_query\
+            .offset(
+                offset
+            )
+    elif 'search' in filters:
+        # relevance is computed per request, so search pages are still counted by rows
+        mangas_query = mangas_query\
+            .offset(
+                int( position.get( 'o', 0 ) )
+            )
+    elif 'n' in position and 'i' in position:
+        # keyset, next page starts right after last seen ( name, id )
+        mangas_query = mangas_query\
+            .filter(
+                or_(
+                    models.Manga.name > position['n'],
+                    and_(
+                        models.Manga.name == position['n'],
+                        models.Manga.id > int( position['i'] )
+                    )
+                )
+            )
+
     mangas_query = mangas_query\
-        .offset(
-            offset
-        )\
         .limit(
-            limit
+            limit if position is None else limit + 1
         )\
         .group_by(
             models.Manga.id
         )\
         .order_by(
-            models.Manga.name.asc()
+            models.Manga.name.asc(),
+            models.Manga.id.asc()
         )
 
-    mangas = session.execute( mangas_query ).scalars().all()
-
-    result = orjson.dumps([ schemas.Manga.model_validate( manga ).model_dump() for manga in mangas ])
-
-    session.close()
+    mangas = ( await session.execute( mangas_query ) ).scalars().all()
+
+    if position is None:
+        result = await session.run_sync( lambda _: orjson.dumps([ schemas.Manga.model_validate( manga ).model_dump() for manga in mangas ]) )
+    else:
+        # relevance filtered pages can not be counted from facet bitmaps
+        facets = None if 'search' in filters else await facet_counts( 'manga', filters )
+        next_cursor = None
+        if len( mangas ) > limit:
+            mangas = mangas[:limit]
+            if 'search' in filters:
+                next_cursor = encode_cursor( { 'o': int( position.get( 'o', 0 ) ) + limit } )
+            else:
+                next_cursor = encode_cursor( { 'n': mangas[-1].name, 'i': mangas[-1].id } )
+        result = await session.run_sync( lambda _: orjson.dumps({
+            'items': [ schemas.Manga.model_validate( manga ).model_dump() for manga in mangas ],
+            'next': next_cursor,
+            'facets': facets,
+        }) )
+
+    await session.close()
+
+    await RD.set( cache_key, result, LIST_TTL )
 
     return result
 
 
 async def get_single(
-    manga_slug: str
-) -> str:
+    manga_slug: str,
+    encoding: str | None = None
+) -> str | bytes:
 
     cache_key = MANGA_CACHE_KEYS['single'].format( manga_slug )
-    result = await RD.get( cache_key )
+    result = await single_flight( cache_key, lambda: build_single( manga_slug ), SINGLE_TTL, encoding )
 
-    if not result:
+    return result or '{}'
 
-        session = DB()
 
-        manga = session.execute( 
-            select(
-                models.Manga
-            )\
-            .where(
-                models.Manga.slug==manga_slug
-            )
-        ).scalars().one_or_none()
+async def build_single(
+    manga_slug: str
+) -> str | bytes | None:
 
-        if manga:
-            result = schemas.MangaFull.model_validate( manga ).model_dump_json()
-            await RD.set( cache_key, result, 3600 )
-        else:
-            result = '{}'
+    result = None
 
-        session.close()
+    session = ADB()
+
+    manga = ( await session.execute(
+        select(
+            models.Manga
+        )\
+        .where(
+            models.Manga.slug==manga_slug
+        )
+    ) ).scalars().one_or_none()
+
+    if manga:
+        result = await session.run_sync( lambda _: schemas.MangaFull.model_validate( manga ).model_dump_json() )
+
+    await session.close()
 
     return result
 
 
-async def get_reader_navigation(
+async def get_reader(
+    manga_slug: str,
+    encoding: str | None = None
+) -> str | bytes:
+
+    # materialized at scan time by warmer, built here only when redis lost it
+    cache_key = MANGA_CACHE_KEYS['reader'].format( manga_slug )
+    result = await single_flight( cache_key, lambda: build_reader( manga_slug ), READER_TTL, encoding )
+
+    return result or '{}'
+
+
+async def build_reader(
     manga_slug: str
-) -> str:
+) -> bytes | None:
 
-    # cache_key = MANGA_CACHE_KEYS['reader'].format(manga_slug)
-    # result = await RD.get( cache_key )
+    result = None
 
-    # if not result:
-        # print(f'manga {manga_slug} reader not cached')
+    session = ADB()
 
-        session = DB()
-        
-        manga = session.execute(
+    manga = ( await session.execute(
+        select(
+            models.Manga
+        )\
+        .where(
+            models.Manga.slug==manga_slug
+        )
+    ) ).scalars().one_or_none()
+
+    if manga:
+        # plain rows instead of chapter -> branches -> branch -> team object graph
+        rows = ( await session.execute(
             select(
-                models.Manga
-            )
-            .filter(
-                models.Manga.slug==manga_slug
+                models.MangaVolume.number,
+                models.MangaChapter.number,
+                models.MangaChapter.id,
+                models.MangaChapter.title,
+                models.MangaChapterBranch.branch_id,
+                models.MangaTranslationBranche.team_id,
+                models.Team.name,
+                models.MangaVolume.path,
+                models.MangaChapter.filename,
+                models.MangaChapter.filesize
+            )\
+            .join(
+                models.MangaVolume, models.MangaVolume.id==models.MangaChapter.volume_id
+            )\
+            .outerjoin(
+                models.MangaChapterBranch, models.MangaChapterBranch.chapter_id==models.MangaChapter.id
+            )\
+            .outerjoin(
+                models.MangaTranslationBranche, models.MangaTranslationBranche.id==models.MangaChapterBranch.branch_id
+            )\
+            .outerjoin(
+                models.Team, models.Team.id==models.MangaTranslationBranche.team_id
+            )\
+            .where(
+                models.MangaVolume.manga_id==manga.id
+            )\
+            .order_by(
+                models.MangaVolume.number.asc(),
+                models.MangaChapter.number.asc(),
+                models.MangaChapterBranch.branch_id.asc()
             )
-        ).scalar_one_or_none()
+        ) ).all()
 
-        if manga:
+        header = await session.run_sync( lambda _: schemas.MangaReader.model_validate( manga ).model_dump( exclude={ 'chapters' } ) )
 
-            chapters = session.execute(
-                select(
-                    models.MangaChapter
-                )
-                .join(
-                    models.MangaVolume, models.MangaVolume.id==models.MangaChapter.volume_id
-                )
-                .options(
-                    joinedload(
-                        models.MangaChapter.branches
-                    ).options(
-                        joinedload(
-                            models.MangaChapterBranch.branch
-                        ).options(
-                            joinedload(
-                                models.MangaTranslationBranche.team
-                            )
-                        )
-                    ),
-                    # joinedload(
-                    #     models.Manga.volumes
-                    # ).options(
-                    #     joinedload(
-                    #         models.MangaVolume.chapters
-                    #     )
-                    # ),
-                )
-                .filter(
-                    models.MangaVolume.manga_id==manga.id
-                )
-                .order_by(
-                    models.MangaVolume.number,
-                    models.MangaChapter.number
-                )
-            ).unique().scalars().all()
-
-        print( chapters )
-        # result = '{}'
-
-        # if manga:
-        #     _manga = schemas.MangaReader.model_validate( manga )
-
-        #     chapters_query = session.execute( 
-        #         select(
-        #             models.MangaChapter
-        #         )\
-        #         .join(
-        #             models.MangaVolume,
-        #             models.MangaVolume.id==models.MangaChapter.volume_id
-        #         )\
-        #         .where(
-        #             models.MangaVolume.manga_id==manga.id
-        #         )\
-        #         .order_by(
-        #             models.MangaVolume.number.asc(),
-        #             models.MangaChapter.number.asc()
-        #         )
-        #     )
-        #     chapters = chapters_query.scalars().all()
-
-        #     if chapters:
-        #         _manga.chapters = [ schemas.MangaReaderChapter.model_validate( chapter ) for chapter in chapters ]
-
-        #     result = _manga.model_dump_json()
-        #     await RD.set( cache_key, result, 3600 )
-        # else:
-        #     result = '{}'
-
-        session.close()
-
-    # return result
\ No newline at end of file
+        # one tuple per chapter and branch, team names are listed once
+        teams = {}
+        navigation = []
+        for volume, chapter, chapter_id, title, branch_id, team_id, team, volume_path, filename, filesize in rows:
+            if team_id is not None:
+                teams[ str( team_id ) ] = team or ''
+            # reader fetches and validates chapter archive by these two
+            download_path = '/'.join( [ models.MANGA_WEB_PATH, *list( filter( None, [ manga.path, volume_path, filename ] ) ) ] ) if filename else ''
+            navigation.append( ( volume, chapter, chapter_id, title or '', branch_id, team_id, filesize or 0, download_path ) )
+
+        result = orjson.dumps({
+            **header,
+            'fields': READER_FIELDS,
+            'navigation': navigation,
+            'teams': teams,
+        })
+
+    await session.close()
+
+    return result
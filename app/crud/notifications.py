@@ -4,22 +4,30 @@ from sqlalchemy import select, and_, or_
 
 from app import models
 from app import schemas
-from app.db import DB
+from app.db import ADB
 from app.db import RD
+from app.cache import local_cache
 
 async def reset_notifications() -> None:
+    local_cache.delete('last_notifications')
     await RD.delete('last_notifications')
     await get_last_notifications()
 
 
 async def get_last_notifications() -> str:
 
+    notifications = local_cache.get('last_notifications')
+    if notifications:
+        return notifications
+
     notifications = await RD.get('last_notifications')
 
     if not notifications:
         notifications = await get_notifications( 10, 0 )
         await RD.set( 'last_notifications', notifications )
 
+    local_cache.set( 'last_notifications', notifications )
+
     return notifications
 
 
@@ -28,7 +36,7 @@ async def get_notifications(
     offset: int = 0
 ) -> str:
 
-    session = DB()
+    session = ADB()
 
     notifications_query = \
         select(
@@ -84,11 +92,11 @@ async def get_notifications(
             models.Notification.id.desc()
         )
 
-    notifications = session.execute( notifications_query ).scalars().all()
+    notifications = ( await session.execute( notifications_query ) ).scalars().all()
 
-    result = [ schemas.Notification.model_validate( notification ).model_dump_json() for notification in notifications ]
+    result = await session.run_sync( lambda _: [ schemas.Notification.model_validate( notification ).model_dump_json() for notification in notifications ] )
     result = f'[{",".join(result)}]'
 
-    session.close()
+    await session.close()
 
     return result
\ No newline at end of file
@@ -1,13 +1,16 @@
-import time
 import orjson
 from sqlalchemy import select, func, or_, and_, case, asc, desc, text
 from sqlalchemy.orm import joinedload
-from typing import Dict, List, Any
+from typing import Dict, List, Tuple, Any
 from app import models
 from app import schemas
-from app.db import DB
+from app.db import ADB
 from app.db import RD
-from app.tools import calculate_hash
+from app.cache import list_cache_key, single_flight, SINGLE_TTL
+from app.tools import calculate_hash, encode_cursor, decode_cursor
+from app.crud.fulltext import fulltext_candidates
+from app.facets import facet_counts, has_facets, get_facet_index
+from app.crud.ranobe_blocks import load_chapter_blocks
 
 
 MANGA_CACHE_KEYS = {
@@ -17,17 +20,23 @@ MANGA_CACHE_KEYS = {
     'reader': 'ranobe-{}-reader',
 }
 
+# no scanner writes ranobes or bumps their catalog version,
+# so cached ranobe payloads only age out
+RANOBE_CACHE_TTL = SINGLE_TTL
+
+# order of values in every reader navigation tuple
+READER_FIELDS = ( 'volume', 'chapter', 'id', 'title', 'branch', 'team' )
+
 
 async def search(
-    search: str
+    search: str,
+    limit: int | None = None
 ) -> List[ schemas.SearchResult ]:
 
     results = []
 
     terms = search.split(' ')
 
-    session = DB()
-
     # 
     
     ranobe_cases = []
@@ -68,79 +77,113 @@ async def search(
             desc("relevance")
         )
 
+    # relevance is still computed by CASE, but only over rows found by fulltext index
+    candidates = fulltext_candidates( models.Ranobe, terms )
+    if candidates is not None:
+        ranobe_query = ranobe_query\
+            .filter(
+                candidates
+            )
+
+    if limit:
+        ranobe_query = ranobe_query\
+            .limit(
+                limit
+            )
+
     # print('#'*20)
     # print( ranobe_query.compile(compile_kwargs={"literal_binds": True}) )
     # print('#'*20)
 
-    ranobes: List[ models.Ranobe ] = session.execute( ranobe_query ).scalars().all()
-
-    if len( ranobes ) > 0:
-        for ranobe in ranobes:
-            result = schemas.SearchResult()
-            result.type = 'ranobe'
-            result.name = ranobe.name
-            result.eng_name = ranobe.eng_name
-            result.slug = ranobe.slug
-            if ranobe.cover:
-                result.cover = ranobe.cover.cover_link_mini if ranobe.cover.cover_link_mini != '' else ranobe.cover.cover_link_full
-            elif ranobe.all_covers:
-                result.cover = ranobe.all_covers[0].cover_link_mini if ranobe.all_covers[0].cover_link_mini != '' else ranobe.all_covers[0].cover_link_full
-            results.append( result.model_dump() )
-
-    session.close()
+    # backend can be cancelled by search timeout, connection must go back anyway
+    session = ADB()
+    try:
+        ranobes: List[ models.Ranobe ] = ( await session.execute( ranobe_query ) ).scalars().all()
+
+        # relationships are loaded lazily, that needs sync session context
+        def collect( _ ) -> None:
+            if len( ranobes ) > 0:
+                for ranobe in ranobes:
+                    result = schemas.SearchResult()
+                    result.type = 'ranobe'
+                    result.name = ranobe.name
+                    result.eng_name = ranobe.eng_name
+                    result.slug = ranobe.slug
+                    if ranobe.cover:
+                        result.cover = ranobe.cover.cover_link_mini if ranobe.cover.cover_link_mini != '' else ranobe.cover.cover_link_full
+                    elif ranobe.all_covers:
+                        result.cover = ranobe.all_covers[0].cover_link_mini if ranobe.all_covers[0].cover_link_mini != '' else ranobe.all_covers[0].cover_link_full
+                    results.append( result.model_dump() )
+
+        await session.run_sync( collect )
+    finally:
+        await session.close()
 
     return results
 
 
-async def get_filters() -> bytes:
+async def get_filters(
+    selection: Dict[ str, Any ] = {}
+) -> str | bytes:
+
     cache_key = MANGA_CACHE_KEYS['filters']
-    result = await RD.get( cache_key )
+    result = await single_flight( cache_key, build_filters, RANOBE_CACHE_TTL )
 
-    if not result:
+    if not has_facets( 'ranobe', selection ):
+        return result or '{}'
 
-        session = DB()
+    # lists are shared, counts follow current selection and are never cached
+    filters = orjson.loads( result or '{}' )
+    filters['counts'] = await facet_counts( 'ranobe', selection )
 
-        authors_query =\
-            select(
-                models.Author
-            )\
-            .join(
-                models.AuthorsToRanobe, models.AuthorsToRanobe.c.author_id==models.Author.id
-            )\
-            .group_by(
-                models.AuthorsToRanobe.c.author_id
-            )\
-            .order_by(
-                models.Author.name.asc()
-            )
+    return orjson.dumps( filters )
 
-        genres_query =\
-            select(
-                models.Genre
-            )\
-            .join(
-                models.GenresToRanobe, models.GenresToRanobe.c.genre_id==models.Genre.id
-            )\
-            .group_by(
-                models.GenresToRanobe.c.genre_id
-            )\
-            .order_by(
-                models.Genre.name.asc()
-            )
 
-        authors = session.execute( authors_query ).scalars().all()
-        genres = session.execute( genres_query ).scalars().all()
+async def build_filters() -> str | bytes | None:
 
-        filters = {
-            'authors': [ schemas.ShortData.model_validate( author ).model_dump() for author in authors ],
-            'genres': [ schemas.ShortData.model_validate( genre ).model_dump() for genre in genres ],
-        }
-    
-        result = orjson.dumps( filters )
+    result = None
 
-        await RD.set( cache_key, result )
+    session = ADB()
 
-        session.close()
+    authors_query =\
+        select(
+            models.Author
+        )\
+        .join(
+            models.AuthorsToRanobe, models.AuthorsToRanobe.c.author_id==models.Author.id
+        )\
+        .group_by(
+            models.AuthorsToRanobe.c.author_id
+        )\
+        .order_by(
+            models.Author.name.asc()
+        )
+
+    genres_query =\
+        select(
+            models.Genre
+        )\
+        .join(
+            models.GenresToRanobe, models.GenresToRanobe.c.genre_id==models.Genre.id
+        )\
+        .group_by(
+            models.GenresToRanobe.c.genre_id
+        )\
+        .order_by(
+            models.Genre.name.asc()
+        )
+
+    authors = ( await session.execute( authors_query ) ).scalars().all()
+    genres = ( await session.execute( genres_query ) ).scalars().all()
+
+    filters = {
+        'authors': [ schemas.ShortData.model_validate( author ).model_dump() for author in authors ],
+        'genres': [ schemas.ShortData.model_validate( genre ).model_dump() for genre in genres ],
+    }
+
+    result = orjson.dumps( filters )
+
+    await session.close()
 
     return result
 
@@ -148,32 +191,40 @@ async def get_filters() -> bytes:
 async def get_list(
     offset: int = 0,
     limit: int = 50,
-    filters: Dict[ str, int ] = {}
+    filters: Dict[ str, int ] = {},
+    cursor: str | None = None
 ) -> bytes:
 
-    session = DB()
+    # cursor mode returns { items, next }, offset mode keeps plain list for old clients
+    if cursor is not None:
+        position = decode_cursor( cursor )
+        cache_filters = { **filters, 'cursor': cursor }
+    else:
+        position = None
+        cache_filters = filters
 
-    ranobes_query = select( models.Ranobe )
+    cache_key = await list_cache_key( MANGA_CACHE_KEYS['list'], 'ranobe', offset, limit, cache_filters )
+    result = await RD.get( cache_key )
 
-    if 'genres' in filters:
-        ranobes_query = ranobes_query\
-            .join(
-                models.GenresToRanobe,
-                models.GenresToRanobe.c.ranobe_id==models.Ranobe.id
-            )\
-            .filter(
-                models.GenresToRanobe.c.genre_id.in_( map( int, filters['genres'] ) )
-            )
+    if result:
+        return result
 
-    if 'authors' in filters:
-        ranobes_query = ranobes_query\
-            .join(
-                models.AuthorsToRanobe,
-                models.AuthorsToRanobe.c.ranobe_id==models.Ranobe.id
-            )\
-            .filter(
-                models.AuthorsToRanobe.c.author_id.in_( map( int, filters['authors'] ) )
-            )
+    session = ADB()
+
+    ranobes_query = select( models.Ranobe )
+
+    # facets are resolved from in-memory bitmaps, without joining relation tables
+    page_ids = None
+    if has_facets( 'ranobe', filters ):
+        index = await get_facet_index( 'ranobe' )
+        matched = index.match( filters )
+        if 'search' not in filters:
+            page_ids = index.page( matched, offset, limit, position )
+        if page_ids is None:
+            ranobes_query = ranobes_query\
+                .filter(
+                    models.Ranobe.id.in_( index.ids( matched ) )
+                )
 
     if 'search' in filters:
         terms = str( filters[ 'search' ] ).split(' ')
@@ -208,161 +259,269 @@ async def get_list(
                 desc("relevance")
             )
 
+        candidates = fulltext_candidates( models.Ranobe, terms )
+        if candidates is not None:
+            ranobes_query = ranobes_query\
+                .filter(
+                    candidates
+                )
+
+    if page_ids is not None:
+        # page is already cut from the index, only its rows are read
+        ranobes_query = ranobes_query\
+            .filter(
+                models.Ranobe.id.in_( page_ids )
+            )
+    elif position is None:
+        ranobes_query = ranobes_query\
+            .offset(
+                offset
+            )
+    elif 'search' in filters:
+        # relevance is computed per request, so search pages are still counted by rows
+        ranobes_query = ranobes_query\
+            .offset(
+                int( position.get( 'o', 0 ) )
+            )
+    elif 'n' in position and 'i' in position:
+        # keyset, next page starts right after last seen ( name, id )
+        ranobes_query = ranobes_query\
+            .filter(
+                or_(
+                    models.Ranobe.name > position['n'],
+                    and_(
+                        models.Ranobe.name == position['n'],
+                        models.Ranobe.id > int( position['i'] )
+                    )
+                )
+            )
+
     ranobes_query = ranobes_query\
-        .offset(
-            offset
-        )\
         .limit(
-            limit
+            limit if position is None else limit + 1
         )\
         .group_by(
             models.Ranobe.id
         )\
         .order_by(
-            models.Ranobe.name.asc()
+            models.Ranobe.name.asc(),
+            models.Ranobe.id.asc()
         )
 
-    ranobes = session.execute( ranobes_query ).scalars().all()
-
-    result = orjson.dumps([ schemas.RanobeBase.model_validate( ranobe ).model_dump() for ranobe in ranobes ])
-
-    session.close()
+    ranobes = ( await session.execute( ranobes_query ) ).scalars().all()
+
+    if position is None:
+        result = await session.run_sync( lambda _: orjson.dumps([ schemas.RanobeBase.model_validate( ranobe ).model_dump() for ranobe in ranobes ]) )
+    else:
+        # relevance filtered pages can not be counted from facet bitmaps
+        facets = None if 'search' in filters else await facet_counts( 'ranobe', filters )
+        next_cursor = None
+        if len( ranobes ) > limit:
+            ranobes = ranobes[:limit]
+            if 'search' in filters:
+                next_cursor = encode_cursor( { 'o': int( position.get( 'o', 0 ) ) + limit } )
+            else:
+                next_cursor = encode_cursor( { 'n': ranobes[-1].name, 'i': ranobes[-1].id } )
+        result = await session.run_sync( lambda _: orjson.dumps({
+            'items': [ schemas.RanobeBase.model_validate( ranobe ).model_dump() for ranobe in ranobes ],
+            'next': next_cursor,
+            'facets': facets,
+        }) )
+
+    await session.close()
+
+    await RD.set( cache_key, result, RANOBE_CACHE_TTL )
 
     return result
 
 
 async def get_single(
-    ranobe_slug: str
-) -> str:
+    ranobe_slug: str,
+    encoding: str | None = None
+) -> str | bytes:
 
     cache_key = MANGA_CACHE_KEYS['single'].format( ranobe_slug )
-    result = await RD.get( cache_key )
+    result = await single_flight( cache_key, lambda: build_single( ranobe_slug ), SINGLE_TTL, encoding )
 
-    if not result:
+    return result or '{}'
 
-        session = DB()
 
-        ranobe = session.execute( 
-            select(
-                models.Ranobe
-            )\
-            .where(
-                models.Ranobe.slug==ranobe_slug
-            )
-        ).scalars().one_or_none()
+async def build_single(
+    ranobe_slug: str
+) -> str | bytes | None:
 
-        if ranobe:
-            result = schemas.RanobeFull.model_validate( ranobe ).model_dump_json()
-            await RD.set( cache_key, result, 3600 )
-        else:
-            result = '{}'
+    result = None
 
-        session.close()
+    session = ADB()
+
+    ranobe = ( await session.execute(
+        select(
+            models.Ranobe
+        )\
+        .where(
+            models.Ranobe.slug==ranobe_slug
+        )
+    ) ).scalars().one_or_none()
+
+    if ranobe:
+        result = await session.run_sync( lambda _: schemas.RanobeFull.model_validate( ranobe ).model_dump_json() )
+
+    await session.close()
 
     return result
 
 
-async def get_reader_navigation(
+async def get_reader(
+    ranobe_slug: str,
+    encoding: str | None = None
+) -> str | bytes:
+
+    # materialized at scan time by warmer, built here only when redis lost it
+    cache_key = MANGA_CACHE_KEYS['reader'].format( ranobe_slug )
+    result = await single_flight( cache_key, lambda: build_reader( ranobe_slug ), RANOBE_CACHE_TTL, encoding )
+
+    return result or '{}'
+
+
+async def build_reader(
     ranobe_slug: str
-) -> str:
+) -> bytes | None:
 
-    # cache_key = MANGA_CACHE_KEYS['reader'].format(ranobe_slug)
-    # result = await RD.get( cache_key )
+    result = None
 
-    # if not result:
-        # print(f'ranobe {ranobe_slug} reader not cached')
+    session = ADB()
 
-        session = DB()
+    ranobe = ( await session.execute(
+        select(
+            models.Ranobe
+        )\
+        .where(
+            models.Ranobe.slug==ranobe_slug
+        )
+    ) ).scalars().one_or_none()
 
-        start = time.time()
-        
-        ranobe = session.execute(
+    if ranobe:
+        # plain rows instead of chapter -> branches -> branch -> team object graph
+        rows = ( await session.execute(
             select(
-                models.Ranobe
-            )
-            .filter(
-                models.Ranobe.slug==ranobe_slug
+                models.RanobeVolume.number,
+                models.RanobeChapter.number,
+                models.RanobeChapter.id,
+                models.RanobeChapter.title,
+                models.RanobeChapterBranch.branch_id,
+                models.RanobeTranslationBranche.team_id,
+                models.Team.name
+            )\
+            .join(
+                models.RanobeVolume, models.RanobeVolume.id==models.RanobeChapter.volume_id
+            )\
+            .outerjoin(
+                models.RanobeChapterBranch, models.RanobeChapterBranch.chapter_id==models.RanobeChapter.id
+            )\
+            .outerjoin(
+                models.RanobeTranslationBranche, models.RanobeTranslationBranche.id==models.RanobeChapterBranch.branch_id
+            )\
+            .outerjoin(
+                models.Team, models.Team.id==models.RanobeTranslationBranche.team_id
+            )\
+            .where(
+                models.RanobeVolume.ranobe_id==ranobe.id
+            )\
+            .order_by(
+                models.RanobeVolume.number.asc(),
+                models.RanobeChapter.number.asc(),
+                models.RanobeChapterBranch.branch_id.asc()
             )
-        ).scalar_one_or_none()
+        ) ).all()
 
-        if ranobe:
-
-            chapters = session.execute(
-                select(
-                    models.RanobeChapter
-                )
-                .join(
-                    models.RanobeVolume, models.RanobeVolume.id==models.RanobeChapter.volume_id
-                )
-                .options(
-                    joinedload(
-                        models.RanobeChapter.volume
-                    ),
-                    joinedload(
-                        models.RanobeChapter.branches
-                    ).options(
-                        joinedload(
-                            models.RanobeChapterBranch.branch
-                        ).options(
-                            joinedload(
-                                models.RanobeTranslationBranche.team
-                            )
-                        )
-                    ),
-                    # joinedload(
-                    #     models.Ranobe.volumes
-                    # ).options(
-                    #     joinedload(
-                    #         models.RanobeVolume.chapters
-                    #     )
-                    # ),
-                )
-                .filter(
-                    models.RanobeVolume.ranobe_id==ranobe.id
-                )
-                .order_by(
-                    models.RanobeVolume.number,
-                    models.RanobeChapter.number
-                )
-            ).unique().scalars().all()
-        
-        end = time.time()
+        header = await session.run_sync( lambda _: schemas.RanobeReader.model_validate( ranobe ).model_dump( exclude={ 'navigation' } ) )
 
-        print('perf:',end-start)
+        # one tuple per chapter and branch, team names are listed once
+        teams = {}
+        navigation = []
+        for volume, chapter, chapter_id, title, branch_id, team_id, team in rows:
+            if team_id is not None:
+                teams[ str( team_id ) ] = team or ''
+            navigation.append( ( volume, chapter, chapter_id, title or '', branch_id, team_id ) )
 
-        # print( '#ranobe' )
-        # print( ranobe )
-        # print( '#chapters' )
-        # for chapter in chapters:
-        #     print( '\t', chapter )
-        #     print( '\t', '#branches' )
-        #     for branch in chapter.branches:
-        #         print( '\t\t', branch )
+        result = orjson.dumps({
+            **header,
+            'fields': READER_FIELDS,
+            'navigation': navigation,
+            'teams': teams,
+        })
 
-        session.close()
+    await session.close()
 
-    # return result
+    return result
 
 
 async def get_reader_chapter_content(
-    chapter_id: int
-) -> str:
+    chapter_id: int,
+    block_from: int = 0,
+    block_to: int | None = None,
+    branch_id: int | None = None
+) -> Tuple[ bytes, List[ bytes ], bytes ] | None:
 
-    result = '{}'
-    
-    session = DB()
+    # ( json head, compressed blocks, json tail ), handler streams them without touching nodes
+    result = None
+
+    session = ADB()
 
-    chapter_query = session.execute( 
+    chapter = ( await session.execute(
         select(
-            models.RanobeChapter
+            models.RanobeChapter.id,
+            models.RanobeChapter.number,
+            models.RanobeChapter.title,
+            models.RanobeVolume.number
+        )\
+        .join(
+            models.RanobeVolume, models.RanobeVolume.id==models.RanobeChapter.volume_id
         )\
         .where(
             models.RanobeChapter.id==chapter_id
         )
-    )
-    chapter = chapter_query.scalar_one_or_none()
+    ) ).one_or_none()
 
-    if chapter:
-        result = schemas.RanobeReaderChapterContent.model_validate( chapter ).model_dump_json()
-    
-    return result
\ No newline at end of file
+    data_query = select(
+            models.RanobeChapterBranch.id,
+            models.RanobeChapterBranch.branch_id
+        )\
+        .where(
+            models.RanobeChapterBranch.chapter_id==chapter_id
+        )\
+        .order_by(
+            models.RanobeChapterBranch.id.asc()
+        )\
+        .limit(
+            1
+        )
+    if branch_id is not None:
+        data_query = data_query\
+            .where(
+                models.RanobeChapterBranch.branch_id==branch_id
+            )
+
+    data = ( await session.execute( data_query ) ).one_or_none() if chapter else None
+
+    if chapter and data:
+        total, blocks = await load_chapter_blocks( session, data[0], block_from, block_to )
+
+        head = orjson.dumps({
+            'id': chapter[0],
+            'number': chapter[1],
+            'volume_number': chapter[3],
+            'name': chapter[2] or '',
+            'eng_name': '',
+            'timestamp': 0,
+            'branch': data[1],
+            'blocks': total,
+            'block_from': block_from,
+            'block_to': min( block_to, total - 1 ) if block_to is not None else total - 1,
+        })
+
+        result = ( head[:-1] + b',"content":[', blocks, b']}' )
+
+    await session.close()
+
+    return result
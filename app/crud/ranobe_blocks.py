@@ -0,0 +1,229 @@
+import asyncio
+import argparse
+import orjson
+import zstandard
+from sqlalchemy import select, delete, func
+from sqlalchemy.exc import IntegrityError, OperationalError
+from sqlalchemy.ext.asyncio import AsyncSession
+from typing import List, Tuple, Dict, Any, AsyncIterator
+from app import models
+from app.db import ADB
+
+# block is closed at whichever limit comes first
+RANOBE_BLOCK_NODES = 32
+RANOBE_BLOCK_BYTES = 65536
+RANOBE_ZSTD_LEVEL = 10
+# innodb deadlock and lock wait timeout
+RETRY_ERRORS = ( 1213, 1205 )
+
+compressor = zstandard.ZstdCompressor( level=RANOBE_ZSTD_LEVEL )
+decompressor = zstandard.ZstdDecompressor()
+
+# concatenated zstd frames are one valid stream, so stored blocks are sent
+# to zstd capable clients as they are, glued with these tiny frames
+ZSTD_COMMA = compressor.compress( b',' )
+
+
+def split_blocks(
+    content: Any
+) -> List[ Tuple[ int, int, bytes ] ]:
+    # ( first node, nodes count, serialized nodes joined with commas )
+    if not isinstance( content, list ):
+        content = [ content ] if content else []
+    blocks = []
+    first = 0
+    nodes: List[ bytes ] = []
+    size = 0
+    for i, node in enumerate( content ):
+        raw = orjson.dumps( node )
+        if nodes and ( len( nodes ) >= RANOBE_BLOCK_NODES or size + len( raw ) > RANOBE_BLOCK_BYTES ):
+            blocks.append( ( first, len( nodes ), b','.join( nodes ) ) )
+            first = i
+            nodes = []
+            size = 0
+        nodes.append( raw )
+        size += len( raw ) + 1
+    if nodes:
+        blocks.append( ( first, len( nodes ), b','.join( nodes ) ) )
+    return blocks
+
+
+def build_chapter_blocks(
+    data_id: int,
+    content: Any,
+    source: str | None = None
+) -> List[ models.RanobeChapterBlock ]:
+    # empty chapter still gets one empty block, so it is not packed again
+    parts = split_blocks( content ) or [ ( 0, 0, b'' ) ]
+    blocks = []
+    for number, ( first, count, raw ) in enumerate( parts ):
+        block = models.RanobeChapterBlock()
+        block.data_id = data_id
+        block.number = number
+        block.first = first
+        block.count = count
+        block.size = len( raw )
+        block.data = compressor.compress( raw )
+        block.source = source or ''
+        blocks.append( block )
+    return blocks
+
+
+async def store_chapter_blocks(
+    session: AsyncSession,
+    data_id: int,
+    blocks: List[ models.RanobeChapterBlock ]
+) -> None:
+    # replaces blocks of one chapter branch, caller commits
+    await session.execute( delete( models.RanobeChapterBlock ).where( models.RanobeChapterBlock.data_id==data_id ) )
+    session.add_all( blocks )
+
+
+async def pack_chapter_data(
+    session: AsyncSession,
+    data_id: int,
+    content: Any,
+    source: str | None = None
+) -> List[ models.RanobeChapterBlock ]:
+    blocks = build_chapter_blocks( data_id, content, source )
+    await store_chapter_blocks( session, data_id, blocks )
+    return blocks
+
+
+async def load_chapter_blocks(
+    session: AsyncSession,
+    data_id: int,
+    block_from: int = 0,
+    block_to: int | None = None
+) -> Tuple[ int, List[ bytes ] ]:
+    # ( total blocks, compressed data of requested range ),
+    # chapters stored before blocks existed or changed since packing are packed on read
+    state = ( await session.execute(
+        select(
+            models.RanobeChapterBranch.content_hash,
+            func.count( models.RanobeChapterBlock.id ),
+            func.min( models.RanobeChapterBlock.source )
+        )\
+        .outerjoin(
+            models.RanobeChapterBlock,
+            models.RanobeChapterBlock.data_id==models.RanobeChapterBranch.id
+        )\
+        .where(
+            models.RanobeChapterBranch.id==data_id
+        )\
+        .group_by(
+            models.RanobeChapterBranch.id
+        )
+    ) ).one_or_none()
+
+    if state is None:
+        return 0, []
+
+    source, total, packed = state
+
+    if total == 0 or ( packed or '' ) != ( source or '' ):
+        # hash is read again with content, so blocks never claim newer source than they hold
+        content, source = ( await session.execute(
+            select(
+                models.RanobeChapterBranch.content,
+                models.RanobeChapterBranch.content_hash
+            )\
+            .where(
+                models.RanobeChapterBranch.id==data_id
+            )
+        ) ).one()
+        blocks = build_chapter_blocks( data_id, content, source )
+        # keep plain values, rollback below would expire the objects
+        result = [ x.data for x in blocks if x.number >= block_from and ( block_to is None or x.number <= block_to ) ]
+        try:
+            await store_chapter_blocks( session, data_id, blocks )
+            await session.commit()
+        except ( IntegrityError, OperationalError ) as e:
+            # another request packed same chapter meanwhile, on unique key or innodb deadlock;
+            # blocks packed here are just as fresh, so they are served without storing
+            if isinstance( e, OperationalError ) and e.orig.args[0] not in RETRY_ERRORS:
+                raise
+            await session.rollback()
+        return len( blocks ), result
+
+    query = select(
+            models.RanobeChapterBlock.data
+        )\
+        .where(
+            models.RanobeChapterBlock.data_id==data_id,
+            models.RanobeChapterBlock.number >= block_from
+        )\
+        .order_by(
+            models.RanobeChapterBlock.number.asc()
+        )
+    if block_to is not None:
+        query = query\
+            .where(
+                models.RanobeChapterBlock.number <= block_to
+            )
+
+    blocks = ( await session.execute( query ) ).scalars().all()
+
+    return total, list( blocks )
+
+
+async def stream_blocks(
+    prefix: bytes,
+    blocks: List[ bytes ],
+    suffix: bytes,
+    zstd: bool = False
+) -> AsyncIterator[ bytes ]:
+    # node JSON is never parsed again, blocks are only inflated or passed through
+    yield compressor.compress( prefix ) if zstd else prefix
+    for i, block in enumerate( blocks ):
+        if i > 0:
+            yield ZSTD_COMMA if zstd else b','
+        yield block if zstd else decompressor.decompress( block )
+    yield compressor.compress( suffix ) if zstd else suffix
+
+
+async def pack_all(
+    batch: int = 200
+) -> None:
+    # bulk conversion of chapters stored as JSON column only or changed since packing
+    packed = 0
+    while True:
+        session = ADB()
+        ids = ( await session.execute(
+            select(
+                models.RanobeChapterBranch.id
+            )\
+            .where(
+                ~select( models.RanobeChapterBlock.id ).where( models.RanobeChapterBlock.data_id==models.RanobeChapterBranch.id, models.RanobeChapterBlock.source==func.coalesce( models.RanobeChapterBranch.content_hash, '' ) ).exists()
+            )\
+            .limit(
+                batch
+            )
+        ) ).scalars().all()
+        if not ids:
+            await session.close()
+            break
+        rows = ( await session.execute(
+            select(
+                models.RanobeChapterBranch.id,
+                models.RanobeChapterBranch.content,
+                models.RanobeChapterBranch.content_hash
+            )\
+            .where(
+                models.RanobeChapterBranch.id.in_( ids )
+            )
+        ) ).all()
+        for data_id, content, source in rows:
+            await pack_chapter_data( session, data_id, content, source )
+        await session.commit()
+        await session.close()
+        packed += len( rows )
+        print(f"Packed {packed} ranobe chapters")
+
+
+if __name__ == '__main__':
+    #   python -m app.crud.ranobe_blocks --batch 200
+    parser = argparse.ArgumentParser()
+    parser.add_argument( '--batch', type=int, default=200 )
+    args = parser.parse_args()
+    asyncio.run( pack_all( args.batch ) )
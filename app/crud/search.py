@@ -0,0 +1,115 @@
+import os
+import time
+import asyncio
+import orjson
+from typing import Dict, List, Any, Callable, Awaitable
+
+from app.db import RD
+from app.cache import CACHE_KEYS, single_flight
+from app.tools import calculate_hash
+from app.crud.anime import search as search_anime
+from app.crud.manga import search as search_manga
+from app.crud.ranobe import search as search_ranobe
+
+SEARCH_BACKENDS: Dict[ str, Callable[ [ str, int | None ], Awaitable[ List[ Dict[ str, Any ] ] ] ] ] = {
+    'anime': search_anime,
+    'manga': search_manga,
+    'ranobe': search_ranobe,
+}
+
+# rows fetched from every backend, merged answer is cut to SEARCH_LIMIT
+SEARCH_TYPE_LIMIT = 20
+SEARCH_LIMIT = 30
+SEARCH_TTL = 600
+# slow backend must not hold the whole answer
+SEARCH_TIMEOUT = 5
+SEARCH_DEBUG = os.environ.get( 'SEARCH_DEBUG', '' ) in [ '1', 'true', 'yes' ]
+
+
+def normalize_query(
+    search: str
+) -> str:
+    # backends split on single spaces, empty terms would match everything
+    return ' '.join( search.split() )
+
+
+def relevance(
+    item: Dict[ str, Any ],
+    terms: List[ str ]
+) -> int:
+    # same count of matched terms the backends order by
+    name = item.get( 'name', '' ).casefold()
+    eng_name = item.get( 'eng_name', '' ).casefold()
+    return sum( [ 1 for term in terms if term in name or term in eng_name ] )
+
+
+async def run_backend(
+    media: str,
+    search: str
+) -> tuple[ List[ Dict[ str, Any ] ], float ]:
+    start = time.perf_counter()
+    try:
+        items = await asyncio.wait_for( SEARCH_BACKENDS[ media ]( search, SEARCH_TYPE_LIMIT ), SEARCH_TIMEOUT )
+    except Exception as e:
+        print(f"Search backend {media} failed: {e!r}")
+        items = []
+    return items, time.perf_counter() - start
+
+
+async def build_search(
+    search: str
+) -> Dict[ str, Any ]:
+    start = time.perf_counter()
+
+    # every backend uses own session, so queries run concurrently on separate connections
+    answers = await asyncio.gather( *[ run_backend( media, search ) for media in SEARCH_BACKENDS.keys() ] )
+
+    terms = [ x.casefold() for x in search.split(' ') ]
+    merged = []
+    for order, ( media, ( items, _ ) ) in enumerate( zip( SEARCH_BACKENDS.keys(), answers ) ):
+        for rank, item in enumerate( items ):
+            merged.append( ( -relevance( item, terms ), rank, order, media, item ) )
+    merged.sort( key=lambda x: x[:3] )
+
+    result = {
+        "anime": [],
+        "manga": [],
+        "ranobe": [],
+        "found": 0
+    }
+    for _, _, _, media, item in merged[ :SEARCH_LIMIT ]:
+        result[ media ].append( item )
+        result['found'] += 1
+
+    if SEARCH_DEBUG:
+        result['timings'] = { media: round( took * 1000, 2 ) for media, ( _, took ) in zip( SEARCH_BACKENDS.keys(), answers ) }
+        result['timings']['total'] = round( ( time.perf_counter() - start ) * 1000, 2 )
+
+    return result
+
+
+async def search_key(
+    search: str
+) -> str:
+    # catalog versions are part of the key, so rescans do not serve old answers
+    versions = await RD.mget( [ CACHE_KEYS['version'].format( x ) for x in SEARCH_BACKENDS.keys() ] )
+    version = '-'.join( [ str( x or 0 ) for x in versions ] )
+    return f'search-{version}-{calculate_hash( search.casefold().encode() )}'
+
+
+async def federated_search(
+    search: str
+) -> bytes:
+    search = normalize_query( search )
+    if not search:
+        return orjson.dumps({ "anime": [], "manga": [], "ranobe": [], "found": 0 })
+
+    if SEARCH_DEBUG:
+        # timings of cached answer would describe some earlier request
+        return orjson.dumps( await build_search( search ) )
+
+    async def build() -> bytes:
+        return orjson.dumps( await build_search( search ) )
+
+    key = await search_key( search )
+    return await single_flight( key, build, SEARCH_TTL )
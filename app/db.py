@@ -1,7 +1,9 @@
 import os
+import redis
 import redis.asyncio as rds
 from sqlalchemy import create_engine
 from sqlalchemy.orm import sessionmaker
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
 from sqlalchemy.ext.declarative import declarative_base
 from elasticsearch import Elasticsearch
 
@@ -13,6 +15,7 @@ RD_HOST = os.environ.get("RD_HOST")
 ES_HOST = os.environ.get("ES_HOST")
 
 SQLALCHEMY_DATABASE_URL = f"mysql+pymysql://{DB_USER}:{DB_PASSWORD}@{DB_HOST}:3306/{DB_BASE}" # ?unix_socket=/var/run/mysqld/mysqld.sock&charset=utf8mb4
+ASYNC_SQLALCHEMY_DATABASE_URL = f"mysql+aiomysql://{DB_USER}:{DB_PASSWORD}@{DB_HOST}:3306/{DB_BASE}"
 
 engine = create_engine(
     SQLALCHEMY_DATABASE_URL,
@@ -21,8 +24,22 @@ engine = create_engine(
 
 DB = sessionmaker(engine, expire_on_commit=False, autoflush=False)
 
+# request handlers, queries must not block the event loop
+async_engine = create_async_engine(
+    ASYNC_SQLALCHEMY_DATABASE_URL,
+    pool_size=10, max_overflow=50, pool_recycle=10, pool_pre_ping=True, pool_timeout=30, pool_reset_on_return='rollback'
+)
+
+ADB = async_sessionmaker(async_engine, expire_on_commit=False, autoflush=False)
+
 RD = rds.Redis( host=RD_HOST, port=6379, db=3, protocol=3, decode_responses=True )
 
+# compressed payloads are binary, they can not go through decoding client
+RDB = rds.Redis( host=RD_HOST, port=6379, db=3, protocol=3, decode_responses=False )
+
+# scanners run outside of event loop
+RDS = redis.Redis( host=RD_HOST, port=6379, db=3, protocol=3, decode_responses=True )
+
 # ES = Elasticsearch(f"http://{ES_HOST}:9200/")
 
 # general = {
@@ -5,7 +5,36 @@ from fastapi import Response
 def update_db():
     from app.db import engine, Base
     from app import models
+    from app.crud.fulltext import load_fulltext_indexes
     Base.metadata.create_all( bind=engine, checkfirst=True )
+    upgrade_db( engine )
+    load_fulltext_indexes( engine )
+
+# create_all does not add columns and indexes to existing tables
+DB_UPGRADES = [
+    ( 'general_images', 'column', 'hash', "ALTER TABLE general_images ADD COLUMN hash VARCHAR(32) DEFAULT '', ADD INDEX ix_general_images_hash (hash)" ),
+    ( 'general_images', 'column', 'variants', "ALTER TABLE general_images ADD COLUMN variants SMALLINT DEFAULT 0" ),
+    ( 'mangas', 'index', 'ft_mangas_search', "ALTER TABLE mangas ADD FULLTEXT INDEX ft_mangas_search (name, eng_name) WITH PARSER ngram" ),
+    ( 'animes', 'index', 'ft_animes_search', "ALTER TABLE animes ADD FULLTEXT INDEX ft_animes_search (name, eng_name) WITH PARSER ngram" ),
+    ( 'ranobes', 'index', 'ft_ranobes_search', "ALTER TABLE ranobes ADD FULLTEXT INDEX ft_ranobes_search (name, eng_name) WITH PARSER ngram" ),
+    ( 'ranobes_chapters_datas', 'column', 'content_hash', "ALTER TABLE ranobes_chapters_datas ADD COLUMN content_hash VARCHAR(32) GENERATED ALWAYS AS (MD5(content)) STORED" ),
+    ( 'ranobes_chapters_blocks', 'column', 'source', "ALTER TABLE ranobes_chapters_blocks ADD COLUMN source VARCHAR(32) DEFAULT ''" ),
+]
+
+def upgrade_db( engine ):
+    from sqlalchemy import inspect, text
+    inspector = inspect( engine )
+    for table, kind, name, ddl in DB_UPGRADES:
+        if kind == 'column':
+            exists = [ x['name'] for x in inspector.get_columns( table ) ]
+        else:
+            exists = [ x['name'] for x in inspector.get_indexes( table ) ]
+        if name not in exists:
+            try:
+                with engine.begin() as conn:
+                    conn.execute( text( ddl ) )
+            except Exception as e:
+                print(f"DB upgrade {table}.{name} failed: {e}")
 
 def get_session():
     from app.db import DB
@@ -21,9 +50,41 @@ def generateOTP():
  
     return OTP
 
+def accepted_encoding( header: str, codings: tuple[ str, ... ] | None = None ) -> str | None:
+    # first of offered codings the client accepts, q=0 means refused,
+    # cached payload codings are offered by default
+    if codings is None:
+        from app.cache import CACHE_ENCODINGS
+        codings = CACHE_ENCODINGS
+    accepted = {}
+    for part in header.lower().split( ',' ):
+        name, _, params = part.strip().partition( ';' )
+        quality = 1.0
+        params = params.strip()
+        if params.startswith( 'q=' ):
+            try:
+                quality = float( params[2:] )
+            except ValueError:
+                quality = 0
+        accepted[ name.strip() ] = quality
+    for encoding in codings:
+        if accepted.get( encoding, accepted.get( '*', 0 ) ) > 0:
+            return encoding
+    return None
+
 class PJSONResponse( Response ):
     media_type = "application/json"
 
+    def __init__( self, content: str|bytes, *args, negotiated: bool = False, **kwargs ) -> None:
+        super().__init__( content, *args, **kwargs )
+        # precompressed cache values carry their coding
+        encoding = getattr( content, 'encoding', None )
+        if encoding:
+            self.headers['Content-Encoding'] = encoding
+        # identity answer of negotiating endpoint must not be reused for clients accepting a coding
+        if encoding or negotiated:
+            self.headers['Vary'] = 'Accept-Encoding'
+
     def render( self, content: str|bytes ) -> bytes:
         if isinstance( content, bytes ):
             return content
@@ -1,51 +1,60 @@
 import asyncio
 from fastapi import FastAPI, Request
 from fastapi.responses import ORJSONResponse
-from app.dependencies import PJSONResponse
+from app.dependencies import PJSONResponse, accepted_encoding
 from app.crud.anime import *
 from app.tools import parse_query
-from app.scaners.anime import scan_animes, scan_animes_single
+from app.jobs import enqueue_scan, get_scan_job
 
 anime = FastAPI()
 
 
 @anime.get( '/rescan' )
-def endpoint_rescan():
-    scan_animes()
-    return None
+async def endpoint_rescan():
+    job = await enqueue_scan( 'anime' )
+    return PJSONResponse( job )
+
+
+@anime.get( '/rescan/jobs/{job_id}' )
+async def endpoint_rescan_job( job_id: str ):
+    job = await get_scan_job( job_id )
+    return PJSONResponse( job )
 
 
 @anime.get( '/rescan/{name}' )
-def endpoint_rescan_single( name: str ):
-    scan_animes_single( name )
-    return None
+async def endpoint_rescan_single( name: str ):
+    job = await enqueue_scan( 'anime', name )
+    return PJSONResponse( job )
 
 
 #
 
 
 @anime.get( '/filters' )
-async def endpoint_filters():
-    filters = await get_filters()
+async def endpoint_filters( request: Request ):
+    # ?genres[]=1&genres[]=2 adds live counts of every facet value for that selection
+    selection = parse_query( request.query_params )
+    filters = await get_filters( selection )
     return PJSONResponse( filters )
 
 
 @anime.get( '/list' )
-async def endpoint_list( request: Request, offset: int = 0, limit: int = 50 ):
+async def endpoint_list( request: Request, offset: int = 0, limit: int = 50, cursor: str | None = None ):
     filters = parse_query( request.query_params )
-    del filters['offset']
-    del filters['limit']
-    animes = await get_list( offset, limit, filters )
+    filters.pop( 'offset', None )
+    filters.pop( 'limit', None )
+    filters.pop( 'cursor', None )
+    animes = await get_list( offset, limit, filters, cursor )
     return PJSONResponse( animes )
 
 
 @anime.get( '/{anime_slug}' )
-async def endpoint_single( anime_slug: str ):
-    anime = await get_single( anime_slug )
-    return PJSONResponse( anime )
+async def endpoint_single( request: Request, anime_slug: str ):
+    anime = await get_single( anime_slug, accepted_encoding( request.headers.get( 'accept-encoding', '' ) ) )
+    return PJSONResponse( anime, negotiated=True )
 
 
 @anime.get( '/{anime_slug}/{season_slug}' )
-async def endpoint_season( anime_slug: str, season_slug: str ):
-    season = await get_season( anime_slug, season_slug )
-    return PJSONResponse( season )
\ No newline at end of file
+async def endpoint_season( request: Request, anime_slug: str, season_slug: str ):
+    season = await get_season( anime_slug, season_slug, accepted_encoding( request.headers.get( 'accept-encoding', '' ) ) )
+    return PJSONResponse( season, negotiated=True )
\ No newline at end of file
@@ -1,47 +1,56 @@
 import asyncio
 from fastapi import FastAPI, Request
-from app.dependencies import PJSONResponse
+from app.dependencies import PJSONResponse, accepted_encoding
 from app.crud.manga import *
 from app.tools import parse_query
-from app.scaners.manga import scan_mangas, scan_mangas_single
+from app.jobs import enqueue_scan, get_scan_job
 
 manga = FastAPI()
 
 
 @manga.get( '/rescan' )
-def endpoint_rescan():
-    scan_mangas()
-    return None
+async def endpoint_rescan():
+    job = await enqueue_scan( 'manga' )
+    return PJSONResponse( job )
+
+
+@manga.get( '/rescan/jobs/{job_id}' )
+async def endpoint_rescan_job( job_id: str ):
+    job = await get_scan_job( job_id )
+    return PJSONResponse( job )
 
 
 @manga.get( '/rescan/{name}' )
-def endpoint_rescan_single( name: str ):
-    scan_mangas_single( name )
-    return None
+async def endpoint_rescan_single( name: str ):
+    job = await enqueue_scan( 'manga', name )
+    return PJSONResponse( job )
 
 
 @manga.get( '/filters' )
-async def endpoint_filters():
-    filters = await get_filters()
+async def endpoint_filters( request: Request ):
+    # ?genres[]=1&genres[]=2 adds live counts of every facet value for that selection
+    selection = parse_query( request.query_params )
+    filters = await get_filters( selection )
     return PJSONResponse( filters )
 
 
 @manga.get( '/list' )
-async def endpoint_list( request: Request, offset: int = 0, limit: int = 50 ):
+async def endpoint_list( request: Request, offset: int = 0, limit: int = 50, cursor: str | None = None ):
     filters = parse_query( request.query_params )
-    del filters['offset']
-    del filters['limit']
-    mangas = await get_list( offset, limit, filters )
+    filters.pop( 'offset', None )
+    filters.pop( 'limit', None )
+    filters.pop( 'cursor', None )
+    mangas = await get_list( offset, limit, filters, cursor )
     return PJSONResponse( mangas )
 
 
 @manga.get( '/{manga_slug}' )
-async def endpoint_single( manga_slug: str ):
-    response = await get_single( manga_slug )
-    return PJSONResponse( response )
+async def endpoint_single( request: Request, manga_slug: str ):
+    response = await get_single( manga_slug, accepted_encoding( request.headers.get( 'accept-encoding', '' ) ) )
+    return PJSONResponse( response, negotiated=True )
 
 
 @manga.get( '/{manga_slug}/reader' )
-async def endpoint_reader( manga_slug: str ):
-    response = await get_reader( manga_slug )
-    return PJSONResponse( response )
\ No newline at end of file
+async def endpoint_reader( request: Request, manga_slug: str ):
+    response = await get_reader( manga_slug, accepted_encoding( request.headers.get( 'accept-encoding', '' ) ) )
+    return PJSONResponse( response, negotiated=True )
\ No newline at end of file
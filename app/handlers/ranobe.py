@@ -1,8 +1,10 @@
 import asyncio
 from fastapi import FastAPI, Request
-from app.dependencies import PJSONResponse
+from fastapi.responses import StreamingResponse
+from app.dependencies import PJSONResponse, accepted_encoding
 from app.crud.ranobe import *
 from app.tools import parse_query
+from app.crud.ranobe_blocks import stream_blocks
 # from app.scaners.ranobe import scan_ranobes, scan_ranobes_single
 
 ranobe = FastAPI()
@@ -21,33 +23,44 @@ async def endpoint_rescan_single( name: str ):
 
 
 @ranobe.get( '/filters' )
-async def endpoint_filters():
-    filters = await get_filters()
+async def endpoint_filters( request: Request ):
+    # ?genres[]=1&genres[]=2 adds live counts of every facet value for that selection
+    selection = parse_query( request.query_params )
+    filters = await get_filters( selection )
     return PJSONResponse( filters )
 
 
 @ranobe.get( '/list' )
-async def endpoint_list( request: Request, offset: int = 0, limit: int = 50 ):
+async def endpoint_list( request: Request, offset: int = 0, limit: int = 50, cursor: str | None = None ):
     filters = parse_query( request.query_params )
-    del filters['offset']
-    del filters['limit']
-    ranobes = await get_list( offset, limit, filters )
+    filters.pop( 'offset', None )
+    filters.pop( 'limit', None )
+    filters.pop( 'cursor', None )
+    ranobes = await get_list( offset, limit, filters, cursor )
     return PJSONResponse( ranobes )
 
 
 @ranobe.get( '/{ranobe_slug}' )
-async def endpoint_single( ranobe_slug: str ):
-    response = await get_single( ranobe_slug )
-    return PJSONResponse( response )
+async def endpoint_single( request: Request, ranobe_slug: str ):
+    response = await get_single( ranobe_slug, accepted_encoding( request.headers.get( 'accept-encoding', '' ) ) )
+    return PJSONResponse( response, negotiated=True )
 
 
 @ranobe.get( '/{ranobe_slug}/reader' )
-async def endpoint_reader( ranobe_slug: str ):
-    response = await get_reader( ranobe_slug )
-    return PJSONResponse( response )
+async def endpoint_reader( request: Request, ranobe_slug: str ):
+    response = await get_reader( ranobe_slug, accepted_encoding( request.headers.get( 'accept-encoding', '' ) ) )
+    return PJSONResponse( response, negotiated=True )
 
 
 @ranobe.get( '/{ranobe_slug}/reader/chapter/{chapter_id}' )
-async def endpoint_reader( chapter_id: int ):
-    response = await get_reader_chapter_content( chapter_id )
-    return PJSONResponse( response )
\ No newline at end of file
+async def endpoint_reader_chapter( request: Request, chapter_id: int, block_from: int = 0, block_to: int | None = None, branch: int | None = None ):
+    response = await get_reader_chapter_content( chapter_id, max( 0, block_from ), block_to, branch )
+    if response is None:
+        return PJSONResponse( '{}' )
+    head, blocks, tail = response
+    # stored zstd frames go out untouched when client can inflate them itself
+    zstd = accepted_encoding( request.headers.get( 'accept-encoding', '' ), ( 'zstd', ) ) is not None
+    headers = { 'Vary': 'Accept-Encoding' }
+    if zstd:
+        headers['Content-Encoding'] = 'zstd'
+    return StreamingResponse( stream_blocks( head, blocks, tail, zstd ), media_type='application/json', headers=headers )
\ No newline at end of file
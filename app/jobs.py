@@ -0,0 +1,299 @@
+import os
+import time
+import socket
+import asyncio
+import orjson
+from typing import Self, Dict, Any, Callable
+
+from app.db import RD
+
+JOB_KEYS = {
+    'id': 'scan-jobs-id',
+    'queue': 'scan-jobs-queue',
+    'job': 'scan-job-{}',
+    'coalesce': 'scan-job-key-{}-{}',
+    'worker': 'scan-worker-{}',
+    'running': 'scan-jobs-running',
+}
+
+JOB_MEDIA = [ 'manga', 'anime' ]
+
+# whole library scan
+JOB_FULL = '*'
+
+JOB_TTL = 86400
+WORKER_LOCK_TTL = 30
+# running job without heartbeat for this long lost its worker
+JOB_STALE = WORKER_LOCK_TTL * 2
+PROGRESS_INTERVAL = 1
+
+
+async def enqueue_scan(
+    media: str,
+    name: str = JOB_FULL
+) -> bytes:
+
+    if media not in JOB_MEDIA:
+        return orjson.dumps( { 'error': f'Unknown media {media}' } )
+
+    coalesce_key = JOB_KEYS['coalesce'].format( media, name )
+
+    # same title is already waiting in queue
+    job_id = await RD.get( coalesce_key )
+    if job_id:
+        if await RD.hget( JOB_KEYS['job'].format( job_id ), 'status' ) == 'queued':
+            return await get_scan_job( job_id )
+        # job was picked up or is gone, key is left over
+        await RD.delete( coalesce_key )
+
+    job_id = str( await RD.incr( JOB_KEYS['id'] ) )
+
+    if not await RD.set( coalesce_key, job_id, nx=True, ex=JOB_TTL ):
+        # lost the race to a concurrent request
+        return await get_scan_job( await RD.get( coalesce_key ) )
+
+    now = time.time()
+    await RD.hset(
+        JOB_KEYS['job'].format( job_id ),
+        mapping={
+            'id': job_id,
+            'media': media,
+            'name': name,
+            'status': 'queued',
+            'phase': '',
+            'done': 0,
+            'total': 0,
+            'created': now,
+            'started': 0,
+            'heartbeat': 0,
+            'phase_started': 0,
+            'finished': 0,
+            'error': '',
+        }
+    )
+    await RD.expire( JOB_KEYS['job'].format( job_id ), JOB_TTL )
+    await RD.rpush( JOB_KEYS['queue'], job_id )
+
+    return await get_scan_job( job_id )
+
+
+async def get_scan_job(
+    job_id: str
+) -> bytes:
+
+    job = await RD.hgetall( JOB_KEYS['job'].format( job_id ) )
+
+    if not job:
+        return b'{}'
+
+    done = int( job['done'] )
+    total = int( job['total'] )
+    phase_started = float( job['phase_started'] )
+    finished = float( job['finished'] )
+
+    throughput = 0
+    eta = None
+
+    if phase_started and done > 0:
+        elapsed = ( finished or time.time() ) - phase_started
+        if elapsed > 0:
+            throughput = done / elapsed
+            if job['status'] == 'running' and total >= done:
+                eta = ( total - done ) / throughput
+
+    return orjson.dumps({
+        'id': job['id'],
+        'media': job['media'],
+        'name': '' if job['name'] == JOB_FULL else job['name'],
+        'status': job['status'],
+        'phase': job['phase'],
+        'done': done,
+        'total': total,
+        'throughput': round( throughput, 2 ),
+        'eta': round( eta ) if eta is not None else None,
+        'created': float( job['created'] ),
+        'started': float( job['started'] ),
+        'finished': finished,
+        'error': job['error'],
+    })
+
+
+def execute_scan(
+    media: str,
+    name: str,
+    progress: Callable[ [ str, int, int ], None ]
+) -> Any:
+
+    if media == 'manga':
+        from app.scaners.manga import MangaScaner
+        scaner = MangaScaner()
+    else:
+        from app.scaners.anime import AnimeScaner
+        scaner = AnimeScaner()
+
+    scaner.progress = progress
+
+    if name == JOB_FULL:
+        return scaner.run()
+    return scaner.run_single( name )
+
+
+class JobProgress:
+
+    key: str
+    loop: asyncio.AbstractEventLoop
+    phase: str
+    reported: float
+
+    def __init__(
+        self: Self,
+        job_id: str,
+        loop: asyncio.AbstractEventLoop
+    ) -> None:
+        self.key = JOB_KEYS['job'].format( job_id )
+        self.loop = loop
+        self.phase = ''
+        self.reported = 0
+
+    def __call__(
+        self: Self,
+        phase: str,
+        done: int = 0,
+        total: int = 0
+    ) -> None:
+        # called from scan thread, writes are throttled except for phase switches
+        now = time.time()
+        mapping = { 'done': done, 'total': total }
+
+        if phase != self.phase:
+            self.phase = phase
+            mapping['phase'] = phase
+            mapping['phase_started'] = now
+        elif now - self.reported < PROGRESS_INTERVAL and done < total:
+            return
+
+        self.reported = now
+        asyncio.run_coroutine_threadsafe( RD.hset( self.key, mapping=mapping ), self.loop )
+
+
+async def run_scan_job(
+    job_id: str
+) -> None:
+    from app.warmer import warm_changed
+
+    key = JOB_KEYS['job'].format( job_id )
+    job = await RD.hgetall( key )
+
+    if not job or job['status'] != 'queued':
+        return
+
+    # new requests for the same title must create a new job from now on
+    await RD.delete( JOB_KEYS['coalesce'].format( job['media'], job['name'] ) )
+    now = time.time()
+    await RD.hset( key, mapping={ 'status': 'running', 'started': now, 'heartbeat': now } )
+    await RD.sadd( JOB_KEYS['running'], job_id )
+
+    print(f"Scan job {job_id} started: {job['media']} {job['name']}")
+
+    heartbeat = asyncio.create_task( keep_job_alive( key ) )
+    try:
+        progress = JobProgress( job_id, asyncio.get_running_loop() )
+        await asyncio.to_thread( execute_scan, job['media'], job['name'], progress )
+        await warm_changed( job['media'], progress )
+        await RD.hset( key, mapping={ 'status': 'done', 'finished': time.time() } )
+    except Exception as e:
+        print(f"Scan job {job_id} failed: {e}")
+        await RD.hset( key, mapping={ 'status': 'failed', 'finished': time.time(), 'error': str( e ) } )
+    finally:
+        heartbeat.cancel()
+
+    await RD.srem( JOB_KEYS['running'], job_id )
+    await RD.expire( key, JOB_TTL )
+
+
+async def keep_job_alive(
+    key: str
+) -> None:
+    # scan thread can be silent for long, so liveness is not taken from progress
+    while True:
+        await asyncio.sleep( WORKER_LOCK_TTL / 3 )
+        await RD.hset( key, 'heartbeat', time.time() )
+
+
+async def sweep_stale_jobs() -> None:
+    # jobs of a worker that died mid scan would stay running forever
+    now = time.time()
+    for job_id in await RD.smembers( JOB_KEYS['running'] ):
+        key = JOB_KEYS['job'].format( job_id )
+        job = await RD.hgetall( key )
+        if not job or job['status'] != 'running':
+            await RD.srem( JOB_KEYS['running'], job_id )
+            continue
+        heartbeat = float( job.get( 'heartbeat' ) or job['started'] )
+        if now - heartbeat < JOB_STALE:
+            continue
+        print(f"Scan job {job_id} lost its worker: {job['media']} {job['name']}")
+        await RD.hset( key, mapping={ 'status': 'failed', 'finished': now, 'error': 'Worker stopped during scan' } )
+        await RD.expire( key, JOB_TTL )
+        await RD.srem( JOB_KEYS['running'], job_id )
+        coalesce_key = JOB_KEYS['coalesce'].format( job['media'], job['name'] )
+        if await RD.get( coalesce_key ) == job_id:
+            await RD.delete( coalesce_key )
+
+
+async def run_scan_worker() -> None:
+    # every uvicorn worker starts this loop, but only the lock holder processes the queue
+    from app.watcher import run_watcher
+
+    lock_key = JOB_KEYS['worker'].format( socket.gethostname() )
+    owner = str( os.getpid() )
+
+    while True:
+        try:
+            if await RD.set( lock_key, owner, nx=True, ex=WORKER_LOCK_TTL ):
+                await sweep_stale_jobs()
+                lost = asyncio.Event()
+                heartbeat = asyncio.create_task( keep_worker_lock( lock_key, owner, lost ) )
+                # library watcher lives with the queue, so fs events are handled once per host
+                watcher = asyncio.create_task( run_watcher() )
+                try:
+                    while not lost.is_set():
+                        item = await RD.blpop( [ JOB_KEYS['queue'] ], timeout=5 )
+                        if item is None:
+                            continue
+                        if lost.is_set():
+                            # another process owns the queue now, job goes back for it
+                            await RD.lpush( JOB_KEYS['queue'], item[1] )
+                            break
+                        await run_scan_job( item[1] )
+                    print(f"Scan worker {owner} lost queue lock")
+                finally:
+                    heartbeat.cancel()
+                    watcher.cancel()
+                    if await RD.get( lock_key ) == owner:
+                        await RD.delete( lock_key )
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            print(f"Scan worker error: {e}")
+
+        await asyncio.sleep( WORKER_LOCK_TTL / 3 )
+
+
+async def keep_worker_lock(
+    lock_key: str,
+    owner: str,
+    lost: asyncio.Event
+) -> None:
+    while True:
+        await asyncio.sleep( WORKER_LOCK_TTL / 3 )
+        try:
+            if await RD.get( lock_key ) == owner:
+                await RD.expire( lock_key, WORKER_LOCK_TTL )
+            elif not await RD.set( lock_key, owner, nx=True, ex=WORKER_LOCK_TTL ):
+                lost.set()
+                return
+        except Exception as e:
+            print(f"Scan worker lock renewal failed: {e}")
+            lost.set()
+            return
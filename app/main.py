@@ -3,7 +3,6 @@ import sys
 import ujson
 import asyncio
 import shutil
-import timeit
 
 from contextlib import asynccontextmanager
 from typing import Dict, List
@@ -32,7 +31,10 @@ from starlette.staticfiles import StaticFiles
 # from app.routers import MiscRequests
 from app.dependencies import PJSONResponse
 from app.dependencies import update_db
-from app.db import DB, RD
+from app.db import DB, RD, RDB, async_engine
+from app.jobs import run_scan_worker
+from app.cache import listen_invalidations
+from app.suggest import run_suggest_index, suggest
 from app import schemas
 from app import models
 
@@ -80,11 +82,18 @@ async def lifespan( app: FastAPI ):
     # await reset_notifications()
     # await reset_animes()
     # await reset_mangas()
-    benchmark()
-    # test()
+    scan_worker = asyncio.create_task( run_scan_worker() )
+    cache_listener = asyncio.create_task( listen_invalidations() )
+    suggest_listener = asyncio.create_task( run_suggest_index() )
     yield
+    suggest_listener.cancel()
+    cache_listener.cancel()
+    scan_worker.cancel()
+    await async_engine.dispose()
     if RD is not None:
         await RD.close()
+    if RDB is not None:
+        await RDB.close()
 
 # platform_dependent = 'public' if os.name == 'nt' else ''
 base_folder = os.path.dirname(__file__)
@@ -152,35 +161,22 @@ app.add_middleware(
 #     return Response(content=response, media_type="application/json")
 
 
-# @app.post('/api/search', response_model=schemas.SearchResponse)
-# async def endpoint_search(request: Request):
+@app.get('/api/suggest')
+async def endpoint_suggest( q: str = '', limit: int = 10 ):
+    # answered from in-memory trigram index, no database round trip
+    return ORJSONResponse( suggest( q, max( 1, min( limit, 50 ) ) ) )
 
-#     from app.crud.manga import search as search_manga
-#     from app.crud.anime import search as search_anime
-#     from app.crud.ranobe import search as search_ranobe
 
-#     payload = await request.json()
+@app.post('/api/search', response_model=schemas.SearchResponse)
+async def endpoint_search(request: Request):
 
-#     result = {
-#         "anime": [],
-#         "manga": [],
-#         "ranobe": [],
-#         "found": 0
-#     }
+    from app.crud.search import federated_search
 
-#     if 'search' in payload and payload['search']:
-#         anime, manga, ranobe = await asyncio.gather(
-#             search_anime( payload['search'] ),
-#             search_manga( payload['search'] ),
-#             search_ranobe( payload['search'] )
-#         )
+    payload = await request.json()
 
-#         result["anime"] = anime
-#         result["manga"] = manga
-#         result["ranobe"] = ranobe
-#         result["found"] = len( anime ) + len( manga ) + len( ranobe )
+    result = await federated_search( str( payload.get( 'search' ) or '' ) )
 
-#     return ORJSONResponse( result )
+    return PJSONResponse( result )
 
 
 # # SPA
@@ -202,74 +198,3 @@ app.add_middleware(
 def noprint( *args, **kwargs ):
     pass
 
-
-def benchmark():
-    iters = 1000
-    total_time = timeit.timeit( test, number=iters )
-    iter_time = total_time / iters
-    print(f'total: {total_time}, per_cycle:{iter_time}')
-
-
-def test():
-
-    from app.crud.ranobe import get_reader_navigation
-    asyncio.create_task( get_reader_navigation('beginning-after-the-end') )
-    # s = DB()
-
-    # manga = s.execute(
-    #     select(
-    #         models.Manga
-    #     )
-    #     .distinct()
-    #     .options(
-    #         joinedload(
-    #             models.Manga.branches
-    #         )
-    #             .options(
-    #                 joinedload(
-    #                     models.MangaTranslationBranche.team
-    #                 )
-    #             ),
-    #         joinedload(
-    #             models.Manga.volumes
-    #         )
-    #             .options(
-    #                 joinedload(
-    #                     models.MangaVolume.chapters
-    #                 )
-    #             ),
-    #     )
-    #     .filter(
-    #         models.Manga.id==1
-    #     )
-    # ).unique().scalar_one_or_none()
-
-    # print('#manga')
-    # print(manga)
-    # print('\t','#branches')
-    # print('\t',manga.branches)
-    # for branch in manga.branches:
-    #     print('\t\t',branch)
-    #     print('\t\t\t',branch.team)
-    # # print('\t','#volumes')
-    # # print('\t',manga.volumes)
-    # print('\t','#chapters')
-    # for volume in manga.volumes:
-    #     # print('\t\t',volume)
-    #     for chapter in volume.chapters:
-    #         print('\t\t',chapter)
-    # # print(manga)
-    # # print('#covers')
-    # # print(manga.covers)
-    # # print('#background')
-    # # print(manga.background)
-    # # print('#branches')
-    # # for branch in manga.branches:
-    # #     print(branch)
-    # #     print('\t',branch.team)
-    # # print('#volumes')
-    # # for volume in manga.volumes:
-    # #     print(volume)
-    # #     print('\t',volume.chapters)
-
-    # s.close()
\ No newline at end of file
@@ -5,7 +5,7 @@ from typing import List, Dict, Any
 from datetime import datetime
 from sqlalchemy import Table, Column
 from sqlalchemy import SmallInteger, Integer, BigInteger, Float, String, Text, Boolean, Date, DateTime, Computed, JSON, UniqueConstraint, ForeignKey, Index
-from sqlalchemy.dialects.mysql import TIMESTAMP
+from sqlalchemy.dialects.mysql import TIMESTAMP, MEDIUMBLOB
 from sqlalchemy.orm import relationship
 from sqlalchemy.orm import Mapped
 from app.db import DB
@@ -624,6 +624,13 @@ class RanobeChapterBranch(Base):
             JSON,
             default={}
         )
+    # kept by mysql on every write, blocks packed from other content are stale
+    content_hash: Mapped[ str ] =\
+        Column(
+            "content_hash",
+            String(32),
+            Computed( "MD5(content)", persisted=True )
+        )
 
     branch: Mapped[ RanobeTranslationBranche ] = relationship(
         "RanobeTranslationBranche",
@@ -637,4 +644,64 @@ class RanobeChapterBranch(Base):
     def __repr__(
         self
     ) -> str:
-        return f'(RanobeChapterBranch chapter_id:{self.chapter_id}, branch:{self.branch_id}, team:{self.branch.team.name})'
\ No newline at end of file
+        return f'(RanobeChapterBranch chapter_id:{self.chapter_id}, branch:{self.branch_id}, team:{self.branch.team.name})'
+
+
+# Содержимое глав блоками: zstd кадры с JSON узлов без обрамляющих скобок
+class RanobeChapterBlock(Base):
+    __tablename__ = "ranobes_chapters_blocks"
+    __table_args__ = (
+        UniqueConstraint("data_id", "number", name="rcb_data_number_uniq"),
+    )
+
+    id: Mapped[ int ] =\
+        Column(
+            "id",
+            BigInteger,
+            primary_key=True
+        )
+    data_id: Mapped[ int ] =\
+        Column(
+            "data_id",
+            BigInteger,
+            ForeignKey( "ranobes_chapters_datas.id", ondelete="cascade" ),
+            index=True
+        )
+    number: Mapped[ int ] =\
+        Column(
+            "number",
+            Integer
+        )
+    # index of first content node in block
+    first: Mapped[ int ] =\
+        Column(
+            "first",
+            Integer
+        )
+    count: Mapped[ int ] =\
+        Column(
+            "count",
+            Integer
+        )
+    size: Mapped[ int ] =\
+        Column(
+            "size",
+            Integer
+        )
+    data: Mapped[ bytes ] =\
+        Column(
+            "data",
+            MEDIUMBLOB
+        )
+    # content_hash of chapter data blocks were packed from
+    source: Mapped[ str ] =\
+        Column(
+            "source",
+            String(32),
+            default=""
+        )
+
+    def __repr__(
+        self
+    ) -> str:
+        return f'(RanobeChapterBlock data_id:{self.data_id}, number:{self.number}, nodes:{self.first}+{self.count}, size:{self.size})'
\ No newline at end of file
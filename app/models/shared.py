@@ -23,6 +23,7 @@ BASE_FS_PATH      = os.path.join( os.path.dirname(__file__).split('app')[0], 'ap
 WEB_FS_PATH       = os.path.join( BASE_FS_PATH, 'web' )
 COVERS_FS_PATH    = os.path.join( WEB_FS_PATH, COVERS_FOLDER )
 DOWNLOADS_FS_PATH = os.path.join( WEB_FS_PATH, DOWNLOADS_FOLDER )
+CACHE_FS_PATH     = os.path.join( BASE_FS_PATH, 'cache' )
 
 COVERS_WEB_PATH   = f'{DEV_URL}/{COVERS_FOLDER}'
 DOWNLOAD_WEB_PATH = f'{DEV_URL}/{DOWNLOADS_FOLDER}'
@@ -39,9 +40,26 @@ BOOKS_WEB_PATH  = f'{DOWNLOAD_WEB_PATH}/{BOOKS_FOLDER}'
 
 
 COVERS_EXTS = [ '.jpg', '.jpeg', '.png', '.webp' ]
+# cover variants, rendered next to original as <hash>.<size>.<format>
+COVER_VARIANTS = {
+    'mini': ( 175, 250 ),
+    'card': ( 350, 500 ),
+    'full': ( 1400, 2000 ),
+}
+COVER_FORMATS = [ 'webp', 'avif' ]
+COVER_FORMAT_FLAGS = {
+    'webp': 1,
+    'avif': 2,
+}
+COVER_FORMAT_OPTIONS = {
+    'webp': { 'quality': 80, 'method': 4 },
+    'avif': { 'quality': 60, 'speed': 6 },
+}
 MANGA_EXTS = [ '.cbz', '.pdf' ]
 ANIME_EXTS = [ '.avi', '.mkv', '.mp4' ]
 MANGA_IMAGES_EXTS = [ '.jpg', '.jpeg', '.png', '.gif', '.webp' ]
+# already compressed formats, deflate only burns cpu on them
+MANGA_STORED_EXTS = [ '.jpg', '.jpeg', '.png', '.webp' ]
 
 #
 
@@ -197,6 +215,21 @@ class Image(Base):
             Text,
             default=""
         )
+    # xxh3_128 of file content
+    hash: Mapped[ str ] =\
+        Column(
+            "hash",
+            String(32),
+            default="",
+            index=True
+        )
+    # COVER_FORMAT_FLAGS of rendered variants
+    variants: Mapped[ int ] =\
+        Column(
+            "variants",
+            SmallInteger,
+            default=0
+        )
     
     def __repr__(
         self
@@ -215,16 +248,38 @@ class Image(Base):
             return ''
         return os.path.join( COVERS_FS_PATH, 'mini', self.filename[0:2], self.filename )
 
+    def variant_link(self, size: str, format: str = 'webp') -> str:
+        if not self.filename or not ( self.variants or 0 ) & COVER_FORMAT_FLAGS[ format ]:
+            return ''
+        stem, _ = os.path.splitext( self.filename )
+        return f'{COVERS_WEB_PATH}/full/{self.filename[0:2]}/{stem}.{size}.{format}'
+
     @property
     def cover_link_full(self) -> str:
         # fs_path = self.fs_path_full
         # if not fs_path or not os.path.exists( fs_path ):
         #     return ''
-        return f'{COVERS_WEB_PATH}/full/{self.filename[0:2]}/{self.filename}'
+        return self.variant_link( 'full' ) or f'{COVERS_WEB_PATH}/full/{self.filename[0:2]}/{self.filename}'
+
+    @property
+    def cover_link_card(self) -> str:
+        return self.variant_link( 'card' ) or self.cover_link_full
 
     @property
     def cover_link_mini(self) -> str:
         # fs_path = self.fs_path_mini
         # if not fs_path or not os.path.exists( fs_path ):
         #     return ''
-        return f'{COVERS_WEB_PATH}/mini/{self.filename[0:2]}/{self.filename}'
\ No newline at end of file
+        # until variants are rendered, or when rendering failed, original is the only file that surely exists
+        return self.variant_link( 'mini' ) or self.cover_link_full
+
+    @property
+    def cover_sources(self) -> Dict[ str, Dict[ str, str ] ]:
+        # size -> format -> link, for <picture> sources
+        result = {}
+        for size in COVER_VARIANTS.keys():
+            links = { format: self.variant_link( size, format ) for format in COVER_FORMATS }
+            links = { x:y for x,y in links.items() if y }
+            if links:
+                result[ size ] = links
+        return result
@@ -2,7 +2,7 @@ from __future__ import annotations
 
 import os
 import multiprocessing
-from typing import Self, List, Dict, Any, Callable
+from typing import Self, List, Dict, Set, Any, Callable
 from concurrent.futures import ProcessPoolExecutor
 from sqlalchemy import select, delete, or_, and_
 from sqlalchemy.orm import Session
@@ -11,34 +11,45 @@ from app import models
 from app import db
 
 from ..base import BaseScaner
+from ..bulk import BulkWriter
+from ..tools import MediaInfoCache
 from .objects import *
 from .scaner import *
 
-def scan_animes():
+def scan_animes( bulk: bool = True ):
     
-    scaner = AnimeScaner()
+    scaner = AnimeScaner( bulk )
     scaner.run()
 
-def scan_animes_single(name: str):
+def scan_animes_single( name: str, bulk: bool = True ):
     
-    scaner = AnimeScaner()
-    scaner.run_single(name)
+    scaner = AnimeScaner( bulk )
+    scaner.run_single( name )
 
 
 class AnimeScaner(
     BaseScaner
 ):
 
+    mediainfo: MediaInfoCache
+    # titles scanned successfully during current run
+    scanned: Set[ str ]
+    bulk: bool
+    media: str = 'anime'
+
     def __init__(
-        self: Self
+        self: Self,
+        bulk: bool = True
     ) -> None:
-        pass
+        self.mediainfo = MediaInfoCache()
+        self.scanned = set()
+        self.bulk = bulk
     
+    @staticmethod
     def __run_scaner_instance__(
-        self: Self,
-        payload: Dict[ str, str]
-    ) -> Dict:
-        scanner = SingleAnimeScaner()
+        payload: Dict[ str, Any ]
+    ) -> Anime:
+        scanner = SingleAnimeScaner( payload.get('mediainfo') )
         if 'folder' in payload:
             return scanner.run_folder( payload['root_dir'], payload['folder'] )
         elif 'file' in payload:
@@ -56,8 +67,11 @@ class AnimeScaner(
             max_processes = 1
         if max_processes > 8:
             max_processes = 8
+
+        self.mediainfo.load()
+        known = self.mediainfo.split( scan_path )
         
-        payloads: List[ Dict[ str, str ] ] = []
+        payloads: List[ Dict[ str, Any ] ] = []
 
         for element in scan_results:
             if os.path.isfile( os.path.join( scan_path, element ) ):
@@ -67,6 +81,7 @@ class AnimeScaner(
                         {
                             "root_dir":scan_path,
                             "file":element,
+                            "mediainfo":MediaInfoCache( known.get( element, {} ) ),
                         }
                     )
             else:
@@ -74,15 +89,37 @@ class AnimeScaner(
                     {
                         "root_dir":scan_path,
                         "folder":element,
+                        "mediainfo":MediaInfoCache( known.get( element, {} ) ),
                     }
                 )
         
-        results: List[ Anime ] = []
-        
-        with ProcessPoolExecutor(max_workers=max_processes) as runner:
-            results = list( runner.map( self.__run_scaner_instance__, payloads ) )
+        # full scan touches every file, so cache is rebuilt from worker results
+        self.mediainfo = MediaInfoCache()
+        self.scanned = set()
+
+        done = 0
+        self.report( 'scan', done, len( payloads ) )
 
-        self.save( results )
+        # save titles as soon as they are scanned
+        for results in self.stream( self.__run_scaner_instance__, payloads, max_processes ):
+            self.collectMediainfo( results )
+            self.save( results )
+            done += len( results )
+            self.report( 'scan', done, len( payloads ) )
+
+        # titles whose worker failed keep their probes for the next run
+        for payload in payloads:
+            title = payload.get( 'folder', payload.get( 'file' ) )
+            if title not in self.scanned:
+                self.mediainfo.entries.update( known.get( title, {} ) )
+
+        self.finishCovers()
+
+        self.finishCatalog()
+
+        self.reportBulk( 'Anime' )
+
+        self.saveMediainfo()
 
 
     def run_single(
@@ -93,6 +130,9 @@ class AnimeScaner(
 
         payloads: List[ Dict[ str, str ] ] = []
 
+        self.mediainfo.load()
+        known = self.mediainfo.split( models.ANIME_FS_PATH )
+
         if os.path.isfile( scan_path ):
             _, ext = os.path.splitext( scan_path )
             if ext in models.ANIME_EXTS:
@@ -100,6 +140,7 @@ class AnimeScaner(
                     {
                         "root_dir":models.ANIME_FS_PATH,
                         "file":name,
+                        "mediainfo":MediaInfoCache( known.get( name, {} ) ),
                     }
                 )
         else:
@@ -107,15 +148,45 @@ class AnimeScaner(
                 {
                     "root_dir":models.ANIME_FS_PATH,
                     "folder":name,
+                    "mediainfo":MediaInfoCache( known.get( name, {} ) ),
                 }
             )
         
-        results: List[ Anime ] = []
-        
-        with ProcessPoolExecutor(max_workers=1) as runner:
-            results = list( runner.map( self.__run_scaner_instance__, payloads ) )
+        self.report( 'scan', 0, len( payloads ) )
+
+        for results in self.stream( self.__run_scaner_instance__, payloads, 1 ):
+            self.collectMediainfo( results )
+            self.save( results )
+            self.report( 'scan', len( results ), len( payloads ) )
 
-        self.save( results )
+        self.finishCovers()
+
+        self.finishCatalog()
+
+        self.reportBulk( 'Anime' )
+
+        self.saveMediainfo()
+
+
+    def collectMediainfo(
+        self: Self,
+        results: List[ Anime ]
+    ):
+        for anime in results:
+            if anime and anime.mediainfo:
+                self.mediainfo.merge( anime.mediainfo )
+                self.scanned.add( anime.folder or anime.filename )
+                # no need to send it back to db saver
+                anime.mediainfo = None
+
+
+    def saveMediainfo(
+        self: Self
+    ):
+        self.mediainfo.save()
+
+        stats = self.mediainfo.stats()
+        print(f"MediaInfo cache: {stats['hits']} hits, {stats['misses']} misses, {stats['entries']} entries")
 
 
     # 
@@ -125,6 +196,11 @@ class AnimeScaner(
         self: Self,
         results: List[ Anime ] = []
     ):
+        if self.bulk:
+            self.saveBulk( results )
+            self.collectChanged( self.changedSlugs( results ) )
+            return
+
         self.session = db.DB()
 
         for anime in results:
@@ -135,6 +211,305 @@ class AnimeScaner(
                     self.saveAnimeSeria( seria, db_season )
         
         self.session.close()
+        self.collectChanged( self.changedSlugs( results ) )
+
+
+    def changedSlugs(
+        self: Self,
+        results: List[ Anime ]
+    ) -> List[ str ]:
+        # seasons are stored as anime_slug/season_slug
+        slugs = []
+        for anime in results:
+            if anime:
+                slugs.append( anime.slug )
+                for _, season in anime.seasons.items():
+                    slugs.append( f'{anime.slug}/{season.slug}' )
+        return slugs
+
+
+    def saveBulk(
+        self: Self,
+        results: List[ Anime ] = []
+    ):
+        results = [ anime for anime in results if anime ]
+        if len( results ) == 0:
+            return
+
+        self.session = db.DB()
+        writer = BulkWriter( self.session )
+
+        # animes
+
+        with writer.phase( 'animes' ):
+            animes_ids = writer.fetchIds(
+                lambda chunk: select(
+                    models.Anime.id,
+                    models.Anime.path,
+                    models.Anime.filename
+                )\
+                .filter(
+                    models.Anime.path.in_( chunk )
+                ),
+                [ anime.folder for anime in results ]
+            )
+
+            inserts = []
+            updates = []
+            for anime in results:
+                row = {
+                    'path': anime.folder,
+                    'filename': anime.filename,
+                    'name': anime.name,
+                    'eng_name': anime.eng_name,
+                    'slug': anime.slug,
+                    'filesize': anime.filesize,
+                }
+                cover_id = self.saveFirstCover( anime.covers )
+                if cover_id:
+                    row['cover_id'] = cover_id
+                if ( anime.folder, anime.filename ) in animes_ids:
+                    row['id'] = animes_ids[ ( anime.folder, anime.filename ) ]
+                    updates.append( row )
+                else:
+                    inserts.append( row )
+
+            writer.upsert( models.Anime, updates )
+            writer.insert( models.Anime, inserts )
+
+            new_ids = writer.fetchIds(
+                lambda chunk: select(
+                    models.Anime.id,
+                    models.Anime.path,
+                    models.Anime.filename
+                )\
+                .filter(
+                    models.Anime.path.in_( chunk )
+                ),
+                [ row['path'] for row in inserts ]
+            )
+            new_ids = { x:y for x,y in new_ids.items() if x not in animes_ids }
+            animes_ids.update( new_ids )
+
+            # Add notifications for new animes
+            writer.insert(
+                models.Notification,
+                [ { 'action': 'new', 'target': 'Anime', 'target_id': x } for x in new_ids.values() ]
+            )
+
+        # seasons
+
+        with writer.phase( 'seasons' ):
+            ids = [ animes_ids[ ( anime.folder, anime.filename ) ] for anime in results ]
+
+            seasons_ids = writer.fetchIds(
+                lambda chunk: select(
+                    models.AnimeSeason.id,
+                    models.AnimeSeason.anime_id,
+                    models.AnimeSeason.path,
+                    models.AnimeSeason.filename
+                )\
+                .filter(
+                    models.AnimeSeason.anime_id.in_( chunk )
+                ),
+                ids
+            )
+
+            inserts = []
+            updates = []
+            for anime in results:
+                anime_id = animes_ids[ ( anime.folder, anime.filename ) ]
+                for _, season in anime.seasons.items():
+                    row = {
+                        'anime_id': anime_id,
+                        'path': season.folder,
+                        'number': season.number,
+                        'name': season.name,
+                        'eng_name': season.eng_name,
+                        'slug': season.slug,
+                        'filename': season.filename,
+                        'filesize': season.filesize,
+                    }
+                    cover_id = self.saveFirstCover( season.covers )
+                    if cover_id:
+                        row['cover_id'] = cover_id
+                    key = ( anime_id, season.folder, season.filename )
+                    if key in seasons_ids:
+                        row['id'] = seasons_ids[ key ]
+                        updates.append( row )
+                    else:
+                        inserts.append( row )
+
+            writer.upsert( models.AnimeSeason, updates )
+            writer.insert( models.AnimeSeason, inserts )
+
+            new_ids = writer.fetchIds(
+                lambda chunk: select(
+                    models.AnimeSeason.id,
+                    models.AnimeSeason.anime_id,
+                    models.AnimeSeason.path,
+                    models.AnimeSeason.filename
+                )\
+                .filter(
+                    models.AnimeSeason.anime_id.in_( chunk )
+                ),
+                set( [ row['anime_id'] for row in inserts ] )
+            )
+            new_ids = { x:y for x,y in new_ids.items() if x not in seasons_ids }
+            seasons_ids.update( new_ids )
+
+            # Add notifications for new seasons
+            writer.insert(
+                models.Notification,
+                [ { 'action': 'new', 'target': 'AnimeSeason', 'target_id': x } for x in new_ids.values() ]
+            )
+
+        # series
+
+        with writer.phase( 'series' ):
+            scanned = []
+            for anime in results:
+                anime_id = animes_ids[ ( anime.folder, anime.filename ) ]
+                for _, season in anime.seasons.items():
+                    scanned.append( seasons_ids[ ( anime_id, season.folder, season.filename ) ] )
+
+            series_ids = writer.fetchIds(
+                lambda chunk: select(
+                    models.AnimeSeria.id,
+                    models.AnimeSeria.season_id,
+                    models.AnimeSeria.filename
+                )\
+                .filter(
+                    models.AnimeSeria.season_id.in_( chunk )
+                ),
+                scanned
+            )
+
+            inserts = []
+            updates = []
+            keep = set()
+            for anime in results:
+                anime_id = animes_ids[ ( anime.folder, anime.filename ) ]
+                for _, season in anime.seasons.items():
+                    season_id = seasons_ids[ ( anime_id, season.folder, season.filename ) ]
+                    for _, seria in season.series.items():
+                        row = {
+                            'season_id': season_id,
+                            'number': seria.number,
+                            'name': seria.name,
+                            'eng_name': seria.eng_name,
+                            'filename': seria.filename,
+                            'filesize': seria.filesize,
+                        }
+                        key = ( season_id, seria.filename )
+                        keep.add( key )
+                        if key in series_ids:
+                            row['id'] = series_ids[ key ]
+                            updates.append( row )
+                        else:
+                            inserts.append( row )
+
+            # series which are gone from scanned seasons
+            writer.delete(
+                models.AnimeSeria,
+                models.AnimeSeria.id,
+                [ y for x,y in series_ids.items() if x not in keep ]
+            )
+            writer.upsert( models.AnimeSeria, updates )
+            writer.insert( models.AnimeSeria, inserts )
+
+            series_ids = writer.fetchIds(
+                lambda chunk: select(
+                    models.AnimeSeria.id,
+                    models.AnimeSeria.season_id,
+                    models.AnimeSeria.filename
+                )\
+                .filter(
+                    models.AnimeSeria.season_id.in_( chunk )
+                ),
+                scanned
+            )
+
+        # voices, studios and genres
+
+        with writer.phase( 'links' ):
+            voices = self.resolveTags( models.Voice, [ x for anime in results for x in anime.voices ] +\
+                [ x for anime in results for _, season in anime.seasons.items() for x in season.voices ] )
+            studios = self.resolveTags( models.Studio, [ x for anime in results for x in anime.studios ] +\
+                [ x for anime in results for _, season in anime.seasons.items() for x in season.studios ] )
+            genres = self.resolveTags( models.Genre, [ x for anime in results for x in anime.genres ] +\
+                [ x for anime in results for _, season in anime.seasons.items() for x in season.genres ] )
+
+            for table in [ models.AnimeVoices, models.AnimeStudios, models.AnimeGenres ]:
+                writer.delete( table, table.c.anime_id, ids )
+                writer.delete( table, table.c.season_id, scanned )
+
+            voices_rows = []
+            studios_rows = []
+            genres_rows = []
+            for anime in results:
+                anime_id = animes_ids[ ( anime.folder, anime.filename ) ]
+                for voice_id in set( [ voices[ x ] for x in anime.voices if x in voices ] ):
+                    voices_rows.append( { 'anime_id': anime_id, 'voice_id': voice_id } )
+                for studio_id in set( [ studios[ x ] for x in anime.studios if x in studios ] ):
+                    studios_rows.append( { 'anime_id': anime_id, 'studio_id': studio_id } )
+                for genre_id in set( [ genres[ x ] for x in anime.genres if x in genres ] ):
+                    genres_rows.append( { 'anime_id': anime_id, 'genre_id': genre_id } )
+                for _, season in anime.seasons.items():
+                    season_id = seasons_ids[ ( anime_id, season.folder, season.filename ) ]
+                    for voice_id in set( [ voices[ x ] for x in season.voices if x in voices ] ):
+                        voices_rows.append( { 'season_id': season_id, 'voice_id': voice_id } )
+                    for studio_id in set( [ studios[ x ] for x in season.studios if x in studios ] ):
+                        studios_rows.append( { 'season_id': season_id, 'studio_id': studio_id } )
+                    for genre_id in set( [ genres[ x ] for x in season.genres if x in genres ] ):
+                        genres_rows.append( { 'season_id': season_id, 'genre_id': genre_id } )
+
+            writer.insert( models.AnimeVoices, voices_rows )
+            writer.insert( models.AnimeStudios, studios_rows )
+            writer.insert( models.AnimeGenres, genres_rows )
+
+        # meta
+
+        with writer.phase( 'meta' ):
+            writer.delete( models.AnimeMeta, models.AnimeMeta.anime_id, ids )
+            writer.delete( models.AnimeSeasonMeta, models.AnimeSeasonMeta.season_id, scanned )
+            writer.delete( models.AnimeSeriaMeta, models.AnimeSeriaMeta.seria_id, series_ids.values() )
+
+            anime_meta = []
+            season_meta = []
+            seria_meta = []
+            for anime in results:
+                anime_id = animes_ids[ ( anime.folder, anime.filename ) ]
+                anime_meta += self.metaRows( 'anime_id', anime_id, anime.meta )
+                for _, season in anime.seasons.items():
+                    season_id = seasons_ids[ ( anime_id, season.folder, season.filename ) ]
+                    season_meta += self.metaRows( 'season_id', season_id, season.meta )
+                    for _, seria in season.series.items():
+                        seria_id = series_ids.get( ( season_id, seria.filename ) )
+                        if seria_id:
+                            seria_meta += self.metaRows( 'seria_id', seria_id, seria.meta )
+
+            writer.insert( models.AnimeMeta, anime_meta )
+            writer.insert( models.AnimeSeasonMeta, season_meta )
+            writer.insert( models.AnimeSeriaMeta, seria_meta )
+
+        self.collectBulk( writer )
+
+        self.session.close()
+
+
+    def metaRows(
+        self: Self,
+        owner_key: str,
+        owner_id: int,
+        meta: Meta
+    ) -> List[ Dict[ str, Any ] ]:
+        rows = []
+        for key in meta._fields_:
+            value = getattr( meta, key, None )
+            if value:
+                rows.append( { owner_key: owner_id, 'meta_key': key, 'meta_value': value } )
+        return rows
 
 
     def saveAnime(
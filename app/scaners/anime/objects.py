@@ -4,7 +4,7 @@ import re
 import os
 import glob
 import ujson
-from typing import Self, List, Dict
+from typing import Self, List, Dict, Any
 from app import models
 from app.tools import escape_glob
 
@@ -131,6 +131,8 @@ class Anime:
     filesize: int = 0
     #
     meta: Meta
+    # mediainfo probes made by worker
+    mediainfo: Any = None
 
     def __init__( self: Self ) -> None:
         self.path = ""
@@ -146,6 +148,7 @@ class Anime:
         self.filename = ""
         self.filesize = 0
         self.meta = Meta()
+        self.mediainfo = None
 
     def json( self: Self ) -> Dict:
         return {
@@ -12,19 +12,22 @@ from app import models
 from app.tools import format_float
 
 from .objects import *
-from ..tools import scan_mediainfo
+from ..tools import MediaInfoCache
 
 class SingleAnimeScaner:
 
     anime: Anime
     season_regex: re.Pattern
     seria_regex: re.Pattern
+    mediainfo: MediaInfoCache
     log: logging.Logger
 
     def __init__(
-        self: Self
+        self: Self,
+        mediainfo: MediaInfoCache | None = None
     ) -> None:
         self.anime = Anime()
+        self.mediainfo = mediainfo if mediainfo is not None else MediaInfoCache()
         self.anime_regex = re.compile("^(?P<anime_name>[^\[]+)")
         self.season_regex = re.compile("^(?P<season_number>\d+(\.\d+)?)\.\s*(?P<season_name>[^\[]+)")
         self.seria_regex = re.compile("^(?P<seria_number>\d+(\.\d+)?)\.?(?P<seria_name>.+)?\.\w+$")
@@ -57,6 +60,9 @@ class SingleAnimeScaner:
             self.anime.studios = list( set( [ *self.anime.studios, *ext_studios ] ) )
             self.anime.genres = list( set( [ *self.anime.genres, *ext_genres ] ) )
 
+        self.mediainfo.compact()
+        self.anime.mediainfo = self.mediainfo
+
         return self.anime
     
     def run_file(
@@ -71,6 +77,9 @@ class SingleAnimeScaner:
         self.log = logging.getLogger(__name__)
         self.scanAnimeFile( root_dir, file )
 
+        self.mediainfo.compact()
+        self.anime.mediainfo = self.mediainfo
+
         return self.anime
     
     def scanAnimeFile(
@@ -99,7 +108,7 @@ class SingleAnimeScaner:
                 self.anime.name = anime_name.strip()
                 self.anime.eng_name = anime_name.strip()
 
-        info = scan_mediainfo( scan_path )
+        info = self.mediainfo.probe( scan_path )
         self.anime.meta.from_mi( info )
 
         self.anime.checkCovers()
@@ -176,7 +185,7 @@ class SingleAnimeScaner:
             if season_number:
                 season.number = float( season_number )
 
-        info = scan_mediainfo( scan_path )
+        info = self.mediainfo.probe( scan_path )
         season.meta.from_mi( info )
 
         season.loadData()
@@ -276,7 +285,7 @@ class SingleAnimeScaner:
             if 'eng_name' in seria_names and seria_names['eng_name']:
                 seria.eng_name = seria_names['eng_name']
 
-        info = scan_mediainfo( scan_path )
+        info = self.mediainfo.probe( scan_path )
         seria.meta.from_mi( info )
 
         # calculate seria size
@@ -0,0 +1,52 @@
+import struct
+import zipfile
+from typing import List
+
+# local file header: signature, versions, flags, method, time, date, crc, sizes, name and extra lengths
+LOCAL_HEADER = struct.Struct( '<4s2B4HL2L2H' )
+LOCAL_HEADER_SIGNATURE = b'PK\003\004'
+
+COPY_CHUNK_SIZE = 1048576
+
+
+def copy_raw_entries(
+    src: zipfile.ZipFile,
+    dst: zipfile.ZipFile,
+    entries: List[ zipfile.ZipInfo ]
+) -> None:
+    # compressed data is moved as is, without inflate / deflate round trip
+    for info in entries:
+        src.fp.seek( info.header_offset )
+        header = src.fp.read( LOCAL_HEADER.size )
+        if len( header ) != LOCAL_HEADER.size or header[0:4] != LOCAL_HEADER_SIGNATURE:
+            raise zipfile.BadZipFile( f'Bad local header of {info.filename}' )
+
+        fields = LOCAL_HEADER.unpack( header )
+        src.fp.seek( fields[10] + fields[11], 1 )
+
+        target = zipfile.ZipInfo( info.filename, date_time=info.date_time )
+        target.compress_type = info.compress_type
+        # sizes and crc are known, so data descriptor is not needed
+        target.flag_bits = info.flag_bits & ~0x08
+        target.CRC = info.CRC
+        target.compress_size = info.compress_size
+        target.file_size = info.file_size
+        target.external_attr = info.external_attr
+        target.header_offset = dst.fp.tell()
+
+        zip64 = target.file_size > zipfile.ZIP64_LIMIT or target.compress_size > zipfile.ZIP64_LIMIT
+        dst.fp.write( target.FileHeader( zip64 ) )
+
+        left = info.compress_size
+        while left > 0:
+            chunk = src.fp.read( min( left, COPY_CHUNK_SIZE ) )
+            if not chunk:
+                raise zipfile.BadZipFile( f'Truncated data of {info.filename}' )
+            dst.fp.write( chunk )
+            left -= len( chunk )
+
+        # same bookkeeping ZipFile.write does, central directory is written on close
+        dst.filelist.append( target )
+        dst.NameToInfo[ target.filename ] = target
+        dst.start_dir = dst.fp.tell()
+        dst._didModify = True
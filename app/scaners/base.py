@@ -1,16 +1,111 @@
 from __future__ import annotations
 
 import os
-from typing import Self, List, Dict, Any, Callable
-from sqlalchemy import select, delete, or_, and_
+import time
+from typing import Self, List, Dict, Set, Any, Callable, Iterator
+from concurrent.futures import ProcessPoolExecutor, Future, wait, as_completed, FIRST_COMPLETED
+from sqlalchemy import select, insert, update, delete, or_, and_
 from sqlalchemy.orm import Session
 from app import models
+from app import db
+from app.cache import CACHE_KEYS
 
-from app.tools import calculate_hash, save_cover
+from .bulk import BulkWriter
+
+from app.tools import calculate_file_hash, save_cover, render_cover_variants
+
+COVER_WORKERS = max( 1, ( os.cpu_count() or 2 ) // 2 )
+# streamed results are saved in batches closed at whichever limit comes first
+STREAM_BATCH_TITLES = 50
+STREAM_BATCH_SECONDS = 5
 
 class BaseScaner:
 
     session: Session
+    # catalog name, cached list pages are versioned by it
+    media: str = ''
+    # model -> normalized name -> id
+    tags: Dict[ Any, Dict[ str, int ] ]
+    # content hash -> saved image, identical covers are copied and resized once per scan
+    covers: Dict[ str, models.Image | None ]
+    # variants are rendered off the db writing process
+    covers_pool: ProcessPoolExecutor | None = None
+    # image id -> render future
+    covers_pending: Dict[ int, Future ]
+    # ( phase, done, total ) reporter, set by scan jobs
+    progress: Callable[ [ str, int, int ], None ] | None = None
+    # slugs saved during current run
+    changed: Set[ str ]
+    # counters of bulk saves, reported once per run
+    bulk_totals: BulkWriter | None = None
+
+    def report(
+        self: Self,
+        phase: str,
+        done: int = 0,
+        total: int = 0
+    ) -> None:
+        if self.progress:
+            self.progress( phase, done, total )
+
+
+    def collectBulk(
+        self: Self,
+        writer: BulkWriter
+    ) -> None:
+        if self.bulk_totals is None:
+            self.bulk_totals = BulkWriter( None )
+        self.bulk_totals.merge( writer )
+
+
+    def reportBulk(
+        self: Self,
+        title: str
+    ) -> None:
+        if self.bulk_totals is None:
+            return
+        self.bulk_totals.report( title )
+        self.bulk_totals = None
+
+
+    def collectChanged(
+        self: Self,
+        slugs: List[ str ]
+    ) -> None:
+        if not hasattr( self, 'changed' ):
+            self.changed = set()
+        self.changed.update( slugs )
+
+
+    def finishCatalog(
+        self: Self
+    ) -> None:
+        # catalog is bumped once per run, after every batch is saved
+        changed = getattr( self, 'changed', set() )
+        if not changed:
+            return
+        self.bumpCatalog( sorted( changed ) )
+        self.changed = set()
+
+
+    def bumpCatalog(
+        self: Self,
+        slugs: List[ str ] = []
+    ) -> None:
+        # one INCR drops every cached list page of this catalog,
+        # changed slugs are picked up by cache warmer after the scan
+        if not self.media:
+            return
+        try:
+            pipe = db.RDS.pipeline( transaction=False )
+            pipe.incr( CACHE_KEYS['version'].format( self.media ) )
+            if slugs:
+                pipe.sadd( CACHE_KEYS['changed'].format( self.media ), *slugs )
+            pipe.publish( CACHE_KEYS['channel'], self.media )
+            pipe.execute()
+        except Exception as e:
+            print(f"Catalog version bump failed: {e}")
+
 
     def chunks_to_n(
         self: Self,
@@ -23,140 +118,311 @@ class BaseScaner:
             yield lst[i:i + n]
 
 
-    def saveAuthor(
+    def stream(
         self: Self,
-        author: str
-    ) -> models.Author | None:
-        db_author = self.session.execute(
-            select(
-                models.Author
-            )\
-            .filter(
-                or_(
-                    models.Author.name.ilike(author)
+        worker: Callable[ [ Dict[ str, Any ] ], Any ],
+        payloads: List[ Dict[ str, Any ] ],
+        max_processes: int,
+        max_in_flight: int | None = None,
+        batch_titles: int = STREAM_BATCH_TITLES,
+        batch_seconds: float = STREAM_BATCH_SECONDS
+    ) -> Iterator[ List[ Any ] ]:
+        # yields finished results in batches of `batch_titles` or whatever
+        # finished in `batch_seconds`, keeping at most `max_in_flight`
+        # payloads submitted to the pool at once
+        if max_in_flight is None:
+            max_in_flight = max_processes * 2
+
+        queue = iter( payloads )
+        pending: set[ Future ] = set()
+
+        with ProcessPoolExecutor( max_workers=max_processes ) as runner:
+
+            def submit() -> None:
+                while len( pending ) < max_in_flight:
+                    payload = next( queue, None )
+                    if payload is None:
+                        return
+                    pending.add( runner.submit( worker, payload ) )
+
+            submit()
+
+            results = []
+            started = time.monotonic()
+
+            while len( pending ) > 0:
+                timeout = None
+                if results:
+                    timeout = max( 0, started + batch_seconds - time.monotonic() )
+                done, _ = wait( pending, timeout=timeout, return_when=FIRST_COMPLETED )
+                for future in done:
+                    pending.discard( future )
+                    try:
+                        result = future.result()
+                    except Exception as e:
+                        print(f"Scan failed: {e}")
+                        continue
+                    if not results:
+                        started = time.monotonic()
+                    results.append( result )
+                # keep runners busy while results are saved
+                submit()
+                if results and ( len( results ) >= batch_titles or time.monotonic() - started >= batch_seconds or len( pending ) == 0 ):
+                    yield results
+                    results = []
+
+
+    def normalizeTag(
+        self: Self,
+        name: str
+    ) -> str:
+        return ' '.join( str( name ).split() ).casefold()
+
+
+    def loadTags(
+        self: Self,
+        model: Any
+    ) -> Dict[ str, int ]:
+        # normalized name -> id, loaded once per scan run
+        if not hasattr( self, 'tags' ):
+            self.tags = {}
+
+        if model not in self.tags:
+            tags: Dict[ str, int ] = {}
+            rows = self.session.execute(
+                select(
+                    model.id,
+                    model.name
+                )\
+                .order_by(
+                    model.id.asc()
                 )
-            )\
-            .limit(1)
-        ).scalar_one_or_none()
-        if not db_author:
-            db_author = models.Author()
-            db_author.name = author
+            ).all()
+            for tag_id, name in rows:
+                key = self.normalizeTag( name )
+                if key not in tags:
+                    tags[ key ] = tag_id
+            self.tags[ model ] = tags
+
+        return self.tags[ model ]
+
+
+    def resolveTags(
+        self: Self,
+        model: Any,
+        names: List[ str ]
+    ) -> Dict[ str, int ]:
+        tags = self.loadTags( model )
+
+        missing: Dict[ str, str ] = {}
+        for name in names:
+            key = self.normalizeTag( name )
+            if key and key not in tags and key not in missing:
+                missing[ key ] = str( name ).strip()
+
+        # create all new tags with one insert
+        if len( missing ) > 0:
             try:
-                self.session.add( db_author )
+                self.session.execute(
+                    insert( model ),
+                    [ { 'name': name } for name in missing.values() ]
+                )
                 self.session.commit()
-            except:
-                db_author = None
-        return db_author
+            except Exception as e:
+                self.session.rollback()
+                print(f"Tags insert failed, retrying one by one: {e}")
+                # one bad name must not drop the whole batch
+                for name in missing.values():
+                    try:
+                        self.session.execute(
+                            insert( model ),
+                            [ { 'name': name } ]
+                        )
+                        self.session.commit()
+                    except Exception as e:
+                        self.session.rollback()
+                        print(f"Tag {name!r} dropped: {e}")
+            rows = self.session.execute(
+                select(
+                    model.id,
+                    model.name
+                )\
+                .filter(
+                    model.name.in_( list( missing.values() ) )
+                )\
+                .order_by(
+                    model.id.asc()
+                )
+            ).all()
+            for tag_id, name in rows:
+                key = self.normalizeTag( name )
+                if key not in tags:
+                    tags[ key ] = tag_id
+
+        result: Dict[ str, int ] = {}
+        for name in names:
+            key = self.normalizeTag( name )
+            if key in tags:
+                result[ name ] = tags[ key ]
+        return result
+
+
+    def saveTag(
+        self: Self,
+        model: Any,
+        name: str
+    ) -> Any | None:
+        tags = self.resolveTags( model, [ name ] )
+        if name not in tags:
+            return None
+        return self.session.get( model, tags[ name ] )
+
+
+    def saveAuthor(
+        self: Self,
+        author: str
+    ) -> models.Author | None:
+        return self.saveTag( models.Author, author )
 
 
     def saveStudio(
         self: Self,
         studio: str
     ) -> models.Studio | None:
-        db_studio = self.session.execute(
-            select(
-                models.Studio
-            )\
-            .filter(
-                or_(
-                    models.Studio.name.ilike(studio)
-                )
-            )\
-            .limit(1)
-        ).scalar_one_or_none()
-        if not db_studio:
-            db_studio = models.Studio()
-            db_studio.name = studio
-            try:
-                self.session.add( db_studio )
-                self.session.commit()
-            except:
-                db_studio = None
-        return db_studio
+        return self.saveTag( models.Studio, studio )
 
 
     def saveGenre(
         self: Self,
         genre: str
     ) -> models.Genre | None:
-        db_genre = self.session.execute(
-            select(
-                models.Genre
-            )\
-            .filter(
-                or_(
-                    models.Genre.name.ilike(genre)
-                )
-            )\
-            .limit(1)
-        ).scalar_one_or_none()
-        if not db_genre:
-            db_genre = models.Genre()
-            db_genre.name = genre
-            try:
-                self.session.add( db_genre )
-                self.session.commit()
-            except:
-                db_genre = None
-        return db_genre
+        return self.saveTag( models.Genre, genre )
 
 
     def saveVoice(
         self: Self,
         voice: str
     ) -> models.Voice | None:
-        db_voice = self.session.execute(
-            select(
-                models.Voice
-            )\
-            .filter(
-                or_(
-                    models.Voice.name.ilike(voice)
-                )
-            )\
-            .limit(1)
-        ).scalar_one_or_none()
-        if not db_voice:
-            db_voice = models.Voice()
-            db_voice.name = voice
-            try:
-                self.session.add( db_voice )
-                self.session.commit()
-            except:
-                db_voice = None
-        return db_voice
+        return self.saveTag( models.Voice, voice )
+
+
+    def saveFirstCover(
+        self: Self,
+        paths: List[ str ]
+    ) -> int | None:
+        for cover_path in paths:
+            cover = self.saveCover( cover_path )
+            if cover:
+                return cover.id
+        return None
 
 
     def saveCover(
         self: Self,
         path: str
-    ) -> models.Cover | None:
-        
-        hash = calculate_hash( path )
+    ) -> models.Image | None:
+
+        if not os.path.isfile( path ):
+            return None
+
+        hash = calculate_file_hash( path )
+
+        if not hasattr( self, 'covers' ):
+            self.covers = {}
+
+        if hash in self.covers:
+            return self.covers[ hash ]
 
         db_cover = self.session.execute(
             select(
-                models.Cover
+                models.Image
             )\
-            .filter(
-                or_(
-                    models.Cover.hash.ilike(hash)
-                )
+            .where(
+                models.Image.hash == hash
             )\
             .limit(1)
         ).scalar_one_or_none()
 
-        _, ext = os.path.splitext( path )
-        filename = f'{hash}{ext}'
-        saved = save_cover( path, filename )
+        if not db_cover:
+            _, ext = os.path.splitext( path )
+            filename = f'{hash}{ext.lower()}'
+            if save_cover( path, filename ):
+                db_cover = models.Image()
+                db_cover.filename = filename
+                db_cover.hash = hash
+                try:
+                    self.session.add( db_cover )
+                    self.session.commit()
+                except:
+                    self.session.rollback()
+                    db_cover = None
+
+        if db_cover and not db_cover.variants:
+            self.renderCover( db_cover )
+
+        self.covers[ hash ] = db_cover
+        return db_cover
+
 
-        if not db_cover and saved:
-            db_cover = models.Cover()
-            db_cover.filename = filename
-            db_cover.hash = hash
+    def renderCover(
+        self: Self,
+        image: models.Image
+    ) -> None:
+        if self.covers_pool is None:
+            self.covers_pool = ProcessPoolExecutor( max_workers=COVER_WORKERS )
+            self.covers_pending = {}
+        self.covers_pending[ image.id ] = self.covers_pool.submit( render_cover_variants, image.filename )
+
+
+    def finishCovers(
+        self: Self
+    ) -> None:
+        if self.covers_pool is None:
+            return
+
+        # variants flags -> image ids
+        rendered: Dict[ int, List[ int ] ] = {}
+
+        total = len( self.covers_pending )
+        done = 0
+        self.report( 'covers', done, total )
+
+        for future in as_completed( self.covers_pending.values() ):
+            done += 1
+            self.report( 'covers', done, total )
+
+        for image_id, future in self.covers_pending.items():
             try:
-                self.session.add( db_cover )
-                self.session.commit()
-            except:
-                db_cover = None
-        return db_cover
\ No newline at end of file
+                flags = future.result()
+            except Exception as e:
+                print(f"Cover render failed: {e}")
+                continue
+            if flags:
+                if flags not in rendered:
+                    rendered[ flags ] = []
+                rendered[ flags ].append( image_id )
+
+        self.covers_pool.shutdown()
+        self.covers_pool = None
+        self.covers_pending = {}
+
+        if len( rendered ) == 0:
+            return
+
+        session = db.DB()
+        for flags, ids in rendered.items():
+            session.execute(
+                update(
+                    models.Image
+                )\
+                .where(
+                    models.Image.id.in_( ids )
+                )\
+                .values(
+                    variants=flags
+                )
+            )
+        session.commit()
+        session.close()
+
+        print(f"Rendered variants of {sum( [ len( x ) for x in rendered.values() ] )} covers")
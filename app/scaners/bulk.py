@@ -0,0 +1,174 @@
+from __future__ import annotations
+
+import time
+from contextlib import contextmanager
+from typing import Self, List, Dict, Tuple, Any, Callable, Iterable
+from sqlalchemy import Table, Select, insert, delete
+from sqlalchemy.dialects.mysql import insert as mysql_insert
+from sqlalchemy.orm import Session
+
+BULK_CHUNK_SIZE = 1000
+
+
+def chunked(
+    lst: List[ Any ],
+    size: int = BULK_CHUNK_SIZE
+):
+    for i in range( 0, len( lst ), size ):
+        yield lst[ i:i + size ]
+
+
+class BulkWriter:
+
+    session: Session
+    chunk_size: int
+    # table -> { inserted, updated, deleted }
+    rows: Dict[ str, Dict[ str, int ] ]
+    # phase -> seconds
+    phases: Dict[ str, float ]
+
+    def __init__(
+        self: Self,
+        session: Session,
+        chunk_size: int = BULK_CHUNK_SIZE
+    ) -> None:
+        self.session = session
+        self.chunk_size = chunk_size
+        self.rows = {}
+        self.phases = {}
+
+
+    @contextmanager
+    def phase(
+        self: Self,
+        name: str
+    ):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.phases[ name ] = self.phases.get( name, 0 ) + time.perf_counter() - start
+
+
+    def count(
+        self: Self,
+        table: Table,
+        action: str,
+        amount: int
+    ) -> None:
+        if table.name not in self.rows:
+            self.rows[ table.name ] = { 'inserted': 0, 'updated': 0, 'deleted': 0 }
+        self.rows[ table.name ][ action ] += amount
+
+
+    def fetchIds(
+        self: Self,
+        query: Callable[ [ List[ Any ] ], Select ],
+        values: Iterable[ Any ]
+    ) -> Dict[ Tuple, int ]:
+        # query must select id as first column, the rest of columns are used as key
+        result: Dict[ Tuple, int ] = {}
+        values = list( set( values ) )
+        for chunk in chunked( values, self.chunk_size ):
+            for row in self.session.execute( query( chunk ) ).all():
+                result[ tuple( row[1:] ) ] = row[0]
+        return result
+
+
+    def insert(
+        self: Self,
+        target: Any,
+        rows: List[ Dict[ str, Any ] ]
+    ) -> None:
+        table = self.__table__( target )
+        for group in self.__groups__( rows ):
+            for chunk in chunked( group, self.chunk_size ):
+                self.session.execute( insert( table ), chunk )
+                self.session.commit()
+                self.count( table, 'inserted', len( chunk ) )
+
+
+    def upsert(
+        self: Self,
+        target: Any,
+        rows: List[ Dict[ str, Any ] ]
+    ) -> None:
+        # rows are matched by primary key, so every row must contain it
+        table = self.__table__( target )
+        for group in self.__groups__( rows ):
+            stmt = mysql_insert( table )
+            stmt = stmt.on_duplicate_key_update(
+                { key: stmt.inserted[ key ] for key in group[0].keys() if key not in table.primary_key.columns }
+            )
+            for chunk in chunked( group, self.chunk_size ):
+                self.session.execute( stmt, chunk )
+                self.session.commit()
+                self.count( table, 'updated', len( chunk ) )
+
+
+    def delete(
+        self: Self,
+        target: Any,
+        column: Any,
+        values: Iterable[ Any ]
+    ) -> None:
+        table = self.__table__( target )
+        values = list( set( values ) )
+        for chunk in chunked( values, self.chunk_size ):
+            result = self.session.execute(
+                delete(
+                    table
+                )\
+                .where(
+                    column.in_( chunk )
+                )
+            )
+            self.session.commit()
+            self.count( table, 'deleted', result.rowcount or 0 )
+
+
+    def merge(
+        self: Self,
+        other: BulkWriter
+    ) -> None:
+        # counters of every saved batch add up into one report per run
+        for name, seconds in other.phases.items():
+            self.phases[ name ] = self.phases.get( name, 0 ) + seconds
+        for name, counters in other.rows.items():
+            if name not in self.rows:
+                self.rows[ name ] = { 'inserted': 0, 'updated': 0, 'deleted': 0 }
+            for action, amount in counters.items():
+                self.rows[ name ][ action ] += amount
+
+
+    def report(
+        self: Self,
+        title: str
+    ) -> None:
+        total = sum( self.phases.values() )
+        print(f"{title}: saved in {total:.2f}s")
+        for name, seconds in self.phases.items():
+            print(f"\t{name}: {seconds:.2f}s")
+        for name, counters in self.rows.items():
+            print(f"\t{name}: inserted {counters['inserted']}, updated {counters['updated']}, deleted {counters['deleted']}")
+
+
+    def __table__(
+        self: Self,
+        target: Any
+    ) -> Table:
+        return getattr( target, '__table__', target )
+
+
+    def __groups__(
+        self: Self,
+        rows: List[ Dict[ str, Any ] ]
+    ) -> List[ List[ Dict[ str, Any ] ] ]:
+        # executemany requires the same set of columns for every row
+        groups: Dict[ Tuple, List[ Dict[ str, Any ] ] ] = {}
+        for row in rows:
+            key = tuple( sorted( row.keys() ) )
+            if key not in groups:
+                groups[ key ] = []
+            groups[ key ].append( row )
+        return list( groups.values() )
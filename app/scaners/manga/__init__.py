@@ -11,18 +11,20 @@ from app import models
 from app import db
 
 from ..base import BaseScaner
+from ..bulk import BulkWriter
+from ..manifest import ScanManifest, stat_tree, changed_subtrees
 from .objects import *
 from .scaner import *
 
-def scan_mangas():
+def scan_mangas( force: bool = False, bulk: bool = True ):
     
-    scaner = MangaScaner()
-    scaner.run()
+    scaner = MangaScaner( bulk )
+    scaner.run( force )
 
-def scan_mangas_single(name: str):
+def scan_mangas_single( name: str, bulk: bool = True ):
     
-    scaner = MangaScaner()
-    scaner.run_single(name)
+    scaner = MangaScaner( bulk )
+    scaner.run_single( name )
 
 
 class MangaScaner(
@@ -30,21 +32,27 @@ class MangaScaner(
 ):
 
     session: Session
+    manifest: ScanManifest
+    bulk: bool
+    media: str = 'manga'
 
     def __init__(
-        self: Self
+        self: Self,
+        bulk: bool = True
     ) -> None:
-        pass
+        self.manifest = ScanManifest( 'manga' )
+        self.bulk = bulk
     
+    @staticmethod
     def __run_scaner_instance__(
-        self: Self,
-        payload: Dict[ str, str]
-    ) -> Dict:
+        payload: Dict[ str, Any ]
+    ) -> Manga:
         scanner = SingleMangaScaner()
-        return scanner.run( payload['root_dir'], payload['folder'] )
+        return scanner.run( payload['root_dir'], payload['folder'], payload.get('volumes') )
 
     def run(
-        self: Self
+        self: Self,
+        force: bool = False
     ):
         scan_path = models.MANGA_FS_PATH
         scan_results = os.listdir( scan_path )
@@ -57,26 +65,58 @@ class MangaScaner(
             max_processes = 8
         
         print(f"Ready {max_processes} runners")
+
+        self.manifest.load()
         
-        payloads: List[ Dict[ str, str ] ] = []
+        payloads: List[ Dict[ str, Any ] ] = []
+        titles: List[ str ] = []
+        skipped = 0
 
-        for element in scan_results:
+        for index, element in enumerate( scan_results ):
+            self.report( 'discover', index, len( scan_results ) )
             if os.path.isfile( os.path.join( scan_path, element ) ):
                 pass
             else:
+                titles.append( element )
+                volumes = None
+
+                # skip titles which are unchanged since last scan
+                if not force:
+                    known = self.manifest.get( element )
+                    changed = changed_subtrees( known, stat_tree( scan_path, element ) )
+                    if changed is None:
+                        skipped += 1
+                        continue
+                    if known:
+                        volumes = list( changed )
+
                 payloads.append(
                     {
                         "root_dir":scan_path,
                         "folder":element,
+                        "volumes":volumes,
                     }
                 )
+
+        print(f"Skipped {skipped} unchanged titles, {len(payloads)} to scan")
         
-        results: List[ Manga ] = []
-        
-        with ProcessPoolExecutor(max_workers=max_processes) as runner:
-            results = list( runner.map( self.__run_scaner_instance__, payloads ) )
-        
-        self.save( results )
+        done = 0
+        self.report( 'scan', done, len( payloads ) )
+
+        # save titles as soon as they are scanned
+        for results in self.stream( self.__run_scaner_instance__, payloads, max_processes ):
+            self.save( results )
+            done += len( results )
+            self.report( 'scan', done, len( payloads ) )
+
+        self.finishCovers()
+
+        self.finishCatalog()
+
+        self.reportBulk( 'Manga' )
+
+        self.manifest.keep( titles )
+        self.manifest.save()
 
 
     def run_single(
@@ -97,18 +137,32 @@ class MangaScaner(
                 }
             )
         
-        results: List[ Manga ] = []
-        
-        with ProcessPoolExecutor(max_workers=1) as runner:
-            results = list( runner.map( self.__run_scaner_instance__, payloads ) )
+        self.manifest.load()
+
+        self.report( 'scan', 0, len( payloads ) )
+
+        for results in self.stream( self.__run_scaner_instance__, payloads, 1 ):
+            self.save( results )
+            self.report( 'scan', len( results ), len( payloads ) )
+
+        self.finishCovers()
+
+        self.finishCatalog()
 
-        self.save( results )
+        self.reportBulk( 'Manga' )
+
+        self.manifest.save()
 
     
     def save(
         self: Self,
         results: List[ Manga ] = []
     ):
+        if self.bulk:
+            self.saveBulk( results )
+            self.collectChanged( self.changedSlugs( results ) )
+            return
+
         self.session = db.DB()
 
         for manga in results:
@@ -117,8 +171,230 @@ class MangaScaner(
                 db_volume = self.saveMangaVolume( volume, db_manga )
                 for _, chapter in volume.chapters.items():
                     self.saveMangaChapter( chapter, db_volume )
+            self.manifest.set( manga.folder, manga.manifest )
         
         self.session.close()
+        self.collectChanged( self.changedSlugs( results ) )
+
+
+    def changedSlugs(
+        self: Self,
+        results: List[ Manga ]
+    ) -> List[ str ]:
+        return [ manga.slug for manga in results if manga ]
+
+
+    def saveBulk(
+        self: Self,
+        results: List[ Manga ] = []
+    ):
+        results = [ manga for manga in results if manga ]
+        if len( results ) == 0:
+            return
+
+        self.session = db.DB()
+        writer = BulkWriter( self.session )
+
+        # mangas
+
+        with writer.phase( 'mangas' ):
+            mangas_ids = writer.fetchIds(
+                lambda chunk: select(
+                    models.Manga.id,
+                    models.Manga.path
+                )\
+                .filter(
+                    models.Manga.path.in_( chunk )
+                ),
+                [ manga.folder for manga in results ]
+            )
+
+            inserts = []
+            updates = []
+            for manga in results:
+                row = {
+                    'path': manga.folder,
+                    'name': manga.name,
+                    'eng_name': manga.eng_name,
+                    'status': manga.status,
+                    'slug': manga.slug,
+                }
+                cover_id = self.saveFirstCover( manga.covers )
+                if cover_id:
+                    row['cover_id'] = cover_id
+                if ( manga.folder, ) in mangas_ids:
+                    row['id'] = mangas_ids[ ( manga.folder, ) ]
+                    updates.append( row )
+                else:
+                    inserts.append( row )
+
+            writer.upsert( models.Manga, updates )
+            writer.insert( models.Manga, inserts )
+
+            new_ids = writer.fetchIds(
+                lambda chunk: select(
+                    models.Manga.id,
+                    models.Manga.path
+                )\
+                .filter(
+                    models.Manga.path.in_( chunk )
+                ),
+                [ row['path'] for row in inserts ]
+            )
+            mangas_ids.update( new_ids )
+
+            # Add notifications for new mangas
+            writer.insert(
+                models.Notification,
+                [ { 'action': 'new', 'target': 'Manga', 'target_id': x } for x in new_ids.values() ]
+            )
+
+        # authors and genres
+
+        with writer.phase( 'links' ):
+            ids = [ mangas_ids[ ( manga.folder, ) ] for manga in results ]
+
+            authors = self.resolveTags( models.Author, [ x for manga in results for x in manga.authors ] )
+            genres = self.resolveTags( models.Genre, [ x for manga in results for x in manga.genres ] )
+
+            writer.delete( models.MangaAuthors, models.MangaAuthors.c.manga_id, ids )
+            writer.delete( models.MangaGenres, models.MangaGenres.c.manga_id, ids )
+
+            authors_rows = []
+            genres_rows = []
+            for manga in results:
+                manga_id = mangas_ids[ ( manga.folder, ) ]
+                for author_id in set( [ authors[ x ] for x in manga.authors if x in authors ] ):
+                    authors_rows.append( { 'manga_id': manga_id, 'author_id': author_id } )
+                for genre_id in set( [ genres[ x ] for x in manga.genres if x in genres ] ):
+                    genres_rows.append( { 'manga_id': manga_id, 'genre_id': genre_id } )
+
+            writer.insert( models.MangaAuthors, authors_rows )
+            writer.insert( models.MangaGenres, genres_rows )
+
+        # volumes
+
+        with writer.phase( 'volumes' ):
+            volumes_ids = writer.fetchIds(
+                lambda chunk: select(
+                    models.MangaVolume.id,
+                    models.MangaVolume.manga_id,
+                    models.MangaVolume.path
+                )\
+                .filter(
+                    models.MangaVolume.manga_id.in_( chunk )
+                ),
+                ids
+            )
+
+            inserts = []
+            updates = []
+            for manga in results:
+                manga_id = mangas_ids[ ( manga.folder, ) ]
+                for _, volume in manga.volumes.items():
+                    row = {
+                        'manga_id': manga_id,
+                        'path': volume.folder,
+                        'number': volume.number,
+                        'name': volume.name,
+                        'eng_name': volume.eng_name,
+                        'status': volume.status,
+                        'slug': volume.slug,
+                        'filename': volume.filename,
+                        'filesize': volume.filesize,
+                    }
+                    cover_id = self.saveFirstCover( volume.covers )
+                    if cover_id:
+                        row['cover_id'] = cover_id
+                    if ( manga_id, volume.folder ) in volumes_ids:
+                        row['id'] = volumes_ids[ ( manga_id, volume.folder ) ]
+                        updates.append( row )
+                    else:
+                        inserts.append( row )
+
+            writer.upsert( models.MangaVolume, updates )
+            writer.insert( models.MangaVolume, inserts )
+
+            new_ids = writer.fetchIds(
+                lambda chunk: select(
+                    models.MangaVolume.id,
+                    models.MangaVolume.manga_id,
+                    models.MangaVolume.path
+                )\
+                .filter(
+                    models.MangaVolume.manga_id.in_( chunk )
+                ),
+                set( [ row['manga_id'] for row in inserts ] )
+            )
+            new_ids = { x:y for x,y in new_ids.items() if x not in volumes_ids }
+            volumes_ids.update( new_ids )
+
+            # Add notifications for new volumes
+            writer.insert(
+                models.Notification,
+                [ { 'action': 'new', 'target': 'MangaVolume', 'target_id': x } for x in new_ids.values() ]
+            )
+
+        # chapters
+
+        with writer.phase( 'chapters' ):
+            scanned = []
+            for manga in results:
+                manga_id = mangas_ids[ ( manga.folder, ) ]
+                for _, volume in manga.volumes.items():
+                    scanned.append( volumes_ids[ ( manga_id, volume.folder ) ] )
+
+            chapters_ids = writer.fetchIds(
+                lambda chunk: select(
+                    models.MangaChapter.id,
+                    models.MangaChapter.volume_id,
+                    models.MangaChapter.filename
+                )\
+                .filter(
+                    models.MangaChapter.volume_id.in_( chunk )
+                ),
+                scanned
+            )
+
+            inserts = []
+            updates = []
+            keep = set()
+            for manga in results:
+                manga_id = mangas_ids[ ( manga.folder, ) ]
+                for _, volume in manga.volumes.items():
+                    volume_id = volumes_ids[ ( manga_id, volume.folder ) ]
+                    for _, chapter in volume.chapters.items():
+                        row = {
+                            'volume_id': volume_id,
+                            'number': chapter.number,
+                            'name': chapter.name,
+                            'eng_name': chapter.eng_name,
+                            'filename': chapter.filename,
+                            'filesize': chapter.filesize,
+                        }
+                        key = ( volume_id, chapter.filename )
+                        keep.add( key )
+                        if key in chapters_ids:
+                            row['id'] = chapters_ids[ key ]
+                            updates.append( row )
+                        else:
+                            inserts.append( row )
+
+            # chapters which are gone from fully scanned volumes
+            writer.delete(
+                models.MangaChapter,
+                models.MangaChapter.id,
+                [ y for x,y in chapters_ids.items() if x not in keep ]
+            )
+            writer.upsert( models.MangaChapter, updates )
+            writer.insert( models.MangaChapter, inserts )
+
+        for manga in results:
+            self.manifest.set( manga.folder, manga.manifest )
+
+        self.collectBulk( writer )
+
+        self.session.close()
 
 
     def saveManga(
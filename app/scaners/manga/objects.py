@@ -17,6 +17,8 @@ class Manga:
     authors: List[ str ]
     genres: List[ str ]
     volumes: Dict[ str, MangaVolume ] = {}
+    # fs snapshot for incremental scan
+    manifest: Dict[ str, List[ int ] ] = {}
 
     def __init__( self: Self ) -> None:
         self.path = ""
@@ -28,6 +30,7 @@ class Manga:
         self.authors = []
         self.genres = []
         self.volumes = {}
+        self.manifest = {}
 
     def __repr__( self: Self ) -> str:
         return ujson.dumps({
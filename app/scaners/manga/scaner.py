@@ -6,12 +6,14 @@ import logging
 import shutil
 import zipfile
 import hashlib
-from typing import Self
+from typing import Self, List, Dict
 from natsort import natsorted, ns
 from app import models
 from app.tools import format_float, calculate_hash
 
 from .objects import *
+from ..manifest import stat_tree
+from ..archive import copy_raw_entries
 
 class SingleMangaScaner:
 
@@ -33,14 +35,18 @@ class SingleMangaScaner:
     def run(
         self: Self,
         root_dir: str,
-        folder: str
+        folder: str,
+        volumes: List[ str ] | None = None
     ) -> Manga:
         logging.basicConfig(
             format=f'%(levelname)s: {folder} %(funcName)s - %(message)s', # %(name)s [%(process)d] - %(asctime)s
             level=logging.INFO
         )
         self.log = logging.getLogger(__name__)
-        self.scanMangaFolder( root_dir, folder )
+        self.scanMangaFolder( root_dir, folder, volumes )
+
+        # snapshot is taken after recompression, so next scan sees it as unchanged
+        self.manga.manifest = stat_tree( root_dir, folder )
 
         return self.manga
 
@@ -48,7 +54,8 @@ class SingleMangaScaner:
     def scanMangaFolder(
         self: Self,
         root_dir: str,
-        folder: str
+        folder: str,
+        volumes: List[ str ] | None = None
     ) -> None:
 
         scan_path = os.path.join( root_dir, folder )
@@ -74,6 +81,9 @@ class SingleMangaScaner:
                 # if ext in models.MANGA_EXTS:
                 #     self.scanMangaVolumeFile( root_dir=scan_path, file=element )
             else:
+                # skip volumes unchanged since last scan
+                if volumes is not None and element not in volumes:
+                    continue
                 self.scanMangaVolumeFolder( root_dir=scan_path, folder=element )
 
 
@@ -138,7 +148,7 @@ class SingleMangaScaner:
         if exists_hashes != new_hashes:
             volume.chapters_hashes = list( new_hashes )
             if len( volume.chapters ) > 0:
-                self.generateSolidVolumeFile( volume )
+                self.generateSolidVolumeFile( volume, list( exists_hashes ) )
 
         if volume.filename:
             # calculate volume size
@@ -202,58 +212,64 @@ class SingleMangaScaner:
         new_chapter_filename = f'r.Chapter {format_float( chapter.number )}.cbz'
         new_chapter_path = os.path.join( volume.path, new_chapter_filename )
 
-        unpack_file = os.path.join( volume.path, chapter.filename )
-        unpack_folder = os.path.join( volume.path, f'temp_Chapter {chapter.number}' )
+        source_path = os.path.join( volume.path, chapter.filename )
+        temp_path = os.path.join( volume.path, f'temp_{new_chapter_filename}' )
 
         image_prefix = f'{format_float(volume.number)}-{format_float(chapter.number)}-'
 
 
-        shutil.rmtree( unpack_folder, ignore_errors=True )
-        os.makedirs( unpack_folder, exist_ok=True )
-
-
-        with zipfile.ZipFile( unpack_file, 'r' ) as z:
-            z.extractall( unpack_folder )
-
-
-        if new_chapter_filename == chapter.filename:
-            os.unlink( unpack_file )
+        with zipfile.ZipFile( source_path, 'r' ) as src:
 
+            # new name -> source entry
+            entries: Dict[ str, zipfile.ZipInfo ] = {}
+            pages = 0
 
-        scan_results = os.listdir( unpack_folder )
-        scan_results = natsorted( scan_results, alg=ns.IGNORECASE )
-
-
-        for file in scan_results:
-            old_file_path = os.path.join( unpack_folder, file )
-            file = file.lower()
-            new_file_path = os.path.join( unpack_folder, file )
-            try:
-                os.rename( old_file_path, new_file_path )
-            except:
-                pass
-            _, ext = os.path.splitext( file )
-            if ext not in models.MANGA_IMAGES_EXTS:
-                os.unlink( file )
-            else:
+            for info in src.infolist():
+                if info.is_dir():
+                    continue
+                file = os.path.basename( info.filename ).lower()
+                _, ext = os.path.splitext( file )
+                if ext not in models.MANGA_IMAGES_EXTS:
+                    continue
                 matches = self.image_regex.match( file )
                 if matches:
                     image_number = int( matches.group('image_number') )
-                    new_file_name = f'{image_prefix}{image_number}{ext}'
-                    new_file_path = os.path.join( unpack_folder, new_file_name )
-                    os.rename( os.path.join( unpack_folder, file ), new_file_path )
-
-
-        with zipfile.ZipFile( new_chapter_path, 'w', compression=zipfile.ZIP_DEFLATED, compresslevel=9 ) as z:
-            scan_results = os.listdir( unpack_folder )
-            scan_results = natsorted( scan_results, alg=ns.IGNORECASE )
-            for file in scan_results:
-                z.write( os.path.join( unpack_folder, file ), file )
-
-
-        shutil.rmtree( unpack_folder, ignore_errors=True )
+                    file = f'{image_prefix}{image_number}{ext}'
+                pages += 1
+                # same basename in two folders or 1.jpg next to 01.jpg would overwrite a page
+                if file in entries:
+                    print(f"Recompress skipped, {source_path}: {info.filename} and {entries[ file ].filename} map to {file}")
+                    return
+                entries[ file ] = info
+
+
+            # pages are streamed from source archive, nothing is unpacked to disk
+            with zipfile.ZipFile( temp_path, 'w' ) as dst:
+                for file in natsorted( entries.keys(), alg=ns.IGNORECASE ):
+                    info = entries[ file ]
+                    _, ext = os.path.splitext( file )
+
+                    target = zipfile.ZipInfo( file, date_time=info.date_time )
+                    target.file_size = info.file_size
+                    if ext in models.MANGA_STORED_EXTS:
+                        target.compress_type = zipfile.ZIP_STORED
+                    else:
+                        target.compress_type = zipfile.ZIP_DEFLATED
+
+                    with src.open( info, 'r' ) as r, dst.open( target, 'w' ) as w:
+                        shutil.copyfileobj( r, w, 1048576 )
+
+        # source is only dropped once every page is in new archive
+        with zipfile.ZipFile( temp_path, 'r' ) as dst:
+            written = len( [ x for x in dst.infolist() if not x.is_dir() ] )
+        if written != pages:
+            print(f"Recompress skipped, {source_path}: {written} of {pages} pages written")
+            os.unlink( temp_path )
+            return
+
+        os.replace( temp_path, new_chapter_path )
         if new_chapter_filename != chapter.filename:
-            os.unlink( unpack_file )
+            os.unlink( source_path )
 
 
         chapter.filename = new_chapter_filename
@@ -261,40 +277,80 @@ class SingleMangaScaner:
 
     def generateSolidVolumeFile(
         self: Self,
-        volume: MangaVolume
+        volume: MangaVolume,
+        known_hashes: List[ str ] = []
     ) -> None:
 
         new_volume_filename = f'r.Volume {format_float( volume.number )}.cbz'
         new_volume_path = os.path.join( volume.path, new_volume_filename )
 
         old_volume_path = os.path.join( volume.path, volume.filename )
-        unpack_folder = os.path.join( volume.path, f'temp_Volume {volume.number}' )
-
-
-        if os.path.exists( old_volume_path ) and os.path.isfile( old_volume_path ):
+        temp_path = os.path.join( volume.path, f'temp_{new_volume_filename}' )
+
+        chapters = [ c for _,c in volume.chapters.items() if c.filename.endswith('cbz') ]
+
+        # only new chapters were added - append them to the existing solid archive
+        known = set( known_hashes )
+        added = [ c for c in chapters if c.hash not in known ]
+        if known and len( added ) > 0 and known.issubset( set( [ c.hash for c in chapters ] ) ):
+            if volume.filename == new_volume_filename and os.path.isfile( new_volume_path ):
+                try:
+                    if self.appendSolidVolumeFile( volume, new_volume_path, added ):
+                        return
+                except zipfile.BadZipFile as e:
+                    self.log.warning(f"Rebuilding {new_volume_path}: {e}")
+
+
+        # entries are copied compressed, chapter pages are never inflated
+        with zipfile.ZipFile( temp_path, 'w' ) as dst:
+            seen = set()
+            for chapter in chapters:
+                with zipfile.ZipFile( os.path.join( volume.path, chapter.filename ), 'r' ) as src:
+                    entries = [ x for x in src.infolist() if not x.is_dir() and x.filename not in seen ]
+                    entries = natsorted( entries, key=lambda x: x.filename, alg=ns.IGNORECASE )
+                    copy_raw_entries( src, dst, entries )
+                    seen.update( [ x.filename for x in entries ] )
+
+
+        os.replace( temp_path, new_volume_path )
+        if volume.filename and volume.filename != new_volume_filename and os.path.isfile( old_volume_path ):
             os.unlink( old_volume_path )
 
+        volume.filename = new_volume_filename
 
-        if os.path.exists( new_volume_path ) and os.path.isfile( new_volume_path ):
-            os.unlink( new_volume_path )
-
-
-        shutil.rmtree( unpack_folder, ignore_errors=True )
-        os.makedirs( unpack_folder, exist_ok=True )
 
-
-        for _, chapter in volume.chapters.items():
-            archive_for_unpack = os.path.join( volume.path, chapter.filename )
-            with zipfile.ZipFile( archive_for_unpack, 'r' ) as z:
-                z.extractall( unpack_folder )
-
-
-        with zipfile.ZipFile( new_volume_path, 'w', compression=zipfile.ZIP_DEFLATED, compresslevel=9 ) as z:
-            scan_results = os.listdir( unpack_folder )
-            scan_results = natsorted( scan_results, alg=ns.IGNORECASE )
-            for file in scan_results:
-                z.write( os.path.join( unpack_folder, file ), file )
-
-
-        shutil.rmtree( unpack_folder, ignore_errors=True )
-        volume.filename = new_volume_filename
\ No newline at end of file
+    def appendSolidVolumeFile(
+        self: Self,
+        volume: MangaVolume,
+        volume_path: str,
+        chapters: List[ MangaChapter ]
+    ) -> bool:
+
+        with zipfile.ZipFile( volume_path, 'r' ) as z:
+            exists_names = natsorted( z.namelist(), alg=ns.IGNORECASE )
+
+        sources: List[ tuple ] = []
+        new_names: List[ str ] = []
+
+        for chapter in chapters:
+            chapter_path = os.path.join( volume.path, chapter.filename )
+            with zipfile.ZipFile( chapter_path, 'r' ) as src:
+                entries = [ x for x in src.infolist() if not x.is_dir() ]
+            entries = natsorted( entries, key=lambda x: x.filename, alg=ns.IGNORECASE )
+            sources.append( ( chapter_path, entries ) )
+            new_names.extend( [ x.filename for x in entries ] )
+
+        # pages must stay in reading order, so new pages have to sort after existing ones
+        if len( set( new_names ) ) != len( new_names ) or set( new_names ) & set( exists_names ):
+            return False
+        if natsorted( exists_names + new_names, alg=ns.IGNORECASE ) != exists_names + new_names:
+            return False
+
+        with zipfile.ZipFile( volume_path, 'a' ) as dst:
+            for chapter_path, entries in sources:
+                with zipfile.ZipFile( chapter_path, 'r' ) as src:
+                    copy_raw_entries( src, dst, entries )
+
+        self.log.info(f"Appended {len( chapters )} chapters to {volume_path}")
+
+        return True
@@ -0,0 +1,109 @@
+from __future__ import annotations
+
+import os
+import ujson
+from typing import Self, List, Dict, Set
+from app import models
+
+# Signature of a single fs entry: [ size, mtime_ns, inode ], size of folders is -1
+Snapshot = Dict[ str, List[ int ] ]
+
+# Temporary folders of recompressor must not affect the snapshot
+SKIP_PREFIXES = ( 'temp_', )
+
+
+def stat_tree(
+    root_dir: str,
+    folder: str
+) -> Snapshot:
+    snapshot: Snapshot = {}
+    scan_path = os.path.join( root_dir, folder )
+
+    def walk( path: str, rel: str ) -> None:
+        try:
+            entries = list( os.scandir( path ) )
+        except OSError:
+            return
+        for entry in entries:
+            if entry.name.startswith( SKIP_PREFIXES ):
+                continue
+            entry_rel = f'{rel}/{entry.name}' if rel else entry.name
+            try:
+                stat = entry.stat( follow_symlinks=False )
+            except OSError:
+                continue
+            if entry.is_dir( follow_symlinks=False ):
+                snapshot[ entry_rel ] = [ -1, stat.st_mtime_ns, stat.st_ino ]
+                walk( entry.path, entry_rel )
+            else:
+                snapshot[ entry_rel ] = [ stat.st_size, stat.st_mtime_ns, stat.st_ino ]
+
+    try:
+        stat = os.stat( scan_path )
+        snapshot[ '.' ] = [ -1, stat.st_mtime_ns, stat.st_ino ]
+    except OSError:
+        return snapshot
+
+    walk( scan_path, '' )
+
+    return snapshot
+
+
+def changed_subtrees(
+    old: Snapshot,
+    new: Snapshot
+) -> Set[ str ] | None:
+    # None - title itself is unchanged,
+    # set of top level folders (volumes / seasons) otherwise
+    if old == new:
+        return None
+
+    changed: Set[ str ] = set()
+
+    for key in old.keys() | new.keys():
+        if old.get( key ) == new.get( key ):
+            continue
+        if '/' in key:
+            changed.add( key.split( '/', 1 )[0] )
+        elif key != '.' and key in new and new[ key ][0] == -1:
+            changed.add( key )
+
+    # only folders that still exist can be scanned
+    return set( [ x for x in changed if x in new and new[ x ][0] == -1 ] )
+
+
+class ScanManifest:
+    path: str = ""
+    titles: Dict[ str, Snapshot ] = {}
+
+    def __init__( self: Self, name: str ) -> None:
+        self.path = os.path.join( models.CACHE_FS_PATH, f'{name}.manifest.json' )
+        self.titles = {}
+
+    def load( self: Self ) -> None:
+        if os.path.exists( self.path ):
+            with open( self.path, "r", encoding="utf-8" ) as f:
+                try:
+                    data = ujson.loads( f.read() )
+                    if "titles" in data:
+                        self.titles = data["titles"]
+                except:
+                    self.titles = {}
+
+    def save( self: Self ) -> None:
+        os.makedirs( models.CACHE_FS_PATH, exist_ok=True )
+        temp_path = f'{self.path}.tmp'
+        with open( temp_path, "w", encoding="utf-8" ) as f:
+            f.write( ujson.dumps( { "titles": self.titles }, ensure_ascii=False ) )
+        os.replace( temp_path, self.path )
+
+    def get( self: Self, title: str ) -> Snapshot:
+        return self.titles.get( title, {} )
+
+    def set( self: Self, title: str, snapshot: Snapshot ) -> None:
+        self.titles[ title ] = snapshot
+
+    def keep( self: Self, titles: List[ str ] ) -> None:
+        # drop titles that are gone from the disk
+        alive = set( titles )
+        self.titles = { x:y for x,y in self.titles.items() if x in alive }
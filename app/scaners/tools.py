@@ -1,4 +1,8 @@
+from __future__ import annotations
+
 import os
+import ujson
+from typing import Self, Set, Dict, Any
 from pymediainfo import MediaInfo
 from sqlalchemy import func, select, exists, or_, and_
 from sqlalchemy.orm import Session
@@ -93,4 +97,94 @@ def scan_mediainfo( path: str ) -> dict|None:
                     info['duration'] = str( duration_gen )
                 return info
         return media_info.to_data()
-    return None
\ No newline at end of file
+    return None
+
+
+class MediaInfoCache:
+    path: str = ""
+    # absolute path -> { size, mtime_ns, info }
+    entries: Dict[ str, Dict[ str, Any ] ] = {}
+    used: Set[ str ] = set()
+    hits: int = 0
+    misses: int = 0
+
+    def __init__(
+        self: Self,
+        entries: Dict[ str, Dict[ str, Any ] ] | None = None
+    ) -> None:
+        self.path = os.path.join( models.CACHE_FS_PATH, 'anime.mediainfo.json' )
+        self.entries = entries if entries is not None else {}
+        self.used = set()
+        self.hits = 0
+        self.misses = 0
+
+    def load( self: Self ) -> None:
+        if os.path.exists( self.path ):
+            with open( self.path, "r", encoding="utf-8" ) as f:
+                try:
+                    data = ujson.loads( f.read() )
+                    if "entries" in data:
+                        self.entries = data["entries"]
+                except:
+                    self.entries = {}
+
+    def save( self: Self ) -> None:
+        os.makedirs( models.CACHE_FS_PATH, exist_ok=True )
+        temp_path = f'{self.path}.tmp'
+        with open( temp_path, "w", encoding="utf-8" ) as f:
+            f.write( ujson.dumps( { "entries": self.entries }, ensure_ascii=False ) )
+        os.replace( temp_path, self.path )
+
+    def probe( self: Self, path: str ) -> Dict | None:
+        path = os.path.abspath( path )
+        try:
+            stat = os.stat( path )
+        except OSError:
+            return None
+
+        self.used.add( path )
+
+        entry = self.entries.get( path )
+        if entry and entry['size'] == stat.st_size and entry['mtime_ns'] == stat.st_mtime_ns:
+            self.hits += 1
+            return entry['info']
+
+        self.misses += 1
+        info = scan_mediainfo( path )
+        self.entries[ path ] = {
+            'size': stat.st_size,
+            'mtime_ns': stat.st_mtime_ns,
+            'info': info,
+        }
+        return info
+
+    def split( self: Self, root_dir: str ) -> Dict[ str, Dict[ str, Dict[ str, Any ] ] ]:
+        # group entries by top level title of root_dir, so every worker gets only its own part
+        root_dir = os.path.abspath( root_dir )
+        result: Dict[ str, Dict[ str, Dict[ str, Any ] ] ] = {}
+        for path, entry in self.entries.items():
+            rel = os.path.relpath( path, root_dir )
+            if rel.startswith( '..' ):
+                continue
+            title = rel.split( os.sep, 1 )[0]
+            if title not in result:
+                result[ title ] = {}
+            result[ title ][ path ] = entry
+        return result
+
+    def compact( self: Self ) -> None:
+        # keep only entries looked up during this run
+        self.entries = { x:y for x,y in self.entries.items() if x in self.used }
+
+    def merge( self: Self, other: MediaInfoCache ) -> None:
+        self.entries.update( other.entries )
+        self.used.update( other.used )
+        self.hits += other.hits
+        self.misses += other.misses
+
+    def stats( self: Self ) -> Dict[ str, int ]:
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'entries': len( self.entries ),
+        }
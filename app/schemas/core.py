@@ -30,6 +30,8 @@ class Translator(ShortData):
 class Cover(BaseModel):
     full: str = Field(validation_alias='cover_link_full')
     mini: str = Field(validation_alias='cover_link_mini')
+    card: str = Field(validation_alias='cover_link_card')
+    sources: Dict[ str, Dict[ str, str ] ] = Field(validation_alias='cover_sources')
 
     class Config:
         from_attributes = True
@@ -37,7 +39,10 @@ class Cover(BaseModel):
 class SearchResponse(BaseModel):
     anime: List[ SearchResult ] = []
     manga: List[ SearchResult ] = []
+    ranobe: List[ SearchResult ] = []
     found: int = 0
+    # milliseconds per backend, only with SEARCH_DEBUG
+    timings: Dict[ str, float ] | None = None
 
 class SearchResult(BaseModel):
     name: str = ""
@@ -0,0 +1,291 @@
+import re
+import time
+import asyncio
+from collections import defaultdict
+from typing import Self, List, Dict, Tuple, Set, Any
+from sqlalchemy import select
+
+from app import models
+from app import schemas
+from app.db import ADB, RD
+from app.cache import CACHE_KEYS, get_catalog_version, index_expired
+
+SUGGEST_MODELS = {
+    'anime': models.Anime,
+    'manga': models.Manga,
+    'ranobe': models.Ranobe,
+}
+# columns differ between media tables, whatever exists is indexed
+SUGGEST_FIELDS = ( 'name', 'eng_name', 'title', 'rus_title' )
+
+SUGGEST_LIMIT = 10
+# share of query trigrams candidate must have, lower is more typo tolerant
+SUGGEST_MIN_SCORE = 0.3
+# postings longer than this are only counted when query has nothing rarer
+SUGGEST_COMMON_POSTING = 2000
+# versions are also checked periodically, pub/sub messages can be lost on reconnect
+SUGGEST_CHECK_INTERVAL = 60
+
+non_word = re.compile( r'[^\w]+' )
+
+
+def normalize(
+    value: str
+) -> str:
+    return ' '.join( non_word.sub( ' ', value.casefold().replace( 'ё', 'е' ) ).split() )
+
+
+def trigrams(
+    value: str,
+    partial: bool = False
+) -> Set[ str ]:
+    # words are padded, so short prefixes still produce grams matching word starts;
+    # last word of typed query is unfinished and gets no end padding
+    result = set()
+    words = value.split()
+    for i, word in enumerate( words ):
+        padded = f'  {word}' if partial and i == len( words ) - 1 else f'  {word} '
+        for x in range( len( padded ) - 2 ):
+            result.add( padded[ x:x+3 ] )
+    return result
+
+
+class SuggestIndex:
+
+    # doc id -> ( media, slug, normalized name, grams count )
+    docs: Dict[ int, Tuple[ str, str, str, int ] ]
+    postings: Dict[ str, Set[ int ] ]
+    # ( media, slug ) -> ( indexed names, result payload, doc ids )
+    entries: Dict[ Tuple[ str, str ], Tuple[ Tuple[ str, ... ], Dict[ str, str ], List[ int ] ] ]
+    versions: Dict[ str, int ]
+    # media -> monotonic time of last load
+    loaded: Dict[ str, float ]
+    next_id: int
+
+    def __init__(
+        self: Self
+    ) -> None:
+        self.docs = {}
+        self.postings = defaultdict( set )
+        self.entries = {}
+        self.versions = {}
+        self.loaded = {}
+        self.next_id = 0
+
+
+    def add(
+        self: Self,
+        media: str,
+        slug: str,
+        names: Tuple[ str, ... ],
+        payload: Dict[ str, str ]
+    ) -> None:
+        ids = []
+        for name in names:
+            grams = trigrams( name )
+            if not grams:
+                continue
+            doc_id = self.next_id
+            self.next_id += 1
+            self.docs[ doc_id ] = ( media, slug, name, len( grams ) )
+            for gram in grams:
+                self.postings[ gram ].add( doc_id )
+            ids.append( doc_id )
+        self.entries[ ( media, slug ) ] = ( names, payload, ids )
+
+
+    def remove(
+        self: Self,
+        media: str,
+        slug: str
+    ) -> None:
+        entry = self.entries.pop( ( media, slug ), None )
+        if entry is None:
+            return
+        for doc_id in entry[2]:
+            _, _, name, _ = self.docs.pop( doc_id )
+            for gram in trigrams( name ):
+                posting = self.postings.get( gram )
+                if posting is not None:
+                    posting.discard( doc_id )
+                    if not posting:
+                        del self.postings[ gram ]
+
+
+    def apply(
+        self: Self,
+        media: str,
+        rows: Dict[ str, Tuple[ Tuple[ str, ... ], Dict[ str, str ] ] ]
+    ) -> int:
+        # only titles that appeared, disappeared or were renamed touch postings
+        changed = 0
+        for media_slug in [ x for x in self.entries.keys() if x[0] == media and x[1] not in rows ]:
+            self.remove( *media_slug )
+            changed += 1
+        for slug, ( names, payload ) in rows.items():
+            entry = self.entries.get( ( media, slug ) )
+            if entry is not None:
+                if entry[0] == names:
+                    if entry[1] != payload:
+                        self.entries[ ( media, slug ) ] = ( names, payload, entry[2] )
+                    continue
+                self.remove( media, slug )
+            self.add( media, slug, names, payload )
+            changed += 1
+        return changed
+
+
+    def search(
+        self: Self,
+        query: str,
+        limit: int = SUGGEST_LIMIT,
+        media: str | None = None
+    ) -> List[ Dict[ str, str ] ]:
+        query = normalize( query )
+        grams = trigrams( query, partial=True )
+        if not grams:
+            return []
+
+        postings = sorted( [ self.postings[ x ] for x in grams if x in self.postings ], key=len )
+        if not postings:
+            return []
+
+        counts: Dict[ int, int ] = defaultdict( int )
+        counted = 0
+        for i, posting in enumerate( postings ):
+            if i > 0 and len( posting ) > SUGGEST_COMMON_POSTING:
+                break
+            counted += 1
+            for doc_id in posting:
+                counts[ doc_id ] += 1
+        # common grams do not bring candidates, but still count for the ones found
+        common = postings[ counted: ]
+
+        # best scoring name of every title
+        best: Dict[ Tuple[ str, str ], float ] = {}
+        for doc_id, shared in counts.items():
+            doc_media, slug, name, size = self.docs[ doc_id ]
+            if media and doc_media != media:
+                continue
+            for posting in common:
+                if doc_id in posting:
+                    shared += 1
+            if shared / len( grams ) < SUGGEST_MIN_SCORE:
+                continue
+            score = shared / ( len( grams ) + size - shared )
+            if name.startswith( query ):
+                score += 1
+            elif f' {query}' in f' {name}':
+                score += 0.5
+            key = ( doc_media, slug )
+            if score > best.get( key, 0 ):
+                best[ key ] = score
+
+        top = sorted( best.items(), key=lambda x: ( -x[1], x[0][1] ) )[ :limit ]
+        return [ self.entries[ key ][1] for key, _ in top ]
+
+
+suggest_index = SuggestIndex()
+
+
+def search_cover(
+    item: Any
+) -> str:
+    # same choice crud search makes
+    cover = getattr( item, 'cover', None )
+    if not cover:
+        covers = getattr( item, 'all_covers', None )
+        cover = covers[0] if covers else None
+    if not cover:
+        return ''
+    return cover.cover_link_mini if cover.cover_link_mini != '' else cover.cover_link_full
+
+
+async def load_rows(
+    media: str
+) -> Dict[ str, Tuple[ Tuple[ str, ... ], Dict[ str, str ] ] ]:
+    model = SUGGEST_MODELS[ media ]
+    rows = {}
+
+    session = ADB()
+
+    items = ( await session.execute( select( model ) ) ).scalars().all()
+
+    # relationships are loaded lazily, that needs sync session context
+    def collect( _ ) -> None:
+        for item in items:
+            values = [ getattr( item, x, None ) or '' for x in SUGGEST_FIELDS ]
+            names = tuple( dict.fromkeys( [ x for x in [ normalize( str( x ) ) for x in values ] if x ] ) )
+            if not names:
+                continue
+            result = schemas.SearchResult()
+            result.type = media
+            result.name = getattr( item, 'name', None ) or getattr( item, 'rus_title', None ) or ''
+            result.eng_name = getattr( item, 'eng_name', None ) or getattr( item, 'title', None ) or ''
+            result.slug = item.slug
+            result.cover = search_cover( item )
+            rows[ item.slug ] = ( names, result.model_dump() )
+
+    await session.run_sync( collect )
+
+    await session.close()
+
+    return rows
+
+
+async def refresh_media(
+    media: str
+) -> None:
+    version = await get_catalog_version( media )
+    if suggest_index.versions.get( media ) == version and not index_expired( media, suggest_index.loaded.get( media, 0 ) ):
+        return
+    start = time.perf_counter()
+    rows = await load_rows( media )
+    changed = suggest_index.apply( media, rows )
+    suggest_index.versions[ media ] = version
+    suggest_index.loaded[ media ] = time.monotonic()
+    print(f"Suggest index: {media} v{version}, {changed} titles changed, {len( rows )} total, {time.perf_counter() - start:.2f}s")
+
+
+async def refresh_all() -> None:
+    for media in SUGGEST_MODELS.keys():
+        try:
+            await refresh_media( media )
+        except Exception as e:
+            print(f"Suggest index refresh of {media} failed: {e}")
+
+
+async def run_suggest_index() -> None:
+    # index is per worker, same as memory cache, and follows catalog announcements
+    while True:
+        try:
+            pubsub = RD.pubsub()
+            await pubsub.subscribe( CACHE_KEYS['channel'] )
+            await refresh_all()
+            while True:
+                message = await pubsub.get_message( ignore_subscribe_messages=True, timeout=SUGGEST_CHECK_INTERVAL )
+                if message is None:
+                    await refresh_all()
+                elif message['type'] == 'message' and message['data'] in SUGGEST_MODELS:
+                    await refresh_media( message['data'] )
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            print(f"Suggest index listener error: {e}")
+            await asyncio.sleep( 1 )
+
+
+def suggest(
+    query: str,
+    limit: int = SUGGEST_LIMIT
+) -> Dict[ str, Any ]:
+    result = {
+        "anime": [],
+        "manga": [],
+        "ranobe": [],
+        "found": 0
+    }
+    for item in suggest_index.search( query, limit ):
+        result[ item['type'] ].append( item )
+        result['found'] += 1
+    return result
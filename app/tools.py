@@ -1,6 +1,8 @@
 import re
 import os
 import json
+import base64
+import orjson
 import hashlib
 import shutil
 import filecmp
@@ -59,23 +61,13 @@ def save_cover(
     source_file: str,
     filename: str
 ) -> bool:
-    
-    sub = filename[0:2]
-
-    full_target_folder = os.path.join( models.COVERS_FS_PATH, 'full', sub )
-    mini_target_folder = os.path.join( models.COVERS_FS_PATH, 'mini', sub )
-
+    # only the original is copied here, sized variants are rendered by render_cover_variants
+    full_target_folder = os.path.join( models.COVERS_FS_PATH, 'full', filename[0:2] )
     full_target_file = os.path.join( full_target_folder, filename )
-    mini_target_file = os.path.join( mini_target_folder, filename )
 
     if not os.path.exists( full_target_folder ):
         os.makedirs( full_target_folder, exist_ok=True )
 
-    if not os.path.exists( mini_target_folder ):
-        os.makedirs( mini_target_folder, exist_ok=True )
-
-    full = True
-
     source_file_size = os.path.getsize( source_file )
     target_file_size = 0
 
@@ -86,18 +78,41 @@ def save_cover(
         try:
             shutil.copy( source_file, full_target_file )
         except:
-            full = False
-    
-    if full and not ( os.path.exists( mini_target_file ) and target_file_size == source_file_size ):
+            return False
 
-        with Image.open( full_target_file ) as img_src:
-            img_src.thumbnail( ( 350, 500 ) )
-            try:
-                img_src.save( mini_target_file, optimize=True )
-            except:
-                pass
+    return True
 
-    return full
+def cover_formats() -> list[str]:
+    # avif needs pillow >= 11.2 (or pillow-avif-plugin)
+    return [ x for x in models.COVER_FORMATS if f'.{x}' in Image.registered_extensions() ]
+
+def render_cover_variants(
+    filename: str
+) -> int:
+    # runs in cover worker pool, returns models.COVER_FORMAT_FLAGS of rendered formats
+    source_file = os.path.join( models.COVERS_FS_PATH, 'full', filename[0:2], filename )
+    stem, _ = os.path.splitext( source_file )
+
+    flags = 0
+    formats = cover_formats()
+
+    for size, box in models.COVER_VARIANTS.items():
+        try:
+            with Image.open( source_file ) as img_src:
+                # jpeg decoder scales down by 1/2..1/8 while decoding, much cheaper than full decode + resize
+                img_src.draft( 'RGB', box )
+                img = img_src.convert( 'RGBA' if img_src.mode in ( 'RGBA', 'LA', 'P' ) else 'RGB' )
+            img.thumbnail( box, Image.Resampling.LANCZOS )
+            for format in formats:
+                img.save( f'{stem}.{size}.{format}', **models.COVER_FORMAT_OPTIONS[ format ] )
+        except Exception as e:
+            print(f"Cover {filename} {size} failed: {e}")
+            return 0
+
+    for format in formats:
+        flags |= models.COVER_FORMAT_FLAGS[ format ]
+
+    return flags
 
 def calculate_file_hash(
     path: str
@@ -121,6 +136,23 @@ def calculate_hash(
         pass
     return hash.hexdigest()
 
+def encode_cursor(
+    position: dict
+) -> str:
+    # opaque for clients, they only pass it back
+    return base64.urlsafe_b64encode( orjson.dumps( position ) ).decode().rstrip('=')
+
+def decode_cursor(
+    cursor: str | None
+) -> dict:
+    if not cursor:
+        return {}
+    try:
+        position = orjson.loads( base64.urlsafe_b64decode( cursor + '=' * ( -len( cursor ) % 4 ) ) )
+        return position if isinstance( position, dict ) else {}
+    except:
+        return {}
+
 def parse_query(
     payload: Any,
     ignore: list[str] = []
@@ -0,0 +1,109 @@
+import asyncio
+from typing import List, Tuple, Callable, Awaitable, Any
+
+from app.db import RD
+from app.cache import CACHE_KEYS, SINGLE_TTL, READER_TTL, warm
+from app.crud import manga as manga_crud
+from app.crud import anime as anime_crud
+from app.crud import ranobe as ranobe_crud
+
+WARM_CONCURRENCY = 4
+# first pages of unfiltered lists, the rest is built on demand
+WARM_LIST_PAGES = 3
+WARM_LIST_LIMIT = 50
+WARM_SPOP_COUNT = 500
+
+
+def single_targets(
+    media: str,
+    slugs: List[ str ]
+) -> List[ Tuple[ str, Callable[ [], Awaitable[ Any ] ], int | None ] ]:
+    # ( cache key, builder, ttl ) of detail payloads
+    targets = []
+    for slug in slugs:
+        if media == 'manga':
+            targets.append( ( manga_crud.MANGA_CACHE_KEYS['single'].format( slug ), lambda slug=slug: manga_crud.build_single( slug ), SINGLE_TTL ) )
+            # reader navigation is materialized here and refreshed on next change
+            targets.append( ( manga_crud.MANGA_CACHE_KEYS['reader'].format( slug ), lambda slug=slug: manga_crud.build_reader( slug ), READER_TTL ) )
+        elif media == 'ranobe':
+            targets.append( ( ranobe_crud.MANGA_CACHE_KEYS['single'].format( slug ), lambda slug=slug: ranobe_crud.build_single( slug ), SINGLE_TTL ) )
+            targets.append( ( ranobe_crud.MANGA_CACHE_KEYS['reader'].format( slug ), lambda slug=slug: ranobe_crud.build_reader( slug ), ranobe_crud.RANOBE_CACHE_TTL ) )
+        elif media == 'anime':
+            if '/' in slug:
+                anime_slug, season_slug = slug.split( '/', 1 )
+                targets.append( ( anime_crud.ANIME_CACHE_KEYS['season'].format( anime_slug, season_slug ), lambda a=anime_slug, s=season_slug: anime_crud.build_season( a, s ), None ) )
+            else:
+                targets.append( ( anime_crud.ANIME_CACHE_KEYS['single'].format( slug ), lambda slug=slug: anime_crud.build_single( slug ), SINGLE_TTL ) )
+    return targets
+
+
+def catalog_targets(
+    media: str
+) -> List[ Tuple[ str, Callable[ [], Awaitable[ Any ] ], int | None ] ]:
+    if media == 'manga':
+        return [ ( manga_crud.MANGA_CACHE_KEYS['filters'], manga_crud.build_filters, None ) ]
+    if media == 'anime':
+        return [ ( anime_crud.ANIME_CACHE_KEYS['filters'], anime_crud.build_filters, None ) ]
+    if media == 'ranobe':
+        return [ ( ranobe_crud.MANGA_CACHE_KEYS['filters'], ranobe_crud.build_filters, ranobe_crud.RANOBE_CACHE_TTL ) ]
+    return []
+
+
+async def pop_changed(
+    media: str
+) -> List[ str ]:
+    slugs = []
+    key = CACHE_KEYS['changed'].format( media )
+    while True:
+        chunk = await RD.spop( key, WARM_SPOP_COUNT )
+        if not chunk:
+            break
+        slugs.extend( chunk )
+    return slugs
+
+
+async def warm_changed(
+    media: str,
+    progress: Callable[ [ str, int, int ], None ] | None = None
+) -> int:
+    # rebuild payloads of titles changed by last scan, so first visitors do not pay for it
+    slugs = await pop_changed( media )
+    if not slugs:
+        return 0
+
+    targets = single_targets( media, slugs ) + catalog_targets( media )
+
+    if media == 'manga':
+        get_list = manga_crud.get_list
+    elif media == 'anime':
+        get_list = anime_crud.get_list
+    else:
+        get_list = ranobe_crud.get_list
+
+    total = len( targets ) + WARM_LIST_PAGES
+    done = 0
+    semaphore = asyncio.Semaphore( WARM_CONCURRENCY )
+
+    async def run( job: Awaitable[ Any ], name: str ) -> None:
+        nonlocal done
+        async with semaphore:
+            try:
+                await job
+            except Exception as e:
+                print(f"Cache warm of {name} failed: {e}")
+        done += 1
+        if progress:
+            progress( 'warm', done, total )
+
+    jobs = [ run( warm( key, build, ttl ), key ) for key, build, ttl in targets ]
+    # list pages are keyed by current catalog version, so get_list stores them
+    jobs += [ run( get_list( page * WARM_LIST_LIMIT, WARM_LIST_LIMIT, {} ), f'{media} list page {page}' ) for page in range( WARM_LIST_PAGES ) ]
+
+    await asyncio.gather( *jobs )
+
+    # workers could have copied old payloads into memory between bump and warm up
+    await RD.publish( CACHE_KEYS['channel'], media )
+
+    print(f"Warmed {len( targets )} {media} payloads and {WARM_LIST_PAGES} list pages")
+
+    return len( targets )
@@ -0,0 +1,129 @@
+import os
+import time
+import asyncio
+from typing import Self, List, Dict, Tuple
+from watchfiles import awatch
+
+from app import models
+from app.jobs import enqueue_scan
+from app.scaners.manifest import ScanManifest, SKIP_PREFIXES, stat_tree
+
+WATCH_ROOTS = {
+    'manga': models.MANGA_FS_PATH,
+    'anime': models.ANIME_FS_PATH,
+}
+
+# seconds of silence in title folder before rescan is queued
+WATCH_DEBOUNCE = float( os.environ.get( 'WATCH_DEBOUNCE', 5 ) )
+# inotify events are not delivered through docker bind mounts of windows drives
+WATCH_POLLING = os.environ.get( 'WATCH_POLLING', '' ) in [ '1', 'true', 'yes' ]
+WATCH_POLL_DELAY = 2000
+
+
+class LibraryWatcher:
+
+    # ( media, title ) -> deadline
+    pending: Dict[ Tuple[ str, str ], float ]
+    polling: bool
+
+    def __init__(
+        self: Self,
+        polling: bool = WATCH_POLLING
+    ) -> None:
+        self.pending = {}
+        self.polling = polling
+
+
+    async def run(
+        self: Self
+    ) -> None:
+        roots = [ x for x in WATCH_ROOTS.values() if os.path.isdir( x ) ]
+        if not roots:
+            return
+
+        flusher = asyncio.create_task( self.flush() )
+        try:
+            while True:
+                try:
+                    await self.watch( roots )
+                except asyncio.CancelledError:
+                    raise
+                except Exception as e:
+                    # e.g. inotify watch limit reached, stat polling works everywhere
+                    if self.polling:
+                        raise
+                    print(f"Watcher failed, switching to polling: {e}")
+                    self.polling = True
+        finally:
+            flusher.cancel()
+
+
+    async def watch(
+        self: Self,
+        roots: List[ str ]
+    ) -> None:
+        print(f"Watching {', '.join( roots )}{' (polling)' if self.polling else ''}")
+        async for changes in awatch(
+            *roots,
+            force_polling=self.polling,
+            poll_delay_ms=WATCH_POLL_DELAY,
+            recursive=True
+        ):
+            for _, path in changes:
+                target = self.resolve( path )
+                if target:
+                    self.pending[ target ] = time.monotonic() + WATCH_DEBOUNCE
+
+
+    def resolve(
+        self: Self,
+        path: str
+    ) -> Tuple[ str, str ] | None:
+        # map any changed path to top level title folder
+        for media, root in WATCH_ROOTS.items():
+            rel = os.path.relpath( path, root )
+            if rel == '.' or rel.startswith( '..' ):
+                continue
+            parts = rel.split( os.sep )
+            if any( x.startswith( SKIP_PREFIXES ) for x in parts ):
+                return None
+            return ( media, parts[0] )
+        return None
+
+
+    async def flush(
+        self: Self
+    ) -> None:
+        while True:
+            await asyncio.sleep( 1 )
+            now = time.monotonic()
+            ready = [ x for x, deadline in self.pending.items() if deadline <= now ]
+            for target in ready:
+                self.pending.pop( target, None )
+                media, title = target
+                try:
+                    if await asyncio.to_thread( self.unchanged, media, title ):
+                        continue
+                    print(f"Watcher: {media} {title} changed, queueing rescan")
+                    await enqueue_scan( media, title )
+                except Exception as e:
+                    print(f"Watcher failed to queue {media} {title}: {e}")
+
+
+    def unchanged(
+        self: Self,
+        media: str,
+        title: str
+    ) -> bool:
+        # recompressor rewrites files of the title it scans,
+        # manifest stores state after that, so own writes do not loop
+        if media != 'manga':
+            return False
+        manifest = ScanManifest( media )
+        manifest.load()
+        known = manifest.get( title )
+        return bool( known ) and known == stat_tree( WATCH_ROOTS[ media ], title )
+
+
+async def run_watcher() -> None:
+    await LibraryWatcher().run()
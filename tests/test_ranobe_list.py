@@ -0,0 +1,77 @@
+import orjson
+import pytest
+from fastapi.testclient import TestClient
+
+from app.crud import ranobe as ranobe_crud
+from app.handlers.ranobe import ranobe
+from app.tools import encode_cursor
+
+
+class FakeRedis:
+
+    def __init__( self ) -> None:
+        self.values = {}
+
+    async def get( self, key ):
+        return self.values.get( key )
+
+    async def set( self, key, value, ttl=None ):
+        self.values[ key ] = value
+
+
+class FakeResult:
+
+    def scalars( self ):
+        return self
+
+    def all( self ):
+        return []
+
+
+class FakeSession:
+
+    async def execute( self, query ):
+        return FakeResult()
+
+    async def run_sync( self, fn ):
+        return fn( None )
+
+    async def close( self ):
+        pass
+
+
+@pytest.fixture
+def client( monkeypatch ):
+    keys = []
+
+    async def list_cache_key( prefix, media, offset, limit, filters ):
+        keys.append( ( offset, limit, dict( filters ) ) )
+        return f'{prefix}-{len( keys )}'
+
+    async def facet_counts( media, filters ):
+        return { 'total': 0, 'facets': {} }
+
+    monkeypatch.setattr( ranobe_crud, 'RD', FakeRedis() )
+    monkeypatch.setattr( ranobe_crud, 'ADB', FakeSession )
+    monkeypatch.setattr( ranobe_crud, 'list_cache_key', list_cache_key )
+    monkeypatch.setattr( ranobe_crud, 'facet_counts', facet_counts )
+
+    test_client = TestClient( ranobe )
+    test_client.keys = keys
+    return test_client
+
+
+def test_list_offset_mode( client ):
+    response = client.get( '/list', params={ 'offset': 50, 'limit': 10 } )
+    assert response.status_code == 200
+    assert orjson.loads( response.content ) == []
+    assert client.keys == [ ( 50, 10, {} ) ]
+
+
+def test_list_cursor_mode( client ):
+    cursor = encode_cursor( { 'n': 'a', 'i': 1 } )
+    response = client.get( '/list', params={ 'limit': 10, 'cursor': cursor } )
+    assert response.status_code == 200
+    assert orjson.loads( response.content ) == { 'items': [], 'next': None, 'facets': { 'total': 0, 'facets': {} } }
+    # pages of different cursors must not share cache key
+    assert client.keys == [ ( 0, 10, { 'cursor': cursor } ) ]
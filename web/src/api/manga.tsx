@@ -5,6 +5,8 @@ import {
     ReaderManga,
 } from "@/types/manga"
 import { loadData, setCached, getCached } from "@/api/general"
+import { uniqueNavigationChapters } from "@/api/reader"
+import { ReaderNavigationDocument, ReaderMangaNavigationTuple } from "@/types/reader"
 
 // 
 
@@ -84,10 +86,24 @@ export async function loadMangaSingle( path: string ): Promise<MangaSingle|null>
 
 export async function loadReaderManga(manga_slug: string): Promise<ReaderManga|null>
 {
-    return loadData<ReaderManga>( `/manga/${manga_slug}/reader` )
+    return loadData<ReaderNavigationDocument<ReaderMangaNavigationTuple>>( `/manga/${manga_slug}/reader` )
         .then(
             (response) => {
-                return response
+                return {
+                    id: response.id,
+                    name: response.name,
+                    eng_name: response.eng_name,
+                    slug: response.slug,
+                    timestamp: response.timestamp,
+                    chapters: uniqueNavigationChapters( response.navigation ).map(
+                        (element) => ({
+                            volume_number: element[0],
+                            number: element[1],
+                            filesize: element[6],
+                            download_path: element[7],
+                        })
+                    ),
+                } as ReaderManga
             }
         )
         .catch(
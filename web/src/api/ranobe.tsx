@@ -6,6 +6,8 @@ import {
     ReaderRanobeChapter,
 } from "@/types/ranobe"
 import { loadData, setCached, getCached } from "@/api/general"
+import { uniqueNavigationChapters } from "@/api/reader"
+import { ReaderNavigationDocument } from "@/types/reader"
 
 // 
 
@@ -93,10 +95,25 @@ export async function loadRanobeReader(
     ranobe_slug: string
 ): Promise<ReaderRanobe|null>
 {
-    return loadData<ReaderRanobe>( `/ranobe/${ranobe_slug}/reader` )
+    return loadData<ReaderNavigationDocument>( `/ranobe/${ranobe_slug}/reader` )
         .then(
             (response) => {
-                return response
+                return {
+                    id: response.id,
+                    name: response.name,
+                    eng_name: response.eng_name,
+                    slug: response.slug,
+                    timestamp: response.timestamp,
+                    navigation: uniqueNavigationChapters( response.navigation ).map(
+                        (element) => ({
+                            id: element[2],
+                            volume_number: element[0],
+                            number: element[1],
+                            name: element[3],
+                            eng_name: '',
+                        })
+                    ),
+                } as ReaderRanobe
             }
         )
         .catch(
@@ -1,4 +1,4 @@
-import { DefaultReaderSettings, ReaderSettings } from "@/types/reader"
+import { DefaultReaderSettings, ReaderSettings, ReaderNavigationTuple } from "@/types/reader"
 import { getCached, setCached } from "@/api/general"
 import { mergeDeep } from "../tools/general"
 
@@ -18,4 +18,20 @@ export function getReaderSettings(): ReaderSettings
 export function setReaderSettings(settings: any)
 {
     setCached( 'reader_settings', settings )
-}
\ No newline at end of file
+}
+
+// server sends one tuple per chapter and branch, reader works with unique chapters
+export function uniqueNavigationChapters<T extends ReaderNavigationTuple>( navigation: T[] ): T[]
+{
+    let seen = new Set<number>()
+    return navigation.filter(
+        (element) => {
+            if( seen.has( element[2] ) )
+            {
+                return false
+            }
+            seen.add( element[2] )
+            return true
+        }
+    )
+}
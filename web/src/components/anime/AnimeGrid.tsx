@@ -74,7 +74,7 @@ function AnimeCard({
                                     (cover) => {
                                         return (
                                             <SwiperSlide key={ cover.full }>
-                                                <img className="w-full h-full object-cover object-center" src={`${cover.mini?cover.mini:cover.full}`} loading="lazy" alt="" />
+                                                <img className="w-full h-full object-cover object-center" src={`${cover.card?cover.card:cover.full}`} loading="lazy" alt="" />
                                             </SwiperSlide>
                                         )
                                     }
@@ -83,7 +83,7 @@ function AnimeCard({
                         </div>
                     ) : (
                         anime?.cover ? (
-                            <img className="absolute z-[1] top-0 left-0 w-full h-full object-cover object-center" src={`${anime.cover.mini?anime.cover.mini:anime.cover.full}`} alt="" />
+                            <img className="absolute z-[1] top-0 left-0 w-full h-full object-cover object-center" src={`${anime.cover.card?anime.cover.card:anime.cover.full}`} alt="" />
                         ) : (
                             <></>
                         )
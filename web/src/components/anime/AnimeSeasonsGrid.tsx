@@ -34,7 +34,7 @@ function AnimeSeasonCard({
             <NavLink className="inline-flex flex-col w-full group cursor-pointer" to={season_link}>
                 <div className="flex pt-[133%] flex-col bg-white/10 rounded-md relative overflow-hidden">
                     { season?.cover && (
-                    <img className="absolute z-[1] top-0 left-0 w-full h-full object-cover object-center" src={`${season.cover.mini?season.cover.mini:season.cover.full}`} alt="" />
+                    <img className="absolute z-[1] top-0 left-0 w-full h-full object-cover object-center" src={`${season.cover.card?season.cover.card:season.cover.full}`} alt="" />
                     ) }
                     { season?.meta?.status && (
                     <div className="absolute z-[2] right-2 bottom-2 px-2 py-1 text-xs text-white bg-sky-700 rounded-md">{season?.meta?.status}</div>
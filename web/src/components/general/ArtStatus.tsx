@@ -20,7 +20,7 @@ export default function ArtStatus({
                             <Loading />
                         </span>
                     ) : (
-                        <img className="absolute z-[1] top-0 left-0 w-full h-full object-cover" src={cover?.mini ? cover?.mini : cover?.full} alt="" />
+                        <img className="absolute z-[1] top-0 left-0 w-full h-full object-cover" src={cover?.card ? cover?.card : cover?.full} alt="" />
                     )}
                     { status ? (
                     <div className="absolute z-[2] right-2 bottom-2 px-2 py-1 text-xs text-white bg-sky-700 rounded-md">{status}</div>
@@ -55,7 +55,7 @@ function RanobeVolumeCard({
             >
                 <div className="flex pt-[133%] flex-col bg-white/10 rounded-md relative overflow-hidden">
                     { volume?.cover && (
-                    <img className="absolute z-[1] top-0 left-0 w-full h-full object-cover object-center" src={`${volume.cover.mini?volume.cover.mini:volume.cover.full}`} alt="" />
+                    <img className="absolute z-[1] top-0 left-0 w-full h-full object-cover object-center" src={`${volume.cover.card?volume.cover.card:volume.cover.full}`} alt="" />
                     ) }
                     { volume?.status && (
                     <div className="absolute z-[2] right-2 bottom-2 px-2 py-1 text-xs text-white bg-sky-700 rounded-md">{volume.status}</div>
@@ -18,6 +18,12 @@ export interface Cover
 {
     full: string
     mini: string
+    card: string
+    sources: {
+        [size: string]: {
+            [format: string]: string
+        }
+    }
 }
 
 export interface SearchResult
@@ -56,6 +62,17 @@ export interface Filterable
     studios?: ShortData[]
     genres?: ShortData[]
     authors?: ShortData[]
+    counts?: FacetCounts
+}
+
+export interface FacetCounts
+{
+    total: number
+    facets: {
+        [index: string]: {
+            [index: string]: number
+        }
+    }
 }
 
 export interface Notification
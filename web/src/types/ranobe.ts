@@ -101,6 +101,11 @@ export interface ReaderRanobeChapter
     content: ReaderRanobeChapterElement[]
     // 
     timestamp: number
+    // content is stored in blocks of nodes, ?block_from=&block_to= selects a range
+    branch?: number
+    blocks?: number
+    block_from?: number
+    block_to?: number
 }
 
 const NodeTypes = [
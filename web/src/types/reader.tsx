@@ -113,6 +113,26 @@ export interface ReaderChapter
     volume_number: number
 }
 
+// ( volume, chapter, chapter id, title, branch id, team id ), one per chapter and branch
+export type ReaderNavigationTuple = [ number, number, number, string, number|null, number|null ]
+
+// manga tuples are followed by ( chapter filesize, chapter download path )
+export type ReaderMangaNavigationTuple = [ ...ReaderNavigationTuple, number, string ]
+
+export interface ReaderNavigationDocument<T extends ReaderNavigationTuple = ReaderNavigationTuple>
+{
+    id: number
+    name: string
+    eng_name: string
+    slug: string
+    timestamp: number
+    fields: string[]
+    navigation: T[]
+    teams: {
+        [index: string]: string
+    }
+}
+
 export interface CachedReader
 {
     data: ReaderVolume